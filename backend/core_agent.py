@@ -4,20 +4,40 @@ Handles the complete flow: greeting -> listen -> intent -> AI/command -> respons
 """
 
 import os
-import json
 import time
 import asyncio
-from typing import Dict, Any, List, Optional, Union
-import requests
+from typing import Dict, Any, List, Optional, Union, Callable, Awaitable
 from datetime import datetime
 
-from backend.speech_processor import SpeechProcessor
+from backend.speech_processor import SpeechProcessor, tts_text_from_response
 from backend.emotion_analyzer import EmotionAnalyzer
 from backend.camera_system import CameraSystem
-from backend.rag_system import RAGSystem
+from backend.rag_system import RAGSystem, RELEVANCE_THRESHOLD
 from backend.learning_tracker import LearningTracker
+from backend.session_manager import SessionManager, StudentSession
 from backend.intent_classifier import IntentClassifier
 from backend.commands.command_executor import CommandExecutor
+from backend.llm.response_cache import SemanticResponseCache, context_fingerprint
+from backend.llm.http_client import LLMRequestError
+from backend.llm.backends import LLMReply, create_backend, mock_reply
+from backend.llm.single_flight import SingleFlight
+from backend.llm.prompt_builder import PromptBuilder
+from backend.rag.query_cache import normalize_query
+
+# Shorter questions ("why?", "and the next one?") depend on the conversation
+# too much to answer from another student's reply
+RESPONSE_CACHE_MIN_WORDS = 3
+
+# Receives each new piece of explanation text while a reply streams in
+DeltaCallback = Callable[[str], Awaitable[None]]
+
+# How long each stage before the LLM call may take before the query goes
+# ahead without it, in milliseconds
+STAGE_DEADLINES_MS = {
+    "emotion": float(os.environ.get("STAGE_DEADLINE_EMOTION_MS", "200")),
+    "learning": float(os.environ.get("STAGE_DEADLINE_LEARNING_MS", "300")),
+    "rag": float(os.environ.get("STAGE_DEADLINE_RAG_MS", "1500"))
+}
 
 class CoreAgent:
     """
@@ -41,9 +61,9 @@ class CoreAgent:
         self.intent_classifier = intent_classifier
         self.command_executor = command_executor
         
-        # OpenRouter API configuration
-        self.openrouter_api_key = os.environ.get("OPENROUTER_API_KEY", "")
-        self.llm_model = "meta-llama/llama-4-maverick:free"
+        # LLM backend for this deployment: OpenRouter or a local GGUF model (LLM_BACKEND)
+        self.llm_backend = create_backend()
+        print(f"Using LLM backend: {self.llm_backend.describe()}")
         
         # System prompt for the AI
         self.system_prompt = """
@@ -74,30 +94,59 @@ class CoreAgent:
         }
         """
         
-        # Conversation state
-        self.conversation_history = []
-        self.current_session = {
-            "start_time": datetime.now(),
-            "topics_covered": [],
-            "student_responses": [],
-            "current_topic": None,
-            "learning_objectives": []
-        }
+        # Every request's context starts with the system prompt, so local
+        # backends can evaluate it once and reuse it
+        self.llm_backend.set_static_prefix(self.system_prompt)
+        
+        # Replies to equivalent questions under the same context, shared by all sessions
+        self.response_cache = None
+        if os.environ.get("LLM_CACHE_ENABLED", "1") != "0":
+            self.response_cache = SemanticResponseCache(
+                self.rag_system.embed_query,
+                similarity_threshold=float(os.environ.get("LLM_CACHE_SIMILARITY", "0.92")),
+                ttl_seconds=float(os.environ.get("LLM_CACHE_TTL", "3600")),
+                max_entries=int(os.environ.get("LLM_CACHE_SIZE", "1024"))
+            )
+        
+        # Time spent in each pre-LLM stage, and how often it missed its deadline
+        self.stage_stats = {name: {"runs": 0, "timeouts": 0, "total_ms": 0.0} for name in STAGE_DEADLINES_MS}
+        
+        # Identical questions arriving together share one LLM call
+        self.llm_in_flight = SingleFlight()
+        
+        # Prompts are filled to a fixed token budget, most important parts first
+        self.prompt_builder = PromptBuilder(
+            self.llm_backend.count_tokens,
+            budget_tokens=int(os.environ.get("LLM_PROMPT_BUDGET", "3000")),
+            max_history_entries=int(os.environ.get("LLM_PROMPT_HISTORY", "6"))
+        )
+        
+        # Conversation and learning state of each student; history is a
+        # ring buffer of the latest entries
+        self.sessions = SessionManager(
+            learning_tracker,
+            data_dir=str(learning_tracker.data_dir),
+            max_active=int(os.environ.get("SESSION_MAX_ACTIVE", "64")),
+            idle_timeout=float(os.environ.get("SESSION_IDLE_TIMEOUT", "1800")),
+            history_size=int(os.environ.get("LLM_HISTORY_SIZE", "40"))
+        )
         
         print("Core Agent initialized successfully")
     
-    async def get_personalized_greeting(self) -> Dict[str, Any]:
+    async def get_personalized_greeting(self, session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Generate a personalized greeting based on learning history and start camera/emotion detection
         """
         try:
+            session = await asyncio.to_thread(self.sessions.get, session_id)
+            
             # Start camera system if available
             if self.camera_system and not self.camera_system.is_running:
                 self.camera_system.start()
                 print("Camera system started for emotion detection")
             
             # Get learning progress
-            progress = self.learning_tracker.get_current_progress()
+            progress = session.tracker.get_current_progress()
             
             # Generate personalized greeting
             if progress.get("total_sessions", 0) == 0:
@@ -114,19 +163,19 @@ class CoreAgent:
             audio_file = self.speech_processor.generate_speech(greeting)
             
             # Start new learning session
-            self.learning_tracker.start_new_session()
+            session.tracker.start_new_session()
             
             return {
                 "greeting": greeting,
                 "audio": f"/tts_output/{audio_file}",
-                "session_id": self.current_session["start_time"].isoformat()
+                "session_id": session_id
             }
             
         except Exception as e:
             print(f"Error generating greeting: {e}")
             return {"error": str(e)}
     
-    async def process_speech_input(self, audio_data: bytes) -> Dict[str, Any]:
+    async def process_speech_input(self, audio_data: bytes, session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Process speech input through the complete AI pipeline
         """
@@ -137,12 +186,13 @@ class CoreAgent:
             print(f"Transcript: {transcript}")
             
             # 2. Process the transcript
-            response = await self.process_text_input(transcript)
+            response = await self.process_text_input(transcript, session_id=session_id)
             
             # 3. Add audio to response if not already present
             if "audio" not in response and "explanation" in response.get("answer", {}):
-                explanation = response["answer"]["explanation"]
-                audio_file = self.speech_processor.generate_speech(explanation)
+                # The answer holds the already parsed reply; speak it without parsing again
+                speech_text = tts_text_from_response(response["answer"]) or response["answer"]["explanation"]
+                audio_file = self.speech_processor.generate_speech(speech_text)
                 response["audio"] = f"/tts_output/{audio_file}"
             
             return response
@@ -151,33 +201,40 @@ class CoreAgent:
             print(f"Error processing speech input: {e}")
             return self._create_error_response(f"Error processing speech: {str(e)}")
     
-    async def process_text_input(self, text: str) -> Dict[str, Any]:
+    async def process_text_input(self, text: str, on_delta: Optional[DeltaCallback] = None,
+                                 session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Process text input through the complete AI pipeline
+        
+        When on_delta is given, explanation text is passed to it as the LLM
+        produces it; the structured response is still returned at the end.
+        session_id selects the student whose history and progress are used.
         """
         try:
             print(f"Processing text input: {text}")
-            
-            # 1. Classify intent
-            intent_result = self.intent_classifier.classify_intent(text)
-            intent_type = intent_result["intent"]
-            confidence = intent_result["confidence"]
-            
-            print(f"Classified intent: {intent_type} (confidence: {confidence})")
-            
-            # 2. Handle based on intent
-            if intent_type == "command" and confidence > 0.7:
-                # Execute command directly
-                return await self._handle_command(text, intent_result)
-            else:
-                # Process as educational query
-                return await self._handle_educational_query(text, intent_result)
+            # Held for the whole request so the session is not evicted under it
+            async with self.sessions.use_async(session_id) as session:
+                # 1. Classify intent
+                intent_result = self.intent_classifier.classify_intent(text)
+                intent_type = intent_result["intent"]
+                confidence = intent_result["confidence"]
+                
+                print(f"Classified intent: {intent_type} (confidence: {confidence})")
+                
+                # 2. Handle based on intent
+                if intent_type == "command" and confidence > 0.7:
+                    # Execute command directly
+                    return await self._handle_command(session, text, intent_result, on_delta)
+                else:
+                    # Process as educational query
+                    return await self._handle_educational_query(session, text, intent_result, on_delta)
                 
         except Exception as e:
             print(f"Error processing text input: {e}")
             return self._create_error_response(f"Error processing input: {str(e)}")
     
-    async def _handle_command(self, text: str, intent_result: Dict[str, Any]) -> Dict[str, Any]:
+    async def _handle_command(self, session: StudentSession, text: str, intent_result: Dict[str, Any],
+                              on_delta: Optional[DeltaCallback] = None) -> Dict[str, Any]:
         """
         Handle command execution
         """
@@ -189,7 +246,7 @@ class CoreAgent:
             
             if command_result["success"]:
                 # Log command execution
-                self.learning_tracker.log_interaction("command", text, command_result["response"])
+                session.tracker.log_interaction("command", text, command_result["response"])
                 
                 return {
                     "question": text,
@@ -203,39 +260,52 @@ class CoreAgent:
             else:
                 # Command failed, fall back to AI processing
                 print("Command execution failed, falling back to AI processing")
-                return await self._handle_educational_query(text, intent_result)
+                return await self._handle_educational_query(session, text, intent_result, on_delta)
                 
         except Exception as e:
             print(f"Error handling command: {e}")
-            return await self._handle_educational_query(text, intent_result)
+            return await self._handle_educational_query(session, text, intent_result, on_delta)
     
-    async def _handle_educational_query(self, text: str, intent_result: Dict[str, Any]) -> Dict[str, Any]:
+    async def _handle_educational_query(self, session: StudentSession, text: str, intent_result: Dict[str, Any],
+                                        on_delta: Optional[DeltaCallback] = None) -> Dict[str, Any]:
         """
         Handle educational queries through AI processing
         """
         try:
             print("Processing as educational query...")
             
-            # 1. Get emotion data for adaptive teaching
-            emotion_data = self._get_current_emotion()
-            
-            # 2. Check if we need to assess student knowledge
-            knowledge_assessment = await self._assess_knowledge_if_needed(text)
+            # 1-3. Emotion data for adaptive teaching, the student's knowledge
+            # and progress, and relevant knowledge base passages, gathered
+            # concurrently in worker threads; a stage that misses its deadline
+            # is left out rather than holding up the LLM call
+            emotion_data, (knowledge_assessment, progress), (rag_blocks, rag_docs, rag_doc_ids) = await asyncio.gather(
+                self._run_stage("emotion", self._get_current_emotion, None),
+                self._run_stage("learning", self._assess_learning_state, (None, None), session, text),
+                self._run_stage("rag", self._enhance_with_rag, ([], [], []), text)
+            )
             
-            # 3. Enhance query with RAG if relevant
-            enhanced_query, rag_docs = self._enhance_with_rag(text)
+            # A new topic counts as encountered only once its assessment is
+            # actually part of the prompt
+            if knowledge_assessment and knowledge_assessment.get("needs_assessment"):
+                session.tracker.mark_topic_encountered(knowledge_assessment["topic"])
             
             # 4. Build context for AI
-            context = self._build_ai_context(text, emotion_data, knowledge_assessment, rag_docs)
-            
-            # 5. Query AI
-            ai_response = await self._query_llm(enhanced_query, context)
+            context_sections = self._build_ai_context(text, emotion_data, knowledge_assessment, progress, rag_docs)
+            
+            # 5. Query AI, reusing the reply to an equivalent question if there is one
+            fingerprint = self._response_fingerprint(text, knowledge_assessment, rag_doc_ids)
+            ai_reply = await self._query_llm_cached(session, text, rag_blocks, context_sections, fingerprint, on_delta)
+            if ai_reply.error:
+                # Every backend failed; the details are for the log, not the student
+                return self._create_error_response(
+                    "Sorry, I'm having trouble reaching my tutoring brain right now. Please ask me again in a moment."
+                )
             
             # 6. Process AI response
-            processed_response = self._process_ai_response(ai_response, text)
+            processed_response = self._process_ai_response(ai_reply, text)
             
             # 7. Update learning tracker
-            self.learning_tracker.log_interaction("educational", text, processed_response)
+            session.tracker.log_interaction("educational", text, processed_response)
             
             # 8. Save learning objectives if this is a new topic
             if knowledge_assessment and knowledge_assessment.get("needs_assessment"):
@@ -243,10 +313,10 @@ class CoreAgent:
                 if topic:
                     objective = f"Learn basic concepts of {topic}"
                     difficulty = "easy" if "kindergarten" in text.lower() or "first" in text.lower() else "medium"
-                    self.learning_tracker.save_learning_objective(topic, objective, difficulty)
+                    session.tracker.save_learning_objective(topic, objective, difficulty)
             
             # 9. Check if follow-up is needed
-            follow_up = self._generate_follow_up(processed_response, text)
+            follow_up = self._generate_follow_up(session, processed_response, text)
             if follow_up:
                 processed_response["follow_up"] = follow_up
             
@@ -256,7 +326,40 @@ class CoreAgent:
             print(f"Error handling educational query: {e}")
             return self._create_error_response(f"Error processing educational query: {str(e)}")
     
-    async def _assess_knowledge_if_needed(self, text: str) -> Optional[Dict[str, Any]]:
+    async def _run_stage(self, name: str, func: Callable, default: Any, *args) -> Any:
+        """
+        Run a blocking pre-LLM stage in a worker thread under its deadline
+        
+        On timeout the default is returned; the thread finishes in the
+        background and its result is discarded.
+        """
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(asyncio.to_thread(func, *args), STAGE_DEADLINES_MS[name] / 1000)
+        except asyncio.TimeoutError:
+            print(f"Stage '{name}' missed its {STAGE_DEADLINES_MS[name]:.0f}ms deadline; continuing without it")
+            self.stage_stats[name]["timeouts"] += 1
+            return default
+        except Exception as e:
+            print(f"Stage '{name}' failed: {e}")
+            return default
+        finally:
+            self.stage_stats[name]["runs"] += 1
+            self.stage_stats[name]["total_ms"] += (time.perf_counter() - started) * 1000
+    
+    def _assess_learning_state(self, session: StudentSession, text: str) -> tuple:
+        """
+        The student's knowledge of the question's topic and their overall progress
+        
+        Both come from the session's tracker, so they are read together in
+        one stage. The stage only reads: it runs in a worker thread that
+        keeps going if the stage misses its deadline, so anything it
+        decides to write is applied by the caller once the result is in.
+        """
+        knowledge_assessment = self._assess_knowledge_if_needed(session, text)
+        return knowledge_assessment, session.tracker.get_current_progress()
+    
+    def _assess_knowledge_if_needed(self, session: StudentSession, text: str) -> Optional[Dict[str, Any]]:
         """
         Assess student knowledge if we're dealing with a new topic
         """
@@ -268,7 +371,7 @@ class CoreAgent:
                 return None
             
             # Check if we've assessed this topic before
-            if not self.learning_tracker.has_assessed_topic(topic):
+            if not session.tracker.has_assessed_topic(topic):
                 print(f"New topic detected: {topic}. Need to assess knowledge.")
                 
                 # Create knowledge assessment
@@ -282,13 +385,11 @@ class CoreAgent:
                     ]
                 }
                 
-                # Mark topic as encountered
-                self.learning_tracker.mark_topic_encountered(topic)
-                
+                # The caller marks the topic as encountered when it uses this
                 return assessment
             
             # Get existing knowledge level
-            return self.learning_tracker.get_topic_knowledge(topic)
+            return session.tracker.get_topic_knowledge(topic)
             
         except Exception as e:
             print(f"Error assessing knowledge: {e}")
@@ -296,175 +397,223 @@ class CoreAgent:
     
     def _enhance_with_rag(self, text: str) -> tuple:
         """
-        Enhance query with RAG system if relevant documents are found
+        Knowledge base passages relevant to the question, best first, with
+        their document titles and ids
         """
         try:
-            # Search for relevant documents
-            relevant_docs = self.rag_system.retrieve(text, top_k=3)
+            # Search for relevant documents, limited to the subject of the
+            # question and to a grade only when the student names one outright
+            relevant_docs = self.rag_system.retrieve(
+                text,
+                top_k=3,
+                subject=self.intent_classifier.extract_topic(text),
+                grade=self.intent_classifier.extract_explicit_grade(text)
+            )
             
             if not relevant_docs:
-                return text, []
-            
-            # Build enhanced query with context
-            context_parts = ["RELEVANT INFORMATION FROM KNOWLEDGE BASE:"]
+                return [], [], []
             
+            rag_blocks = []
             for doc, score in relevant_docs:
-                if score > 0.7:  # Only use highly relevant documents
-                    context_parts.append(f"- {doc.title}: {doc.content[:500]}...")
+                if score > RELEVANCE_THRESHOLD:  # Only use highly relevant documents
+                    rag_blocks.append(f"- {doc.title}: {doc.content[:500]}...")
             
-            if len(context_parts) > 1:
-                enhanced_query = "\n".join(context_parts) + f"\n\nSTUDENT QUESTION: {text}"
-                return enhanced_query, [doc.title for doc, _ in relevant_docs]
+            if rag_blocks:
+                return rag_blocks, [doc.title for doc, _ in relevant_docs], [doc.doc_id for doc, _ in relevant_docs]
             
-            return text, []
+            return [], [], []
             
         except Exception as e:
             print(f"Error enhancing with RAG: {e}")
-            return text, []
+            return [], [], []
     
-    def _build_ai_context(self, text: str, emotion_data: Optional[Dict], 
-                         knowledge_assessment: Optional[Dict], rag_docs: List[str]) -> str:
+    def _build_ai_context(self, text: str, emotion_data: Optional[Dict], knowledge_assessment: Optional[Dict],
+                         progress: Optional[Dict], rag_docs: List[str]) -> List[str]:
         """
-        Build context for AI based on student state and learning history
+        Build context sections for AI based on student state and learning history
+        
+        Sections are in priority order; the prompt builder drops the last ones
+        first when the token budget runs out.
         """
-        context_parts = [self.system_prompt]
+        context_parts = []
         
         # Add emotion context
         if emotion_data and emotion_data.get("face_detected"):
             emotion = emotion_data["emotions"]["primary"]
             stress_level = emotion_data["emotions"]["stress_level"]
             
-            context_parts.append(f"\nSTUDENT EMOTIONAL STATE:")
-            context_parts.append(f"- Current emotion: {emotion}")
-            context_parts.append(f"- Stress level: {stress_level:.2f}")
+            section = [f"\nSTUDENT EMOTIONAL STATE:"]
+            section.append(f"- Current emotion: {emotion}")
+            section.append(f"- Stress level: {stress_level:.2f}")
             
             if stress_level > 0.7:
-                context_parts.append("- IMPORTANT: Student appears stressed. Use calming, supportive language and break down concepts into smaller steps.")
+                section.append("- IMPORTANT: Student appears stressed. Use calming, supportive language and break down concepts into smaller steps.")
             elif stress_level < 0.3:
-                context_parts.append("- Student appears relaxed and ready to learn.")
+                section.append("- Student appears relaxed and ready to learn.")
+            context_parts.append("\n".join(section))
         
         # Add knowledge assessment context
         if knowledge_assessment:
-            context_parts.append(f"\nKNOWLEDGE ASSESSMENT:")
+            section = [f"\nKNOWLEDGE ASSESSMENT:"]
             if knowledge_assessment.get("needs_assessment"):
-                context_parts.append(f"- This is a new topic ({knowledge_assessment['topic']}) for the student")
-                context_parts.append("- You should ask about their background knowledge before teaching")
+                section.append(f"- This is a new topic ({knowledge_assessment['topic']}) for the student")
+                section.append("- You should ask about their background knowledge before teaching")
             else:
-                context_parts.append(f"- Student knowledge level: {knowledge_assessment.get('level', 'unknown')}")
-                context_parts.append(f"- Previous performance: {knowledge_assessment.get('performance', 'no data')}")
+                section.append(f"- Student knowledge level: {knowledge_assessment.get('level', 'unknown')}")
+                section.append(f"- Previous performance: {knowledge_assessment.get('performance', 'no data')}")
+            context_parts.append("\n".join(section))
         
         # Add learning history context
-        progress = self.learning_tracker.get_current_progress()
         if progress:
-            context_parts.append(f"\nLEARNING HISTORY:")
-            context_parts.append(f"- Topics covered: {progress.get('completed_topics', 0)}")
-            context_parts.append(f"- Current session duration: {progress.get('session_duration', 0)} minutes")
+            section = [f"\nLEARNING HISTORY:"]
+            section.append(f"- Topics covered: {progress.get('completed_topics', 0)}")
+            section.append(f"- Current session duration: {progress.get('session_duration', 0)} minutes")
             
             if progress.get("struggling_areas"):
-                context_parts.append(f"- Areas student struggles with: {', '.join(progress['struggling_areas'])}")
+                section.append(f"- Areas student struggles with: {', '.join(progress['struggling_areas'])}")
+            context_parts.append("\n".join(section))
         
         # Add RAG document context
         if rag_docs:
             context_parts.append(f"\nRELEVANT KNOWLEDGE BASE DOCUMENTS: {', '.join(rag_docs)}")
         
-        return "\n".join(context_parts)
+        return context_parts
+    
+    def _response_fingerprint(self, text: str, knowledge_assessment: Optional[Dict],
+                              rag_doc_ids: List[str]) -> str:
+        """
+        Fingerprint of the context a cached reply must share to be reused
+        
+        The question's numbers are part of it, in order: "3/4 + 1/8" and
+        "3/5 + 1/10" embed almost identically but have different answers.
+        """
+        knowledge_assessment = knowledge_assessment or {}
+        return context_fingerprint(
+            topic=self.intent_classifier.extract_topic(text),
+            needs_assessment=bool(knowledge_assessment.get("needs_assessment")),
+            level=knowledge_assessment.get("level"),
+            rag_docs=sorted(set(rag_doc_ids)),
+            numbers=self.intent_classifier.extract_numbers(text)
+        )
+    
+    async def _query_llm_cached(self, session: StudentSession, text: str, rag_blocks: List[str], context_sections: List[str],
+                                fingerprint: str, on_delta: Optional[DeltaCallback] = None) -> LLMReply:
+        """
+        Answer from the semantic response cache when possible, otherwise query
+        the LLM, sharing the call with identical questions already in flight
+        """
+        # Mock replies echo the question, so only real LLM replies are shared
+        shareable = self.llm_backend.available and len(text.split()) >= RESPONSE_CACHE_MIN_WORDS
+        if not shareable:
+            return await self._query_llm(session, text, rag_blocks, context_sections, on_delta)
+        
+        if self.response_cache is not None:
+            cached = await asyncio.to_thread(self.response_cache.lookup, text, fingerprint)
+            if cached is not None:
+                print("Answering from the LLM response cache")
+                self._remember_exchange(session, text, cached)
+                return LLMReply.from_text(cached)
+        
+        # The leader's prompt carries its own session's history and context,
+        # so only requests that would send the same prompt share its reply
+        prompt_digest = context_fingerprint(
+            history=list(session.history), context_sections=context_sections, rag_blocks=rag_blocks
+        )
+        ai_reply, leader = await self.llm_in_flight.run(
+            f"{fingerprint}:{prompt_digest}:{normalize_query(text)}",
+            lambda emit: self._query_llm(session, text, rag_blocks, context_sections, emit),
+            on_delta
+        )
+        
+        if not leader:
+            print("Answered by an identical request already in flight")
+            self._remember_exchange(session, text, ai_reply.text)
+        elif self.response_cache is not None and not ai_reply.error and not ai_reply.degraded:
+            await asyncio.to_thread(self.response_cache.store, text, fingerprint, ai_reply.text)
+        return ai_reply
     
-    async def _query_llm(self, query: str, context: str) -> str:
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """
+        Hit and miss counters for the LLM response cache, coalesced requests
+        and pre-LLM stage timings
         """
-        Query the LLM with enhanced context
+        stats = self.response_cache.get_stats() if self.response_cache else {"enabled": False}
+        stats["coalescing"] = self.llm_in_flight.get_stats()
+        stats["stages"] = {
+            name: dict(counters, deadline_ms=STAGE_DEADLINES_MS[name],
+                       mean_ms=counters["total_ms"] / counters["runs"] if counters["runs"] else 0.0)
+            for name, counters in self.stage_stats.items()
+        }
+        return stats
+    
+    async def _query_llm(self, session: StudentSession, text: str, rag_blocks: List[str], context_sections: List[str],
+                         on_delta: Optional[DeltaCallback] = None) -> LLMReply:
         """
-        if not self.openrouter_api_key:
-            return self._get_mock_response(query)
+        Query the LLM with a token-budgeted prompt, streaming the explanation to on_delta if given
+        """
+        if not self.llm_backend.available:
+            return LLMReply.from_text(self._get_mock_response(text), degraded=True)
         
         try:
-            headers = {
-                "Authorization": f"Bearer {self.openrouter_api_key}",
-                "HTTP-Referer": "http://localhost:8000",
-                "X-Title": "PEARL AI Tutor",
-                "Content-Type": "application/json",
-            }
-            
-            messages = [
-                {"role": "system", "content": context},
-                {"role": "user", "content": query}
-            ]
-            
-            # Add recent conversation history
-            if self.conversation_history:
-                recent_history = self.conversation_history[-6:]  # Last 3 exchanges
-                messages = [messages[0]] + recent_history + [messages[1]]
-            
-            payload = {
-                "model": self.llm_model,
-                "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 1000
-            }
-            
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=payload
+            messages, usage = self.prompt_builder.build(
+                self.system_prompt, text, rag_blocks, list(session.history), context_sections
             )
+            print(f"LLM {usage.summary()}")
+            
+            # Streams the explanation to on_delta when given
+            ai_reply = await self.llm_backend.reply(messages, temperature=0.7, max_tokens=1000, on_delta=on_delta)
             
-            if response.status_code == 200:
-                result = response.json()
-                if "choices" in result and len(result["choices"]) > 0:
-                    ai_response = result["choices"][0]["message"]["content"]
-                    
-                    # Update conversation history
-                    self.conversation_history.append({"role": "user", "content": query})
-                    self.conversation_history.append({"role": "assistant", "content": ai_response})
-                    
-                    return ai_response
+            if ai_reply.text:
+                self._remember_exchange(session, text, ai_reply.text)
+                return ai_reply
             
-            return f"Error from AI service: {response.status_code}"
+            return LLMReply("Error from AI service: empty response", error=True)
             
+        except LLMRequestError as e:
+            print(f"Error querying LLM: {e}")
+            return LLMReply(str(e), error=True)
         except Exception as e:
             print(f"Error querying LLM: {e}")
-            return f"Error communicating with AI: {str(e)}"
+            return LLMReply(f"Error communicating with AI: {str(e)}", error=True)
+    
+    def _remember_exchange(self, session: StudentSession, question: str, reply: str):
+        """
+        Record a question and reply in the student's conversation history
+        
+        The bare question is kept rather than the prompt around it, so
+        knowledge base passages are not carried into later prompts.
+        """
+        session.history.append({"role": "user", "content": question})
+        session.history.append({"role": "assistant", "content": reply})
     
     def _get_mock_response(self, query: str) -> str:
         """
-        Generate mock response when no API key is available
+        Generate mock response when no LLM backend is available
         """
-        return json.dumps({
-            "explanation": f"I understand you're asking about: {query}. This is a mock response since no OpenRouter API key is configured.",
-            "scene": [],
-            "final_answer": {
-                "correct_value": "",
-                "explanation": "Mock response - no actual calculation performed",
-                "feedback_correct": "Good job!",
-                "feedback_incorrect": "Let's try again"
-            },
-            "follow_up_question": "Would you like to learn more about this topic?",
-            "knowledge_check": "basic understanding"
-        })
+        return mock_reply(query)
     
-    def _process_ai_response(self, ai_response: str, original_text: str) -> Dict[str, Any]:
+    def _process_ai_response(self, ai_reply: LLMReply, original_text: str) -> Dict[str, Any]:
         """
         Process and structure the AI response
         """
         try:
-            # Try to parse as JSON first
-            if ai_response.strip().startswith('{') and ai_response.strip().endswith('}'):
-                try:
-                    parsed_response = json.loads(ai_response)
-                    
-                    # Structure the response
-                    return {
-                        "question": original_text,
-                        "answer": {
-                            "explanation": parsed_response.get("explanation", ai_response),
-                            "scene": parsed_response.get("scene", []),
-                            "final_answer": parsed_response.get("final_answer", {})
-                        },
-                        "follow_up_question": parsed_response.get("follow_up_question"),
-                        "knowledge_check": parsed_response.get("knowledge_check"),
-                        "type": "educational"
-                    }
-                except json.JSONDecodeError:
-                    pass
+            # The JSON object was found (inside code fences or surrounding
+            # text, repaired if cut off) when the reply was parsed
+            parsed_response = ai_reply.parsed
+            ai_response = ai_reply.text
+            if parsed_response is not None:
+                # Structure the response
+                return {
+                    "question": original_text,
+                    "answer": {
+                        "explanation": parsed_response.get("explanation", ai_response),
+                        "scene": parsed_response.get("scene", []),
+                        "final_answer": parsed_response.get("final_answer", {})
+                    },
+                    "follow_up_question": parsed_response.get("follow_up_question"),
+                    "knowledge_check": parsed_response.get("knowledge_check"),
+                    "type": "educational"
+                }
             
             # Handle non-JSON response
             return {
@@ -481,7 +630,7 @@ class CoreAgent:
             print(f"Error processing AI response: {e}")
             return self._create_error_response(f"Error processing AI response: {str(e)}")
     
-    def _generate_follow_up(self, response: Dict[str, Any], original_text: str) -> Optional[str]:
+    def _generate_follow_up(self, session: StudentSession, response: Dict[str, Any], original_text: str) -> Optional[str]:
         """
         Generate appropriate follow-up question based on the response and learning progress
         """
@@ -493,7 +642,7 @@ class CoreAgent:
             # Generate based on topic and student performance
             topic = self.intent_classifier.extract_topic(original_text)
             if topic:
-                performance = self.learning_tracker.get_topic_performance(topic)
+                performance = session.tracker.get_topic_performance(topic)
                 
                 if performance and performance.get("correct_answers", 0) >= 3:
                     return f"Great job with {topic}! Are you ready to try a more challenging problem?"
@@ -548,15 +697,26 @@ class CoreAgent:
             print(f"Error processing whiteboard image: {e}")
             return {"error": str(e)}
     
-    async def process_websocket_message(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    async def process_websocket_message(self, data: Dict[str, Any],
+                                        send: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None) -> Dict[str, Any]:
         """
         Process WebSocket messages
+        
+        Given a send callback, text messages stream their explanation as
+        {"type": "delta", "data": {"text": ...}} messages before the final
+        response, unless the message sets "stream": false. A "session_id"
+        field selects the student.
         """
         try:
             message_type = data.get("type")
             
             if message_type == "text":
-                response = await self.process_text_input(data.get("text", ""))
+                on_delta = None
+                if send is not None and data.get("stream", True):
+                    async def on_delta(text: str):
+                        await send({"type": "delta", "data": {"text": text}})
+                
+                response = await self.process_text_input(data.get("text", ""), on_delta, data.get("session_id"))
                 return {"type": "response", "data": response}
             
             elif message_type == "command":
@@ -573,6 +733,13 @@ class CoreAgent:
             print(f"Error processing WebSocket message: {e}")
             return {"type": "error", "data": {"message": str(e)}}
     
+    async def close(self):
+        """
+        Release network connections and save active student sessions
+        """
+        await self.llm_backend.close()
+        self.sessions.save_all()
+    
     def _create_error_response(self, error_message: str) -> Dict[str, Any]:
         """
         Create standardized error response
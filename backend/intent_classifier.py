@@ -311,6 +311,29 @@ class IntentClassifier:
         
         return None
     
+    def extract_explicit_grade(self, text: str) -> Optional[str]:
+        """
+        Grade level named outright ("grade 3", "3rd grade", "third grade",
+        "kindergarten"), or None
+
+        Unlike extract_grade_level, ordinal words on their own ("one fifth
+        of 20") do not count, so the result is safe to filter by.
+        """
+        numbers = {"1": 1, "2": 2, "3": 3, "4": 4, "5": 5, "6": 6,
+                   "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+                   "first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5, "sixth": 6}
+        names = {1: "first_grade", 2: "second_grade", 3: "third_grade",
+                 4: "fourth_grade", 5: "fifth_grade", 6: "sixth_grade"}
+
+        text_lower = text.lower()
+        if re.search(r"\bkindergarten\b", text_lower):
+            return "kindergarten"
+
+        match = re.search(r"\bgrade\s*([1-6]|one|two|three|four|five|six)\b", text_lower) \
+            or re.search(r"\b([1-6])(?:st|nd|rd|th)\s*grade\b", text_lower) \
+            or re.search(r"\b(first|second|third|fourth|fifth|sixth)\s+grade\b", text_lower)
+        return names[numbers[match.group(1)]] if match else None
+    
     def _check_patterns(self, text: str, patterns: List[IntentPattern]) -> Dict[str, Any]:
         """
         Check text against a list of patterns and return best match
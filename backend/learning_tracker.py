@@ -344,6 +344,32 @@ class LearningTracker:
         temp_data = self._load_temp_progress()
         return [obj for obj in temp_data.get("learning_objectives", []) if not obj.get("completed", False)]
     
+    def export_session_state(self) -> Optional[Dict[str, Any]]:
+        """
+        The in-progress learning session as plain JSON data, or None if there is none
+        """
+        if not self.current_session:
+            return None
+
+        session_data = asdict(self.current_session)
+        session_data["start_time"] = session_data["start_time"].isoformat()
+        if session_data["end_time"]:
+            session_data["end_time"] = session_data["end_time"].isoformat()
+        return session_data
+
+    def import_session_state(self, session_data: Optional[Dict[str, Any]]):
+        """
+        Resume a learning session previously returned by export_session_state
+        """
+        if not session_data:
+            return
+
+        session_data = dict(session_data)
+        session_data["start_time"] = datetime.fromisoformat(session_data["start_time"])
+        if session_data.get("end_time"):
+            session_data["end_time"] = datetime.fromisoformat(session_data["end_time"])
+        self.current_session = LearningSession(**session_data)
+
     def reset_progress(self):
         """
         Reset all learning progress (for testing or new student)
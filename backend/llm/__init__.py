@@ -0,0 +1,35 @@
+"""
+LLM Package - Serving-side building blocks for the tutor's language model calls
+"""
+
+from .response_cache import SemanticResponseCache, context_fingerprint
+from .http_client import LLMHttpClient, LLMRequestError
+from .response_parser import TutorResponseParser, parse_tutor_response
+from .backends import LLMBackend, LLMReply, OpenRouterBackend, LlamaCppBackend, MockBackend, create_backend
+from .single_flight import SingleFlight
+from .prompt_builder import PromptBuilder, PromptUsage, approximate_token_count
+from .router import LLMRouter, BackendHealth
+from .batch_scheduler import BatchScheduler, BatchEngine
+
+__all__ = [
+    'SemanticResponseCache',
+    'context_fingerprint',
+    'LLMHttpClient',
+    'LLMRequestError',
+    'TutorResponseParser',
+    'parse_tutor_response',
+    'LLMBackend',
+    'LLMReply',
+    'OpenRouterBackend',
+    'LlamaCppBackend',
+    'MockBackend',
+    'create_backend',
+    'SingleFlight',
+    'PromptBuilder',
+    'PromptUsage',
+    'approximate_token_count',
+    'LLMRouter',
+    'BackendHealth',
+    'BatchScheduler',
+    'BatchEngine'
+]
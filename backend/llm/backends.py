@@ -0,0 +1,551 @@
+"""
+LLM Backends - Interchangeable chat completion backends for the tutor
+"""
+
+import os
+import json
+import time
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from .http_client import LLMHttpClient, LLMRequestError
+from .batch_scheduler import BatchScheduler
+from .llama_batch import LlamaBatchEngine
+from .prompt_builder import QUESTION_LABEL, approximate_token_count
+from .response_parser import TutorResponseParser, parse_tutor_response
+
+BACKEND_TYPES = ("openrouter", "llama_cpp", "mock")
+
+DEFAULT_OPENROUTER_MODEL = "meta-llama/llama-4-maverick:free"
+
+# Context size of the Llama object when batching, which then only tokenizes
+TOKENIZER_N_CTX = 512
+
+Messages = List[Dict[str, str]]
+
+# Receives explanation text as a reply streams in
+DeltaCallback = Callable[[str], Awaitable[None]]
+
+@dataclass
+class LLMReply:
+    """
+    A finished reply together with the tutor object parsed from it
+
+    The reply is parsed once, as it streams in or when it arrives, and the
+    result is shared by everything downstream. error marks a reply that is
+    an error message rather than an answer; degraded marks one that came
+    from a degraded backend (the mock) and must not be cached.
+    """
+    text: str
+    parsed: Optional[Dict[str, Any]] = None
+    error: bool = False
+    degraded: bool = False
+
+    @classmethod
+    def from_text(cls, text: str, degraded: bool = False) -> "LLMReply":
+        return cls(text, parse_tutor_response(text), degraded=degraded)
+
+    @classmethod
+    async def from_stream(cls, deltas: AsyncIterator[str], on_delta: DeltaCallback,
+                          degraded: bool = False) -> "LLMReply":
+        """
+        Read a streamed reply, passing explanation text to on_delta as it arrives
+        """
+        parser = TutorResponseParser()
+        try:
+            async for delta in deltas:
+                text = parser.feed(delta)
+                if text:
+                    await on_delta(text)
+        finally:
+            await deltas.aclose()
+        return cls(parser.buffer, parser.result(), degraded=degraded)
+
+def mock_reply(query: str) -> str:
+    """
+    Canned tutor reply used when no real model can answer
+    """
+    return json.dumps({
+        "explanation": f"I understand you're asking about: {query}. This is a mock response since no LLM backend is configured.",
+        "scene": [],
+        "final_answer": {
+            "correct_value": "",
+            "explanation": "Mock response - no actual calculation performed",
+            "feedback_correct": "Good job!",
+            "feedback_incorrect": "Let's try again"
+        },
+        "follow_up_question": "Would you like to learn more about this topic?",
+        "knowledge_check": "basic understanding"
+    })
+
+class LLMBackend:
+    """
+    A source of chat completions.
+
+    Backends take OpenAI-style message lists and return the assistant's
+    text, either whole or as a stream of deltas. A backend that is not
+    available (no API key, no model file) makes the agent fall back to its
+    mock replies.
+    """
+
+    name = "base"
+
+    # Degraded backends give canned replies: never cached, only used as a last resort
+    degraded = False
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def load(self):
+        """
+        Prepare the backend so the first question does not pay for it
+        """
+        pass
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Tokens text takes up in a prompt for this backend's model
+        """
+        return approximate_token_count(text)
+
+    def set_static_prefix(self, prefix: str):
+        """
+        Declare text that starts the first system message of every request
+
+        Backends that can reuse work across requests with a common prefix
+        use this; the rest ignore it.
+        """
+        pass
+
+    async def complete(self, messages: Messages, temperature: float = 0.7, max_tokens: int = 1000) -> str:
+        raise NotImplementedError
+
+    async def stream(self, messages: Messages, temperature: float = 0.7,
+                     max_tokens: int = 1000) -> AsyncIterator[str]:
+        # Backends without native streaming deliver the reply as one delta
+        yield await self.complete(messages, temperature, max_tokens)
+
+    async def reply(self, messages: Messages, temperature: float = 0.7, max_tokens: int = 1000,
+                    on_delta: Optional[DeltaCallback] = None) -> LLMReply:
+        """
+        Complete the messages, or stream them to on_delta if given, and parse the reply
+
+        The reply is marked degraded when the backend that produced it is.
+        """
+        if on_delta is None:
+            return LLMReply.from_text(await self.complete(messages, temperature, max_tokens), self.degraded)
+        return await LLMReply.from_stream(self.stream(messages, temperature, max_tokens), on_delta, self.degraded)
+
+    async def close(self):
+        pass
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": self.name, "available": self.available}
+
+class OpenRouterBackend(LLMBackend):
+    """
+    Hosted models behind an OpenAI-compatible HTTP API (OpenRouter by default)
+    """
+
+    name = "openrouter"
+
+    def __init__(self, client: LLMHttpClient, model: str = DEFAULT_OPENROUTER_MODEL, requires_key: bool = True):
+        self.client = client
+        self.model = model
+        self.requires_key = requires_key
+
+    @property
+    def available(self) -> bool:
+        # Self-hosted and stand-in servers may not need a key
+        return bool(self.client.api_key) or not self.requires_key
+
+    async def complete(self, messages: Messages, temperature: float = 0.7, max_tokens: int = 1000) -> str:
+        result = await self.client.chat_completion(self._payload(messages, temperature, max_tokens))
+        if not result.get("choices"):
+            return ""
+        return result["choices"][0]["message"]["content"] or ""
+
+    async def stream(self, messages: Messages, temperature: float = 0.7,
+                     max_tokens: int = 1000) -> AsyncIterator[str]:
+        async for delta in self.client.stream_chat_completion(self._payload(messages, temperature, max_tokens)):
+            yield delta
+
+    async def close(self):
+        await self.client.close()
+
+    def describe(self) -> Dict[str, Any]:
+        info = super().describe()
+        info.update({"model": self.model, "base_url": self.client.base_url})
+        return info
+
+    def _payload(self, messages: Messages, temperature: float, max_tokens: int) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+
+class LlamaCppBackend(LLMBackend):
+    """
+    A quantised GGUF model run in-process with llama-cpp-python.
+
+    The model is loaded once, on first use, and kept for the life of the
+    process. llama.cpp contexts are not thread-safe, so generations run one
+    at a time in a worker thread, leaving the event loop free; n_threads
+    sets how many CPU threads generation uses.
+
+    With max_batch above 1, concurrent requests go through a BatchScheduler
+    instead. It groups up to max_batch of them, waiting at most
+    batch_wait_ms for a batch to fill, into one LlamaBatchEngine context
+    where each request is a sequence of its own and every decode step
+    advances all of them with a single llama_decode call. That context
+    holds the only n_ctx KV cache, shared by the sequences, and uses all
+    n_threads, so a student alone on the server still gets every core.
+    The Llama object then only provides the weights and tokenizer, so its
+    own context is kept to TOKENIZER_N_CTX tokens.
+
+    With a static prefix set, its KV state is evaluated once and saved.
+    llama.cpp only re-evaluates the part of a prompt that differs from what
+    is already in the context, so restoring that state whenever the context
+    holds something else leaves just the dynamic suffix to evaluate. When
+    batching, the engine keeps the prefix in a sequence of its own instead.
+    """
+
+    name = "llama_cpp"
+
+    def __init__(self, model_path: str, n_ctx: int = 4096, n_threads: Optional[int] = None,
+                 n_gpu_layers: int = 0, chat_format: Optional[str] = None,
+                 prefix_cache: bool = True, max_batch: int = 1, batch_wait_ms: float = 10.0):
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads or max(1, (os.cpu_count() or 2) // 2)
+        self.max_batch = max(1, max_batch)
+        self.n_gpu_layers = n_gpu_layers
+        self.chat_format = chat_format
+        self.prefix_cache = prefix_cache
+
+        self._llm = None
+        self._load_lock = threading.Lock()
+        self._generate_lock = threading.Lock()
+
+        self._batch_engine = None
+        self.scheduler = None
+        if self.max_batch > 1:
+            self.scheduler = BatchScheduler(lambda: self.batch_engine, self.max_batch, batch_wait_ms)
+
+        self.static_prefix: Optional[str] = None
+        self._prefix_tokens: List[int] = []
+        self._prefix_state = None
+        self._prefix_lock = threading.Lock()
+        self.prefix_stats = {"warm": 0, "restored": 0, "prefix_tokens": 0, "warmup_seconds": 0.0}
+
+    @property
+    def available(self) -> bool:
+        return os.path.exists(self.model_path)
+
+    @property
+    def llm(self):
+        with self._load_lock:
+            if self._llm is None:
+                print(f"Loading local LLM {self.model_path} with {self.n_threads} threads...")
+                self._llm = self._new_llama()
+            return self._llm
+
+    @property
+    def batch_engine(self) -> LlamaBatchEngine:
+        llm = self.llm
+        with self._load_lock:
+            if self._batch_engine is None:
+                print(f"Creating batched context for {self.max_batch} sequences...")
+                self._batch_engine = LlamaBatchEngine(
+                    llm, self.n_ctx, self.max_batch, self.n_threads, self.prefix_stats,
+                    self.static_prefix if self.prefix_cache else None
+                )
+            return self._batch_engine
+
+    def load(self):
+        if self.scheduler is not None:
+            # Create the batched context now rather than in the middle of a request
+            engine = self.batch_engine
+            started = time.perf_counter()
+            engine.warm_prefix()
+            self.prefix_stats["warmup_seconds"] = time.perf_counter() - started
+            return
+        llm = self.llm
+        with self._generate_lock:
+            self._warm_prefix(llm)
+
+    def count_tokens(self, text: str) -> int:
+        # Until the model is loaded its tokenizer is not available either
+        if self._llm is None or not text:
+            return approximate_token_count(text)
+        return len(self._llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def set_static_prefix(self, prefix: str):
+        with self._prefix_lock:
+            if prefix == self.static_prefix:
+                return
+            self.static_prefix = prefix
+            self._prefix_tokens = []
+            self._prefix_state = None
+        if self._batch_engine is not None and self.prefix_cache:
+            self._batch_engine.set_static_prefix(prefix)
+
+    async def complete(self, messages: Messages, temperature: float = 0.7, max_tokens: int = 1000) -> str:
+        if self.scheduler is not None:
+            return "".join([delta async for delta in self._scheduled(messages, temperature, max_tokens)])
+        return await asyncio.to_thread(self._complete, messages, temperature, max_tokens)
+
+    async def stream(self, messages: Messages, temperature: float = 0.7,
+                     max_tokens: int = 1000) -> AsyncIterator[str]:
+        if self.scheduler is not None:
+            async for delta in self._scheduled(messages, temperature, max_tokens):
+                yield delta
+            return
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for delta in self._stream(messages, temperature, max_tokens):
+                    if stop.is_set():
+                        # The consumer went away; free the model for the next request
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, delta)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        producer = loop.run_in_executor(None, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise LLMRequestError(f"Error from local model: {item}")
+                yield item
+        finally:
+            stop.set()
+            await producer
+
+    async def close(self):
+        if self.scheduler is not None:
+            await self.scheduler.close()
+        if self._batch_engine is not None:
+            self._batch_engine.close()
+
+    def describe(self) -> Dict[str, Any]:
+        info = super().describe()
+        info.update({
+            "model_path": self.model_path,
+            "loaded": self._llm is not None,
+            "n_ctx": self.n_ctx,
+            "n_threads": self.n_threads,
+            "n_gpu_layers": self.n_gpu_layers,
+            "prefix_cache": dict(self.prefix_stats, enabled=self.prefix_cache),
+            "batching": self.scheduler.get_stats() if self.scheduler is not None else {"enabled": False}
+        })
+        return info
+
+    def _new_llama(self):
+        from llama_cpp import Llama
+
+        return Llama(
+            model_path=self.model_path,
+            # With batching, generation runs in the batch engine's context
+            n_ctx=self.n_ctx if self.scheduler is None else TOKENIZER_N_CTX,
+            n_threads=self.n_threads,
+            n_gpu_layers=self.n_gpu_layers,
+            chat_format=self.chat_format,
+            use_mmap=True,
+            verbose=False
+        )
+
+    def _warm_prefix(self, llm):
+        """
+        Evaluate the static prefix once in llm and save the KV state covering it
+
+        The token boundary between the prefix and whatever follows depends on
+        the chat template, so two probe prompts that differ only after the
+        prefix are evaluated and their shared tokens taken as the prefix. The
+        second probe reuses the first's KV, so this costs one prefix
+        evaluation plus a few tokens. Must be called with the generate lock
+        held.
+        """
+        with self._prefix_lock:
+            if not self.prefix_cache or not self.static_prefix or self._prefix_state is not None:
+                return
+            self._evaluate_prefix(llm)
+
+    def _evaluate_prefix(self, llm):
+        started = time.perf_counter()
+
+        probes = []
+        for probe in ("A", "B"):
+            llm.create_chat_completion(
+                messages=[
+                    {"role": "system", "content": f"{self.static_prefix}\n{probe}"},
+                    {"role": "user", "content": probe}
+                ],
+                max_tokens=1
+            )
+            probes.append(list(llm.input_ids[:llm.n_tokens]))
+
+        shared = 0
+        for a, b in zip(probes[0], probes[1]):
+            if a != b:
+                break
+            shared += 1
+
+        if shared == 0:
+            print("Static prompt prefix not shared between requests; prefix cache disabled")
+            self.prefix_cache = False
+            return
+
+        # The context now holds the prefix plus the second probe; llama.cpp
+        # discards everything past the shared tokens on the next request
+        self._prefix_tokens = probes[1][:shared]
+        self._prefix_state = llm.save_state()
+        self.prefix_stats["prefix_tokens"] = shared
+        self.prefix_stats["warmup_seconds"] = time.perf_counter() - started
+        print(f"Cached KV state for {shared} static prompt tokens")
+
+    def _restore_prefix(self, llm, messages: Messages):
+        """
+        Put the static prefix's KV state back if the context no longer starts with it
+
+        Must be called with the generate lock held.
+        """
+        if not self.prefix_cache or not self.static_prefix:
+            return
+        if not messages or messages[0].get("role") != "system" or not messages[0]["content"].startswith(self.static_prefix):
+            return
+
+        self._warm_prefix(llm)
+        if self._prefix_state is None:
+            return
+
+        n_prefix = len(self._prefix_tokens)
+        if llm.n_tokens >= n_prefix and list(llm.input_ids[:n_prefix]) == self._prefix_tokens:
+            self.prefix_stats["warm"] += 1
+            return
+
+        llm.load_state(self._prefix_state)
+        self.prefix_stats["restored"] += 1
+
+    def _complete(self, messages: Messages, temperature: float, max_tokens: int) -> str:
+        llm = self.llm
+        with self._generate_lock:
+            self._restore_prefix(llm, messages)
+            result = llm.create_chat_completion(messages=messages, temperature=temperature, max_tokens=max_tokens)
+        return result["choices"][0]["message"].get("content") or ""
+
+    def _stream(self, messages: Messages, temperature: float, max_tokens: int):
+        llm = self.llm
+        with self._generate_lock:
+            self._restore_prefix(llm, messages)
+            for chunk in llm.create_chat_completion(messages=messages, temperature=temperature,
+                                                    max_tokens=max_tokens, stream=True):
+                content = chunk["choices"][0]["delta"].get("content")
+                if content:
+                    yield content
+
+    async def _scheduled(self, messages: Messages, temperature: float, max_tokens: int) -> AsyncIterator[str]:
+        try:
+            async for delta in self.scheduler.submit((messages, temperature, max_tokens)):
+                yield delta
+        except LLMRequestError:
+            raise
+        except Exception as e:
+            raise LLMRequestError(f"Error from local model: {e}")
+
+class MockBackend(LLMBackend):
+    """
+    Answers instantly with the canned mock reply; the last resort of a router
+    """
+
+    name = "mock"
+    degraded = True
+
+    async def complete(self, messages: Messages, temperature: float = 0.7, max_tokens: int = 1000) -> str:
+        # Echo the bare question, not the knowledge base passages around it
+        question = messages[-1]["content"] if messages else ""
+        return mock_reply(question.rpartition(QUESTION_LABEL)[2])
+
+def create_backend(backend_type: Optional[str] = None) -> LLMBackend:
+    """
+    Build the backend selected for this deployment from environment settings
+
+    LLM_BACKENDS is a comma-separated list of "openrouter", "llama_cpp",
+    "mock" or base URLs of other OpenAI-compatible servers; with more than
+    one entry they are combined by an LLMRouter in that order of
+    preference. LLM_BACKEND (default "openrouter") is read when LLM_BACKENDS
+    is not set.
+
+    OpenRouter reads OPENROUTER_API_KEY, OPENROUTER_BASE_URL,
+    OPENROUTER_MODEL and the LLM_*_TIMEOUT / LLM_MAX_RETRIES settings, which
+    URL entries share; llama_cpp reads LLAMA_MODEL_PATH, LLAMA_N_CTX,
+    LLAMA_N_THREADS, LLAMA_N_GPU_LAYERS, LLAMA_CHAT_FORMAT,
+    LLAMA_PREFIX_CACHE, LLAMA_MAX_BATCH, the number of generations decoded
+    together (default 1, one at a time), and LLAMA_BATCH_WAIT_MS, how long
+    a new batch waits to fill (default 10). See create_router for the
+    router's settings.
+    """
+    specs = backend_type or os.environ.get("LLM_BACKENDS") or os.environ.get("LLM_BACKEND", "openrouter")
+    specs = [spec.strip() for spec in specs.split(",") if spec.strip()]
+
+    if len(specs) == 1:
+        return _create_single_backend(specs[0])
+
+    from .router import create_router
+    return create_router([(spec, _create_single_backend(spec)) for spec in specs])
+
+def _http_backend(base_url: str, requires_key: bool) -> OpenRouterBackend:
+    client = LLMHttpClient(
+        base_url,
+        api_key=os.environ.get("OPENROUTER_API_KEY", ""),
+        headers={
+            "HTTP-Referer": "http://localhost:8000",
+            "X-Title": "PEARL AI Tutor"
+        },
+        connect_timeout=float(os.environ.get("LLM_CONNECT_TIMEOUT", "5")),
+        read_timeout=float(os.environ.get("LLM_READ_TIMEOUT", "60")),
+        max_retries=int(os.environ.get("LLM_MAX_RETRIES", "2"))
+    )
+    return OpenRouterBackend(client, os.environ.get("OPENROUTER_MODEL", DEFAULT_OPENROUTER_MODEL), requires_key)
+
+def _create_single_backend(spec: str) -> LLMBackend:
+    backend_type = spec.lower()
+
+    if backend_type.startswith(("http://", "https://")):
+        return _http_backend(spec, requires_key=False)
+
+    if backend_type == "openrouter":
+        return _http_backend(os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"), requires_key=True)
+
+    if backend_type == "mock":
+        return MockBackend()
+
+    if backend_type == "llama_cpp":
+        n_threads = os.environ.get("LLAMA_N_THREADS")
+        return LlamaCppBackend(
+            os.environ.get("LLAMA_MODEL_PATH", "models/tutor.gguf"),
+            n_ctx=int(os.environ.get("LLAMA_N_CTX", "4096")),
+            n_threads=int(n_threads) if n_threads else None,
+            n_gpu_layers=int(os.environ.get("LLAMA_N_GPU_LAYERS", "0")),
+            chat_format=os.environ.get("LLAMA_CHAT_FORMAT") or None,
+            prefix_cache=os.environ.get("LLAMA_PREFIX_CACHE", "1") != "0",
+            max_batch=int(os.environ.get("LLAMA_MAX_BATCH", "1")),
+            batch_wait_ms=float(os.environ.get("LLAMA_BATCH_WAIT_MS", "10"))
+        )
+
+    raise ValueError(f"Unknown LLM backend '{spec}', expected one of {', '.join(BACKEND_TYPES)} or a URL")
@@ -0,0 +1,274 @@
+"""
+Batch Scheduler - Groups concurrent local generations into shared decode steps
+"""
+
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+_FINISHED = object()
+
+class BatchEngine:
+    """
+    A model context that advances several sequences with one decode call.
+
+    Only the scheduler's thread calls an engine. start() prepares a request
+    to join the batch as the given slot and returns its state, or None when
+    there is no room for it until a running sequence finishes. step()
+    evaluates the prompts of joining sequences together with one token of
+    every running sequence and returns, for each state, the text produced
+    and whether the sequence finished. release() frees the slot again.
+    """
+
+    def start(self, slot: int, request: Any) -> Optional[Any]:
+        raise NotImplementedError
+
+    def step(self, states: List[Any]) -> List[Tuple[str, bool]]:
+        raise NotImplementedError
+
+    def release(self, state: Any):
+        pass
+
+class _Sequence:
+    def __init__(self, request: Any, loop: asyncio.AbstractEventLoop):
+        self.request = request
+        self.loop = loop
+        self.enqueued_at = time.monotonic()
+        self.output: asyncio.Queue = asyncio.Queue()
+        self.slot: Optional[int] = None
+        self.state: Any = None
+        self.cancelled = False
+
+    def send(self, item: Any):
+        try:
+            self.loop.call_soon_threadsafe(self.output.put_nowait, item)
+        except RuntimeError:
+            # The caller's event loop is already closed
+            pass
+
+class BatchScheduler:
+    """
+    Runs concurrent generations as one batch of sequences on a single engine.
+
+    A decode thread owns the engine. When the batch is empty, the first
+    request waits up to max_wait_ms for others so that simultaneous
+    requests start together; requests arriving while a batch runs join it
+    at the next step boundary, up to max_batch sequences. Every step
+    advances all sequences in the batch with one engine call, so decoding
+    for several students costs about as much as for one. A sequence leaves
+    the batch when it finishes, fails or its caller goes away, and its slot
+    goes to the next queued request.
+
+    Queue depth (current, max and mean per step), mean queue wait and mean
+    batch size are reported by get_stats().
+    """
+
+    def __init__(self, engine_factory: Callable[[], BatchEngine], max_batch: int = 8,
+                 max_wait_ms: float = 10.0):
+        self.engine_factory = engine_factory
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+
+        self._waiting: Deque[_Sequence] = deque()
+        self._active: List[_Sequence] = []
+        self._free_slots = list(range(self.max_batch - 1, -1, -1))
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0,
+                      "steps": 0, "outputs": 0, "queue_depth_max": 0}
+        self._admitted = 0
+        self._wait_total = 0.0
+        self._batch_total = 0
+        self._queue_total = 0
+
+    async def submit(self, request: Any) -> AsyncIterator[str]:
+        """
+        Queue a request and yield its output as its sequence produces it
+        """
+        sequence = _Sequence(request, asyncio.get_running_loop())
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("the local model is shutting down")
+            self._waiting.append(sequence)
+            self.stats["submitted"] += 1
+            self.stats["queue_depth_max"] = max(self.stats["queue_depth_max"], len(self._waiting))
+            self._ensure_thread()
+            self._condition.notify_all()
+
+        try:
+            while True:
+                item = await sequence.output.get()
+                if item is _FINISHED:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # A running sequence is dropped by the decode thread before its next step
+            with self._condition:
+                sequence.cancelled = True
+                if sequence in self._waiting:
+                    self._waiting.remove(sequence)
+                    self.stats["cancelled"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._condition:
+            stats = dict(self.stats)
+            steps = stats["steps"]
+            admitted = self._admitted
+            stats.update({
+                "queue_depth": len(self._waiting),
+                "active": len(self._active),
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+                "mean_batch_size": self._batch_total / steps if steps else 0.0,
+                "mean_queue_depth": self._queue_total / steps if steps else 0.0,
+                "mean_queue_wait_ms": self._wait_total / admitted * 1000 if admitted else 0.0
+            })
+            return stats
+
+    async def close(self):
+        """
+        Stop admitting requests and wait for the decode thread to wind down
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            await asyncio.to_thread(thread.join)
+
+    def _ensure_thread(self):
+        # Called with the condition held; a thread that could not create the
+        # engine clears itself, so the next request tries again
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="llm-batch", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            engine = self.engine_factory()
+        except Exception as e:
+            with self._condition:
+                waiting = list(self._waiting)
+                self._waiting.clear()
+                self.stats["failed"] += len(waiting)
+                self._thread = None
+            for sequence in waiting:
+                sequence.send(e)
+            return
+
+        try:
+            while self._gather():
+                self._admit(engine)
+                self._drop_cancelled(engine)
+                if self._active:
+                    self._step(engine)
+        finally:
+            self._shut_down(engine)
+
+    def _gather(self) -> bool:
+        """
+        Wait until there is work; False once the scheduler is closed
+        """
+        with self._condition:
+            if self._active:
+                return not self._closed
+
+            while not self._waiting and not self._closed:
+                self._condition.wait()
+
+            # An empty batch waits briefly so simultaneous requests start together
+            deadline = time.monotonic() + self.max_wait
+            while len(self._waiting) < self.max_batch and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return not self._closed
+
+    def _admit(self, engine: BatchEngine):
+        while True:
+            with self._condition:
+                if not self._waiting or not self._free_slots:
+                    return
+                sequence = self._waiting.popleft()
+                sequence.slot = self._free_slots.pop()
+
+            try:
+                state = engine.start(sequence.slot, sequence.request)
+                if state is None and not self._active:
+                    raise RuntimeError("the request does not fit in the model context")
+            except Exception as e:
+                with self._condition:
+                    self._free_slots.append(sequence.slot)
+                    self.stats["failed"] += 1
+                sequence.send(e)
+                continue
+
+            with self._condition:
+                if state is None:
+                    # No room until a running sequence finishes; keep its place
+                    self._free_slots.append(sequence.slot)
+                    if sequence.cancelled:
+                        self.stats["cancelled"] += 1
+                    else:
+                        self._waiting.appendleft(sequence)
+                    return
+                sequence.state = state
+                self._active.append(sequence)
+                self._admitted += 1
+                self._wait_total += time.monotonic() - sequence.enqueued_at
+
+    def _drop_cancelled(self, engine: BatchEngine):
+        for sequence in [sequence for sequence in self._active if sequence.cancelled]:
+            self._leave(engine, sequence, "cancelled")
+
+    def _step(self, engine: BatchEngine):
+        batch = list(self._active)
+        try:
+            results = engine.step([sequence.state for sequence in batch])
+        except Exception as e:
+            for sequence in batch:
+                self._leave(engine, sequence, "failed")
+                sequence.send(e)
+            return
+
+        with self._condition:
+            self.stats["steps"] += 1
+            self._batch_total += len(batch)
+            self._queue_total += len(self._waiting)
+
+        for sequence, (text, finished) in zip(batch, results):
+            if text:
+                self.stats["outputs"] += 1
+                sequence.send(text)
+            if finished:
+                self._leave(engine, sequence, "completed")
+                sequence.send(_FINISHED)
+
+    def _leave(self, engine: BatchEngine, sequence: _Sequence, outcome: str):
+        try:
+            engine.release(sequence.state)
+        except Exception as e:
+            print(f"Error releasing batch sequence: {e}")
+        with self._condition:
+            self._active.remove(sequence)
+            self._free_slots.append(sequence.slot)
+            self.stats[outcome] += 1
+
+    def _shut_down(self, engine: BatchEngine):
+        error = RuntimeError("the local model is shutting down")
+        for sequence in list(self._active):
+            self._leave(engine, sequence, "cancelled")
+            sequence.send(error)
+        with self._condition:
+            waiting = list(self._waiting)
+            self._waiting.clear()
+            self.stats["cancelled"] += len(waiting)
+        for sequence in waiting:
+            sequence.send(error)
@@ -0,0 +1,195 @@
+"""
+HTTP Client - Pooled async client for OpenAI-compatible chat completion APIs
+"""
+
+import json
+import random
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+# Upstream statuses worth retrying; anything else is returned to the caller
+RETRYABLE_STATUSES = frozenset([408, 425, 429, 500, 502, 503, 504])
+
+# Never wait longer than this between attempts, whatever Retry-After says
+MAX_BACKOFF_SECONDS = 8.0
+
+class LLMRequestError(Exception):
+    """
+    Raised when a completion request fails after all retries
+    """
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+class LLMHttpClient:
+    """
+    One keep-alive connection pool per upstream, shared by every request.
+
+    Requests go out on the event loop without blocking it, with separate
+    connect and read timeouts. Connection errors, timeouts, 429s and 5xx
+    responses are retried a bounded number of times with full-jitter
+    exponential backoff. HTTP/2 is used when the h2 package is installed.
+    The base URL is configurable, so a local stand-in server can take the
+    place of the real API; an httpx transport can be passed in to serve
+    requests without a network at all.
+    """
+
+    def __init__(self, base_url: str, api_key: str = "",
+                 headers: Optional[Dict[str, str]] = None,
+                 connect_timeout: float = 5.0,
+                 read_timeout: float = 60.0,
+                 max_retries: int = 2,
+                 backoff_base: float = 0.5,
+                 max_connections: int = 20,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.headers = dict(headers or {})
+        self.timeout = httpx.Timeout(connect=connect_timeout, read=read_timeout,
+                                     write=connect_timeout, pool=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_connections,
+                                   keepalive_expiry=30.0)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            headers = {"Content-Type": "application/json", **self.headers}
+            if self.api_key:
+                headers["Authorization"] = f"Bearer {self.api_key}"
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=headers,
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=_http2_available(),
+                transport=self.transport
+            )
+        return self._client
+
+    async def chat_completion(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        POST /chat/completions and return the decoded JSON body
+
+        Raises:
+            LLMRequestError: on a non-retryable status or when retries run out
+        """
+        last_error: Optional[LLMRequestError] = None
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = await self.client.post("/chat/completions", json=payload)
+                if response.status_code == 200:
+                    return response.json()
+
+                last_error = LLMRequestError(
+                    f"Error from AI service: {response.status_code}", response.status_code)
+                if response.status_code not in RETRYABLE_STATUSES:
+                    raise last_error
+                retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            except httpx.TransportError as e:
+                # Connect/read timeouts, refused or dropped connections
+                last_error = LLMRequestError(f"Error communicating with AI: {type(e).__name__}: {e}")
+
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+
+        raise last_error
+
+    async def stream_chat_completion(self, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        POST /chat/completions with stream=True and yield content deltas as they arrive
+
+        Failures before the first delta are retried like chat_completion;
+        once text has been yielded a failure is raised to the caller, since
+        replaying the request would repeat what was already sent.
+
+        Raises:
+            LLMRequestError: on a non-retryable status, when retries run out
+                or when the stream breaks part way through
+        """
+        payload = dict(payload, stream=True)
+        last_error: Optional[LLMRequestError] = None
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            started = False
+            try:
+                async with self.client.stream("POST", "/chat/completions", json=payload) as response:
+                    if response.status_code == 200:
+                        async for delta in _iter_sse_deltas(response):
+                            started = True
+                            yield delta
+                        return
+
+                    await response.aread()
+                    last_error = LLMRequestError(
+                        f"Error from AI service: {response.status_code}", response.status_code)
+                    if response.status_code not in RETRYABLE_STATUSES:
+                        raise last_error
+                    retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            except httpx.TransportError as e:
+                last_error = LLMRequestError(f"Error communicating with AI: {type(e).__name__}: {e}")
+                if started:
+                    raise last_error
+
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+
+        raise last_error
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(retry_after, MAX_BACKOFF_SECONDS)
+        # Full jitter keeps a burst of failing requests from retrying in lockstep
+        return random.uniform(0, min(MAX_BACKOFF_SECONDS, self.backoff_base * (2 ** attempt)))
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+async def _iter_sse_deltas(response: httpx.Response) -> AsyncIterator[str]:
+    """
+    Content deltas from an OpenAI-style server-sent event stream
+    """
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            # Blank separators and ": keep-alive" comments
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        try:
+            event = json.loads(data)
+        except json.JSONDecodeError:
+            continue
+        if "error" in event:
+            raise LLMRequestError(f"Error from AI service: {event['error']}")
+        for choice in event.get("choices", []):
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                yield content
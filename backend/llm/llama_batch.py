@@ -0,0 +1,342 @@
+"""
+Llama Batch - One llama.cpp context decoding many sequences per step
+"""
+
+import codecs
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .batch_scheduler import BatchEngine
+
+Messages = List[Dict[str, str]]
+
+# Sampling defaults of llama-cpp-python's create_chat_completion
+TOP_K = 40
+TOP_P = 0.95
+
+# Tokens per llama_decode call; longer prompts are evaluated in chunks
+DECODE_CHUNK_TOKENS = 512
+
+# The static prefix's KV cells belong to this sequence; requests use 1..max_batch
+PREFIX_SEQ_ID = 0
+
+def _kv_seq(op: str):
+    """
+    The llama.cpp function for a KV cache sequence operation ("rm" or "cp")
+
+    It has been renamed across llama-cpp-python releases: llama_kv_cache_*,
+    then llama_kv_self_*, then llama_memory_* on the context's memory.
+    """
+    import llama_cpp
+
+    memory_op = getattr(llama_cpp, f"llama_memory_seq_{op}", None)
+    if memory_op is not None:
+        return lambda ctx, *args: memory_op(llama_cpp.llama_get_memory(ctx), *args)
+    for name in (f"llama_kv_self_seq_{op}", f"llama_kv_cache_seq_{op}"):
+        kv_op = getattr(llama_cpp, name, None)
+        if kv_op is not None:
+            return kv_op
+    raise RuntimeError(f"llama-cpp-python has no KV cache sequence {op} function")
+
+def chat_formatter(llm) -> Callable[[Messages], Tuple[str, List[str], bool]]:
+    """
+    Render messages with the chat template stored in the GGUF file
+
+    Returns the prompt text, stop strings and whether the prompt already
+    contains the BOS token.
+    """
+    from llama_cpp import llama_chat_format
+
+    template = llm.metadata.get("tokenizer.chat_template")
+    if not template:
+        raise RuntimeError("batched generation needs a GGUF model with a chat template")
+
+    def token_text(token: int) -> str:
+        return llm.detokenize([token], special=True).decode("utf-8", errors="ignore")
+
+    formatter = llama_chat_format.Jinja2ChatFormatter(
+        template=template, eos_token=token_text(llm.token_eos()), bos_token=token_text(llm.token_bos())
+    )
+
+    def format_messages(messages: Messages) -> Tuple[str, List[str], bool]:
+        response = formatter(messages=messages)
+        stop = response.stop or []
+        if isinstance(stop, str):
+            stop = [stop]
+        return response.prompt, list(stop), bool(getattr(response, "added_special", False))
+
+    return format_messages
+
+class _SequenceState:
+    def __init__(self, seq_id: int, pending: List[int], n_past: int, max_tokens: int,
+                 reserved: int, temperature: float, stop: List[str]):
+        self.seq_id = seq_id
+        self.pending = pending
+        self.n_past = n_past
+        self.remaining = max_tokens
+        self.reserved = reserved
+        self.temperature = temperature
+        self.stop = [text for text in stop if text]
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self.unsent = ""
+
+    def feed(self, text: str) -> Tuple[str, bool]:
+        """
+        Text that can be sent, holding back what may be the start of a stop string
+        """
+        self.unsent += text
+        for stop in self.stop:
+            at = self.unsent.find(stop)
+            if at >= 0:
+                text, self.unsent = self.unsent[:at], ""
+                return text, True
+
+        hold = max((len(stop) - 1 for stop in self.stop), default=0)
+        cut = len(self.unsent) - hold
+        if cut <= 0:
+            return "", False
+        text, self.unsent = self.unsent[:cut], self.unsent[cut:]
+        return text, False
+
+    def flush(self) -> str:
+        text, self.unsent = self.unsent + self.decoder.decode(b"", final=True), ""
+        return text
+
+class LlamaBatchEngine(BatchEngine):
+    """
+    Decodes every sequence of a batch in one llama.cpp context.
+
+    The context is created on the already loaded model with one sequence id
+    per batch slot and the full thread count. All sequences share its n_ctx
+    KV cells, so a request is only started while its prompt and max_tokens
+    fit next to the running ones; alone in the context, its reply is
+    shortened to fit instead. Each step puts the prompt tokens of joining
+    sequences and the last sampled token of every running one into a
+    single llama_batch, so one llama_decode call advances all of them.
+
+    With a static prefix set, its tokens are evaluated once into a sequence
+    of their own and copied into each new sequence whose prompt starts with
+    them; the copies share the prefix's KV cells.
+    """
+
+    def __init__(self, llm, n_ctx: int, max_batch: int, n_threads: int,
+                 prefix_stats: Dict[str, Any], static_prefix: Optional[str] = None):
+        import llama_cpp
+
+        self.llm = llm
+        self.n_ctx = n_ctx
+        self.n_vocab = llm.n_vocab()
+        self.prefix_stats = prefix_stats
+        self.format_messages = chat_formatter(llm)
+
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = n_ctx
+        params.n_batch = DECODE_CHUNK_TOKENS
+        params.n_seq_max = max_batch + 1
+        params.n_threads = n_threads
+        params.n_threads_batch = n_threads
+        if hasattr(params, "kv_unified"):
+            # One cache shared by all sequences rather than n_ctx / n_seq_max each
+            params.kv_unified = True
+        new_context = getattr(llama_cpp, "llama_init_from_model", None) or llama_cpp.llama_new_context_with_model
+        self.ctx = new_context(llm.model, params)
+        if not self.ctx:
+            raise RuntimeError("Failed to create the batched llama.cpp context")
+        self._batch = llama_cpp.llama_batch_init(DECODE_CHUNK_TOKENS, 0, 1)
+        self._decode = llama_cpp.llama_decode
+        self._logits = llama_cpp.llama_get_logits_ith
+        self._seq_rm = _kv_seq("rm")
+        self._seq_cp = _kv_seq("cp")
+
+        vocab_is_eog = getattr(llama_cpp, "llama_vocab_is_eog", None)
+        if vocab_is_eog is not None:
+            vocab = llama_cpp.llama_model_get_vocab(llm.model)
+            self._is_eog = lambda token: vocab_is_eog(vocab, token)
+        else:
+            self._is_eog = lambda token: llama_cpp.llama_token_is_eog(llm.model, token)
+
+        self._rng = np.random.default_rng()
+        # KV cells promised to running sequences
+        self._reserved = 0
+        # Held by the scheduler's thread and by load() warming the prefix
+        self._lock = threading.Lock()
+
+        self.static_prefix = static_prefix
+        self._prefix_tokens: List[int] = []
+        self._prefix_ready = False
+
+    def set_static_prefix(self, prefix: Optional[str]):
+        with self._lock:
+            if prefix == self.static_prefix:
+                return
+            self.static_prefix = prefix
+            self._drop_prefix()
+
+    def warm_prefix(self):
+        with self._lock:
+            self._warm_prefix()
+
+    def start(self, slot: int, request: Any) -> Optional[_SequenceState]:
+        messages, temperature, max_tokens = request
+        with self._lock:
+            prompt, stop, added_special = self.format_messages(messages)
+            tokens = self.llm.tokenize(prompt.encode("utf-8"), add_bos=not added_special, special=True)
+            seq_id = slot + 1
+
+            shared = 0
+            if self._uses_prefix(messages):
+                self._warm_prefix()
+                n_prefix = len(self._prefix_tokens)
+                if self._prefix_ready and tokens[:n_prefix] == self._prefix_tokens:
+                    # At least one token is evaluated to get logits to sample from
+                    shared = min(n_prefix, len(tokens) - 1)
+
+            prompt_cells = len(tokens) - shared
+            room = self.n_ctx - len(self._prefix_tokens) - self._reserved
+            if prompt_cells + max_tokens > room:
+                if self._reserved:
+                    return None
+                max_tokens = room - prompt_cells
+                if max_tokens <= 0:
+                    raise ValueError(f"prompt of {len(tokens)} tokens does not fit in the {self.n_ctx} token context")
+
+            self._seq_rm(self.ctx, seq_id, -1, -1)
+            if shared:
+                self._seq_cp(self.ctx, PREFIX_SEQ_ID, seq_id, 0, shared)
+                self.prefix_stats["restored"] += 1
+
+            reserved = prompt_cells + max_tokens
+            self._reserved += reserved
+            return _SequenceState(seq_id, tokens[shared:], shared, max_tokens, reserved, temperature, stop)
+
+    def step(self, states: List[_SequenceState]) -> List[Tuple[str, bool]]:
+        with self._lock:
+            entries = []
+            for state in states:
+                last = len(state.pending) - 1
+                for offset, token in enumerate(state.pending):
+                    entries.append((state.seq_id, token, state.n_past + offset, offset == last))
+
+            sampled: Dict[int, int] = {}
+            owners = {state.seq_id: state for state in states}
+            for begin in range(0, len(entries), DECODE_CHUNK_TOKENS):
+                chunk = entries[begin:begin + DECODE_CHUNK_TOKENS]
+                self._decode_chunk(chunk)
+                # Logits are overwritten by the next chunk, so sample now
+                for index, (seq_id, _, _, wants_logits) in enumerate(chunk):
+                    if wants_logits:
+                        sampled[seq_id] = self._sample(index, owners[seq_id].temperature)
+
+            results = []
+            for state in states:
+                state.n_past += len(state.pending)
+                token = sampled[state.seq_id]
+                state.remaining -= 1
+                if self._is_eog(token):
+                    state.pending = []
+                    results.append((state.flush(), True))
+                    continue
+
+                state.pending = [token]
+                text, stopped = state.feed(state.decoder.decode(self.llm.detokenize([token])))
+                finished = stopped or state.remaining <= 0
+                if finished and not stopped:
+                    text += state.flush()
+                results.append((text, finished))
+            return results
+
+    def release(self, state: Optional[_SequenceState]):
+        if state is None:
+            return
+        with self._lock:
+            self._seq_rm(self.ctx, state.seq_id, -1, -1)
+            self._reserved -= state.reserved
+
+    def close(self):
+        import llama_cpp
+
+        with self._lock:
+            if self.ctx:
+                llama_cpp.llama_batch_free(self._batch)
+                llama_cpp.llama_free(self.ctx)
+                self.ctx = None
+
+    def _decode_chunk(self, chunk: List[Tuple[int, int, int, bool]]):
+        batch = self._batch
+        batch.n_tokens = len(chunk)
+        for index, (seq_id, token, position, wants_logits) in enumerate(chunk):
+            batch.token[index] = token
+            batch.pos[index] = position
+            batch.n_seq_id[index] = 1
+            batch.seq_id[index][0] = seq_id
+            batch.logits[index] = wants_logits
+        result = self._decode(self.ctx, batch)
+        if result != 0:
+            raise RuntimeError(f"llama_decode failed with status {result}")
+
+    def _sample(self, index: int, temperature: float) -> int:
+        logits = np.ctypeslib.as_array(self._logits(self.ctx, index), shape=(self.n_vocab,))
+        if temperature <= 0:
+            return int(np.argmax(logits))
+
+        top = np.argpartition(logits, -TOP_K)[-TOP_K:]
+        scaled = logits[top].astype("float64") / temperature
+        probabilities = np.exp(scaled - scaled.max())
+        probabilities /= probabilities.sum()
+
+        order = np.argsort(-probabilities)
+        kept = order[:int(np.searchsorted(np.cumsum(probabilities[order]), TOP_P)) + 1]
+        return int(top[self._rng.choice(kept, p=probabilities[kept] / probabilities[kept].sum())])
+
+    def _uses_prefix(self, messages: Messages) -> bool:
+        return bool(self.static_prefix) and bool(messages) and messages[0].get("role") == "system" \
+            and messages[0]["content"].startswith(self.static_prefix)
+
+    def _warm_prefix(self):
+        """
+        Evaluate the static prefix into its own sequence; called with the lock held
+
+        As with a single context, the token boundary after the prefix depends
+        on the chat template, so it is found from two probe prompts that
+        differ only after the prefix.
+        """
+        if self._prefix_ready or not self.static_prefix:
+            return
+
+        probes = []
+        for probe in ("A", "B"):
+            prompt, _, added_special = self.format_messages([
+                {"role": "system", "content": f"{self.static_prefix}\n{probe}"},
+                {"role": "user", "content": probe}
+            ])
+            probes.append(self.llm.tokenize(prompt.encode("utf-8"), add_bos=not added_special, special=True))
+
+        shared = 0
+        for a, b in zip(probes[0], probes[1]):
+            if a != b:
+                break
+            shared += 1
+        if shared == 0:
+            print("Static prompt prefix not shared between requests; prefix cache disabled")
+            self._prefix_ready = True
+            return
+        # The prefix needs cells of its own beside the running sequences
+        if shared + self._reserved >= self.n_ctx:
+            return
+
+        self._seq_rm(self.ctx, PREFIX_SEQ_ID, -1, -1)
+        tokens = probes[0][:shared]
+        for begin in range(0, shared, DECODE_CHUNK_TOKENS):
+            self._decode_chunk([(PREFIX_SEQ_ID, token, position, False)
+                                for position, token in enumerate(tokens[begin:begin + DECODE_CHUNK_TOKENS], begin)])
+        self._prefix_tokens = tokens
+        self._prefix_ready = True
+        self.prefix_stats["prefix_tokens"] = shared
+        print(f"Cached KV state for {shared} static prompt tokens in the batch context")
+
+    def _drop_prefix(self):
+        self._seq_rm(self.ctx, PREFIX_SEQ_ID, -1, -1)
+        self._prefix_tokens = []
+        self._prefix_ready = False
@@ -0,0 +1,177 @@
+"""
+Prompt Builder - Token-budgeted assembly of the chat messages sent to the LLM
+"""
+
+import math
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Tuple
+
+# Truncated text is marked so the model knows something was cut
+TRUNCATION_MARK = "..."
+
+# Wrapped around the question when knowledge base passages are included
+RAG_HEADER = "RELEVANT INFORMATION FROM KNOWLEDGE BASE:"
+QUESTION_LABEL = "STUDENT QUESTION: "
+
+# A truncated piece shorter than this is more noise than help and is dropped
+MIN_TRUNCATED_TOKENS = 32
+
+# Role markers and chat template tokens each message costs beyond its content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def approximate_token_count(text: str) -> int:
+    """
+    Rough token count for when no tokenizer is at hand (about 4 characters per token)
+    """
+    return math.ceil(len(text) / 4) if text else 0
+
+@dataclass
+class PromptUsage:
+    budget: int
+    tokens: Dict[str, int] = field(default_factory=dict)
+    truncated: List[str] = field(default_factory=list)
+    dropped: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def total(self) -> int:
+        return sum(self.tokens.values())
+
+    def summary(self) -> str:
+        parts = [f"{name}={count}" for name, count in self.tokens.items()]
+        line = f"prompt {self.total}/{self.budget} tokens ({', '.join(parts)})"
+        if self.truncated:
+            line += f", truncated: {', '.join(self.truncated)}"
+        if self.dropped:
+            line += ", dropped: " + ", ".join(f"{name} x{count}" for name, count in self.dropped.items())
+        return line
+
+class PromptBuilder:
+    """
+    Fills a fixed token budget with prompt parts in priority order.
+
+    The system prompt always goes in whole. After it come the student's
+    question, the knowledge base passages in rank order, the most recent
+    conversation turns and finally the learning context sections. Each
+    part is added whole while it fits. A question or passage that does not
+    fit is cut at a token boundary; history is taken newest first and stops
+    at the first turn that does not fit, so it stays contiguous; learning
+    context sections that do not fit are skipped. The same inputs always
+    give the same prompt.
+
+    Every message also costs MESSAGE_OVERHEAD_TOKENS for its role and
+    template markers, and every passage after the first and every context
+    section the line break that joins it to the one before, so the whole
+    prompt stays within the budget. If the
+    system prompt leaves no room for the question, build() raises
+    ValueError rather than send a prompt over budget.
+
+    The messages are laid out as before: system prompt and learning context
+    in the system message, then history, then passages and question in the
+    user message.
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int] = approximate_token_count,
+                 budget_tokens: int = 3000, max_history_entries: int = 6):
+        self.count_tokens = count_tokens
+        self.budget_tokens = budget_tokens
+        self.max_history_entries = max_history_entries
+
+    def build(self, system_prompt: str, question: str, rag_blocks: List[str],
+              history: List[Dict[str, str]], context_sections: List[str]) -> Tuple[List[Dict[str, str]], PromptUsage]:
+        usage = PromptUsage(budget=self.budget_tokens)
+        remaining = self.budget_tokens
+
+        # The system and user messages are always sent
+        usage.tokens["overhead"] = 2 * MESSAGE_OVERHEAD_TOKENS
+        remaining -= usage.tokens["overhead"]
+
+        # 1. System prompt, never cut: it defines the reply format
+        remaining -= self._spend(usage, "system", system_prompt)
+
+        # 2. The question itself
+        question_text = self._fit(question, remaining)
+        if question and not question_text:
+            raise ValueError(f"Prompt budget of {self.budget_tokens} tokens leaves no room for the "
+                             f"question after the {usage.tokens['system']} token system prompt")
+        if question_text != question:
+            usage.truncated.append("question")
+        remaining -= self._spend(usage, "question", question_text)
+
+        # 3. Knowledge base passages, best first
+        line_break = self.count_tokens("\n")
+        rag_included = []
+        # The header's line break already separates it from the first passage
+        wrapper_cost = self.count_tokens(f"{RAG_HEADER}\n\n\n{QUESTION_LABEL}") if rag_blocks else 0
+        remaining -= wrapper_cost
+        for block in rag_blocks:
+            joiner = line_break if rag_included else 0
+            text = self._fit(block, remaining - joiner)
+            if not text:
+                usage.dropped["rag"] = usage.dropped.get("rag", 0) + 1
+                continue
+            if text != block:
+                usage.truncated.append("rag")
+            rag_included.append(text)
+            remaining -= self._spend(usage, "rag", text) + joiner
+            usage.tokens["rag"] += joiner
+        if rag_included:
+            usage.tokens["rag"] += wrapper_cost
+        else:
+            remaining += wrapper_cost
+
+        # 4. Conversation history, newest first, without gaps
+        recent = history[-self.max_history_entries:] if self.max_history_entries else []
+        history_included = []
+        for position, entry in enumerate(reversed(recent)):
+            cost = self.count_tokens(entry["content"]) + MESSAGE_OVERHEAD_TOKENS
+            if cost > remaining:
+                usage.dropped["history"] = len(recent) - position
+                break
+            history_included.insert(0, entry)
+            remaining -= cost
+            usage.tokens["history"] = usage.tokens.get("history", 0) + cost
+
+        # 5. Learning context: emotion, knowledge assessment, progress
+        context_included = []
+        for section in context_sections:
+            # Each section goes on a line of its own after the system prompt
+            cost = self.count_tokens(section) + line_break
+            if cost > remaining:
+                usage.dropped["context"] = usage.dropped.get("context", 0) + 1
+                continue
+            context_included.append(section)
+            remaining -= cost
+            usage.tokens["context"] = usage.tokens.get("context", 0) + cost
+
+        if rag_included:
+            user_content = f"{RAG_HEADER}\n" + "\n".join(rag_included) + f"\n\n{QUESTION_LABEL}{question_text}"
+        else:
+            user_content = question_text
+
+        messages = [{"role": "system", "content": "\n".join([system_prompt] + context_included)}]
+        messages.extend(history_included)
+        messages.append({"role": "user", "content": user_content})
+        return messages, usage
+
+    def _spend(self, usage: PromptUsage, name: str, text: str) -> int:
+        cost = self.count_tokens(text) if text else 0
+        usage.tokens[name] = usage.tokens.get(name, 0) + cost
+        return cost
+
+    def _fit(self, text: str, max_tokens: int) -> str:
+        """
+        The longest prefix of text, marked as cut, that fits in max_tokens
+        """
+        if self.count_tokens(text) <= max_tokens:
+            return text
+        if max_tokens < MIN_TRUNCATED_TOKENS:
+            return ""
+
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(text[:middle] + TRUNCATION_MARK) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low] + TRUNCATION_MARK if low else ""
@@ -0,0 +1,149 @@
+"""
+Response Cache - Semantic cache of LLM replies keyed by query embedding and context
+"""
+
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend.rag.query_cache import normalize_query
+
+def context_fingerprint(**parts: Any) -> str:
+    """
+    Stable hash of the context inputs that change what the right answer is
+    """
+    encoded = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:16]
+
+@dataclass
+class CachedResponse:
+    fingerprint: str
+    query: str
+    vector: np.ndarray
+    response: str
+    created_at: float
+
+class SemanticResponseCache:
+    """
+    LLM replies reused for questions that mean the same thing.
+
+    Entries are grouped by context fingerprint, so a reply is only reused
+    under the same topic, knowledge level and knowledge base documents. A
+    lookup first tries the exact normalised query and otherwise compares
+    query embeddings within the group, counting a hit at or above the
+    similarity threshold. Entries expire after the TTL and the least
+    recently used are evicted beyond max_entries.
+    """
+
+    def __init__(self, embed: Callable[[str], np.ndarray],
+                 similarity_threshold: float = 0.92,
+                 ttl_seconds: float = 3600,
+                 max_entries: int = 1024):
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._entries: "OrderedDict[Tuple[str, str], CachedResponse]" = OrderedDict()
+        self._by_fingerprint: Dict[str, List[Tuple[str, str]]] = {}
+        self._lock = threading.Lock()
+
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    def lookup(self, query: str, fingerprint: str) -> Optional[str]:
+        query_key = normalize_query(query)
+        key = (fingerprint, query_key)
+
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["exact_hits"] += 1
+                return entry.response
+
+            candidates = [self._live_entry(candidate) for candidate in list(self._by_fingerprint.get(fingerprint, []))]
+            candidates = [candidate for candidate in candidates if candidate is not None]
+
+        if not candidates:
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+
+        vector = self._vector(query_key)
+        similarities = np.vstack([candidate.vector for candidate in candidates]) @ vector
+        best = int(np.argmax(similarities))
+
+        with self._lock:
+            if similarities[best] >= self.similarity_threshold:
+                best_key = (fingerprint, candidates[best].query)
+                if best_key in self._entries:
+                    self._entries.move_to_end(best_key)
+                self.stats["semantic_hits"] += 1
+                return candidates[best].response
+
+            self.stats["misses"] += 1
+            return None
+
+    def store(self, query: str, fingerprint: str, response: str):
+        query_key = normalize_query(query)
+        entry = CachedResponse(
+            fingerprint=fingerprint,
+            query=query_key,
+            vector=self._vector(query_key),
+            response=response,
+            created_at=time.time()
+        )
+        key = (fingerprint, query_key)
+
+        with self._lock:
+            if key not in self._entries:
+                self._by_fingerprint.setdefault(fingerprint, []).append(key)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                oldest_key, _ = self._entries.popitem(last=False)
+                self._forget(oldest_key)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_fingerprint.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+            stats["size"] = len(self._entries)
+            stats["hit_rate"] = (stats["exact_hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+            return stats
+
+    def _vector(self, query_key: str) -> np.ndarray:
+        return np.asarray(self.embed(query_key), dtype="float32").reshape(-1)
+
+    def _live_entry(self, key: Tuple[str, str]) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry.created_at > self.ttl_seconds:
+            del self._entries[key]
+            self._forget(key)
+            self.stats["expired"] += 1
+            return None
+        return entry
+
+    def _forget(self, key: Tuple[str, str]):
+        keys = self._by_fingerprint.get(key[0])
+        if keys is None:
+            return
+        if key in keys:
+            keys.remove(key)
+        if not keys:
+            del self._by_fingerprint[key[0]]
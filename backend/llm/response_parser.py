@@ -0,0 +1,341 @@
+"""
+Response Parser - Incremental, tolerant parsing of the tutor's JSON replies
+"""
+
+import re
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+EXPLANATION_KEY = "explanation"
+
+JSON_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+CODE_FENCE = "```"
+
+# How many earlier cut points to try when repairing a truncated reply
+MAX_REPAIR_ATTEMPTS = 32
+
+class TutorResponseParser:
+    """
+    Parses an LLM reply that should contain the tutor's JSON object.
+
+    Text is fed in as it arrives. A single pass tracks where the object
+    starts, string and nesting state, and the comma positions where it can
+    be cut cleanly, so the object is found inside ```json fences or chatty
+    preambles without rescanning. Braces that close something other than a
+    JSON object (e.g. "{ok}" in a preamble) are skipped and the search
+    goes on from the next "{". feed() returns the newly completed part of
+    the top-level "explanation" string for streaming. A reply that opens
+    with prose instead of JSON streams that prose until a "{" or code
+    fence appears; the prose is not part of the parsed object, so a reply
+    with no JSON at all is left to the caller to use as plain text.
+
+    result() returns the parsed object. Control characters inside strings
+    are accepted. An object that closes but does not parse (e.g. a trailing
+    comma) is repaired before anything nested in it is considered, and a
+    nested object only stands in for it if it has an "explanation". A reply
+    cut off mid-object is repaired by closing the open string and brackets,
+    falling back to the last comma at which everything before it was
+    complete.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+
+        # Object scanning state
+        self.start: Optional[int] = None
+        self.end: Optional[int] = None
+        self.position = 0
+        self.stack: List[str] = []
+        self.in_string = False
+        self.escaped = False
+        self.string_start = 0
+        self.key_state: Optional[str] = None  # "key" after a top-level "explanation", "colon" after its ':'
+        self.cut_points: List[Tuple[int, Tuple[str, ...]]] = []
+        self.parsed: Optional[Dict[str, Any]] = None
+        # End of the last object that closed but could not be parsed or
+        # repaired; objects starting before it are nested in it
+        self.failed_end = 0
+
+        # Explanation streaming state
+        self.mode: Optional[str] = None  # "json" or "prose" once the first character arrives
+        self.prose_emitted = 0
+        self.value_position: Optional[int] = None
+        self.value_finished = False
+        self.explanation_emitted = False
+
+    def feed(self, chunk: str) -> str:
+        """
+        Add reply text and return the explanation text it completes
+        """
+        self.buffer += chunk
+        self._scan()
+        return self._explanation_delta()
+
+    def result(self) -> Optional[Dict[str, Any]]:
+        """
+        The JSON object in the reply so far, repaired if cut off, or None
+        """
+        if self.start is None:
+            return None
+
+        if self.end is not None:
+            return self.parsed
+
+        for candidate in self._repair_candidates():
+            parsed = _load_object(candidate)
+            if parsed is not None and self._acceptable(parsed):
+                return parsed
+        return None
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def _scan(self):
+        buffer = self.buffer
+        i = self.position
+
+        while self.end is None:
+            if self.start is None:
+                i = buffer.find("{", i)
+                if i < 0:
+                    i = len(buffer)
+                    break
+                self.start = i
+                self.stack.append("{")
+                i += 1
+
+            if i >= len(buffer):
+                break
+
+            char = buffer[i]
+            i += 1
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    if len(self.stack) == 1 and buffer[self.string_start:i - 1] == EXPLANATION_KEY:
+                        self.key_state = "key"
+                continue
+            if char.isspace():
+                continue
+
+            # Only the top-level "explanation" value is streamed, not one
+            # nested in final_answer or the scene
+            key_state, self.key_state = self.key_state, None
+            if char == '"':
+                self.in_string = True
+                self.string_start = i
+                if key_state == "colon" and self.value_position is None:
+                    self.value_position = i
+            elif char == ":" and key_state == "key":
+                self.key_state = "colon"
+            elif char in "{[":
+                self.stack.append(char)
+            elif char in "}]":
+                if self.stack:
+                    self.stack.pop()
+                if not self.stack:
+                    self.end = i
+                    if not self._accept():
+                        # Not the tutor's object; look again from the next "{"
+                        self.failed_end = max(self.failed_end, i)
+                        i = self.start + 1
+                        self._reset_object()
+            elif char == ",":
+                self.cut_points.append((i - 1, tuple(self.stack)))
+
+        self.position = i
+
+    def _accept(self) -> bool:
+        text = self.buffer[self.start:self.end]
+        candidates = [text, _strip_trailing_commas(text)]
+        # Otherwise cut at the last comma after which the object broke
+        candidates.extend(self.buffer[self.start:index] + _closers(stack)
+                          for index, stack in reversed(self.cut_points[-MAX_REPAIR_ATTEMPTS:]))
+
+        for candidate in candidates:
+            parsed = _load_object(candidate)
+            if parsed is not None and self._acceptable(parsed):
+                self.parsed = parsed
+                return True
+        return False
+
+    def _acceptable(self, parsed: Dict[str, Any]) -> bool:
+        # An object inside one that failed, such as its final_answer, is not
+        # the reply unless it carries the tutor's explanation
+        return self.start >= self.failed_end or EXPLANATION_KEY in parsed
+
+    def _reset_object(self):
+        self.start = None
+        self.end = None
+        self.stack = []
+        self.in_string = False
+        self.escaped = False
+        self.key_state = None
+        self.cut_points = []
+        if not self.explanation_emitted:
+            self.value_position = None
+            self.value_finished = False
+
+    def _repair_candidates(self):
+        fragment = self.buffer[self.start:]
+
+        if self.in_string:
+            # Drop an escape sequence that was cut in half, then close the string
+            fragment = re.sub(r'\\u[0-9a-fA-F]{0,3}$', '', fragment)
+            if self.escaped:
+                fragment = fragment[:-1]
+            fragment += '"'
+
+        fragment = fragment.rstrip()
+        if fragment.endswith(","):
+            fragment = fragment[:-1]
+        elif fragment.endswith(":"):
+            fragment += "null"
+        yield fragment + _closers(self.stack)
+
+        for index, stack in reversed(self.cut_points[-MAX_REPAIR_ATTEMPTS:]):
+            yield self.buffer[self.start:index] + _closers(stack)
+
+    def _explanation_delta(self) -> str:
+        if self.mode is None:
+            stripped = self.buffer.lstrip()
+            if not stripped:
+                return ""
+            self.mode = "json" if stripped[0] in "{`" else "prose"
+
+        if self.mode == "prose":
+            text = self._prose_delta()
+            if self.mode == "prose":
+                return text
+            return text + self._json_delta()
+
+        return self._json_delta()
+
+    def _prose_delta(self) -> str:
+        # Plain text streams until something that looks like the JSON object
+        boundary = len(self.buffer)
+        for marker in ("{", CODE_FENCE):
+            found = self.buffer.find(marker, self.prose_emitted)
+            if found >= 0:
+                boundary = min(boundary, found)
+                self.mode = "json"
+
+        if self.mode == "prose":
+            # Hold back backticks that may be the start of a fence
+            while boundary > self.prose_emitted and self.buffer[boundary - 1] == "`":
+                boundary -= 1
+
+        text = self.buffer[self.prose_emitted:boundary]
+        self.prose_emitted = boundary
+        return text
+
+    def _json_delta(self) -> str:
+        if self.value_finished or self.value_position is None:
+            return ""
+
+        out, self.value_position, self.value_finished = _decode_string(self.buffer, self.value_position)
+        if out:
+            self.explanation_emitted = True
+        return out
+
+def _load_object(text: str) -> Optional[Dict[str, Any]]:
+    # strict=False: models often put raw newlines inside strings
+    try:
+        parsed = json.loads(text, strict=False)
+    except json.JSONDecodeError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+def _strip_trailing_commas(text: str) -> str:
+    """
+    text without commas that directly precede a closing bracket, outside strings
+    """
+    out = []
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+        out.append(char)
+    return "".join(out)
+
+def _closers(stack) -> str:
+    return "".join("}" if opener == "{" else "]" for opener in reversed(stack))
+
+def _decode_string(buffer: str, i: int) -> Tuple[str, int, bool]:
+    """
+    Decode JSON string content from i up to the closing quote or the end of
+    the buffer; returns the text, where decoding stopped and whether the
+    string is finished. Escapes cut off by the end of the buffer are left
+    for the next call.
+    """
+    out = []
+
+    while i < len(buffer):
+        char = buffer[i]
+        if char == '"':
+            return "".join(out), i + 1, True
+        if char != "\\":
+            out.append(char)
+            i += 1
+            continue
+
+        if i + 1 >= len(buffer):
+            break
+        escape = buffer[i + 1]
+        if escape != "u":
+            out.append(JSON_ESCAPES.get(escape, escape))
+            i += 2
+            continue
+
+        if i + 6 > len(buffer):
+            break
+        try:
+            code = int(buffer[i + 2:i + 6], 16)
+        except ValueError:
+            out.append(buffer[i:i + 6])
+            i += 6
+            continue
+        if 0xD800 <= code < 0xDC00:
+            # Characters outside the BMP arrive as a surrogate pair
+            if i + 12 > len(buffer):
+                break
+            try:
+                low = int(buffer[i + 8:i + 12], 16) if buffer[i + 6:i + 8] == "\\u" else 0
+            except ValueError:
+                low = 0
+            if 0xDC00 <= low < 0xE000:
+                out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                i += 12
+                continue
+            code = 0xFFFD
+        out.append(chr(code))
+        i += 6
+
+    return "".join(out), i, False
+
+def parse_tutor_response(text: str) -> Optional[Dict[str, Any]]:
+    """
+    The tutor's JSON object from a complete reply, or None if it has none
+    """
+    parser = TutorResponseParser()
+    parser.feed(text)
+    return parser.result()
@@ -0,0 +1,390 @@
+"""
+LLM Router - Health-aware routing, hedging and failover across LLM backends
+"""
+
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from .http_client import LLMRequestError
+from .backends import DeltaCallback, LLMBackend, LLMReply, Messages
+
+# Latency kinds tracked per backend: whole replies and time to the first streamed delta
+LATENCY_KINDS = ("complete", "first_token")
+
+# A p95 from fewer samples than this is noise; the default hedge delay is used instead
+MIN_P95_SAMPLES = 20
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+class BackendHealth:
+    """
+    Latency and error statistics of one backend, with its circuit breaker.
+
+    Latencies are kept as an EWMA and a window of recent samples for the
+    p95; the error rate is an EWMA over request outcomes. After
+    failure_threshold consecutive failures the circuit opens and the
+    backend gets no requests for cooldown seconds. Then a single trial
+    request is let through (half open): success closes the circuit, failure
+    opens it for another cooldown.
+    """
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30.0,
+                 alpha: float = 0.2, window: int = 200):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.alpha = alpha
+
+        self.latency_ewma: Dict[str, Optional[float]] = {kind: None for kind in LATENCY_KINDS}
+        self.latencies: Dict[str, Deque[float]] = {kind: deque(maxlen=window) for kind in LATENCY_KINDS}
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+
+        self.state = CIRCUIT_CLOSED
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+        self.counts = {"requests": 0, "successes": 0, "failures": 0, "cancelled": 0, "rejected": 0, "trips": 0}
+
+    def allow_request(self) -> bool:
+        """
+        Whether the breaker lets a request through now; counts it if so
+        """
+        if self.state == CIRCUIT_OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = CIRCUIT_HALF_OPEN
+
+        if self.state == CIRCUIT_OPEN or (self.state == CIRCUIT_HALF_OPEN and self.trial_in_flight):
+            self.counts["rejected"] += 1
+            return False
+
+        if self.state == CIRCUIT_HALF_OPEN:
+            self.trial_in_flight = True
+        self.counts["requests"] += 1
+        return True
+
+    def record_success(self, kind: str, latency: float):
+        self.counts["successes"] += 1
+        previous = self.latency_ewma[kind]
+        self.latency_ewma[kind] = latency if previous is None else previous + self.alpha * (latency - previous)
+        self.latencies[kind].append(latency)
+        self.error_rate *= 1 - self.alpha
+
+        self.consecutive_failures = 0
+        self.state = CIRCUIT_CLOSED
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.counts["failures"] += 1
+        self.error_rate += self.alpha * (1 - self.error_rate)
+        self.consecutive_failures += 1
+
+        if self.state == CIRCUIT_HALF_OPEN or (
+                self.state == CIRCUIT_CLOSED and self.consecutive_failures >= self.failure_threshold):
+            if self.state == CIRCUIT_CLOSED:
+                self.counts["trips"] += 1
+            self.state = CIRCUIT_OPEN
+            self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+    def cancel_request(self):
+        """
+        A request was abandoned before it finished, e.g. it lost a hedge race
+
+        It says nothing about the backend's health, but a trial request
+        that was cancelled must not keep the circuit half open forever.
+        """
+        self.counts["cancelled"] += 1
+        self.trial_in_flight = False
+
+    def p95(self, kind: str) -> Optional[float]:
+        samples = self.latencies[kind]
+        if len(samples) < MIN_P95_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def describe(self) -> Dict[str, Any]:
+        latency = {}
+        for kind in LATENCY_KINDS:
+            if self.latency_ewma[kind] is None:
+                continue
+            p95 = self.p95(kind)
+            latency[kind] = {
+                "ewma_ms": round(self.latency_ewma[kind] * 1000, 1),
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                "samples": len(self.latencies[kind])
+            }
+
+        return {
+            "circuit": self.state,
+            "error_rate": round(self.error_rate, 3),
+            "consecutive_failures": self.consecutive_failures,
+            "latency": latency,
+            **self.counts
+        }
+
+class _Member:
+    def __init__(self, label: str, backend: LLMBackend, health: BackendHealth):
+        self.label = label
+        self.backend = backend
+        self.health = health
+
+class LLMRouter(LLMBackend):
+    """
+    Sends each request to the best of several backends.
+
+    Backends are tried in the configured order of preference, skipping
+    unavailable ones and those whose circuit breaker is open. If the chosen
+    backend has not answered by its p95 latency (for streams: time to the
+    first delta), a hedged request goes to the next backend and whichever
+    answers first wins; the other request is cancelled. A failed request
+    fails over to the next backend. Degraded backends (the mock) are never
+    hedged to, only failed over to, so a slow answer is not replaced by a
+    canned one.
+
+    Once a stream has produced text it is committed to its backend: an error
+    after that point is raised to the caller rather than retried elsewhere.
+    """
+
+    name = "router"
+
+    def __init__(self, members: List[Tuple[str, LLMBackend]], hedge: bool = True,
+                 hedge_default: float = 2.0, hedge_min: float = 0.25,
+                 failure_threshold: int = 3, cooldown: float = 30.0):
+        if not members:
+            raise ValueError("LLMRouter needs at least one backend")
+
+        self.members = [_Member(label, backend, BackendHealth(failure_threshold, cooldown))
+                        for label, backend in members]
+        self.hedge = hedge
+        self.hedge_default = hedge_default
+        self.hedge_min = hedge_min
+
+        self.stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "failovers": 0, "exhausted": 0}
+
+    @property
+    def available(self) -> bool:
+        return any(member.backend.available for member in self.members)
+
+    def load(self):
+        for member in self.members:
+            if member.backend.available:
+                member.backend.load()
+
+    def count_tokens(self, text: str) -> int:
+        # Prompts are budgeted for the preferred backend's tokenizer
+        for member in self.members:
+            if member.backend.available:
+                return member.backend.count_tokens(text)
+        return super().count_tokens(text)
+
+    def set_static_prefix(self, prefix: str):
+        for member in self.members:
+            member.backend.set_static_prefix(prefix)
+
+    async def complete(self, messages: Messages, temperature: float = 0.7, max_tokens: int = 1000) -> str:
+        _, text = await self._complete(messages, temperature, max_tokens)
+        return text
+
+    async def stream(self, messages: Messages, temperature: float = 0.7,
+                     max_tokens: int = 1000) -> AsyncIterator[str]:
+        member, first, deltas = await self._open_stream(messages, temperature, max_tokens)
+        async for delta in self._relay(member, first, deltas):
+            yield delta
+
+    async def reply(self, messages: Messages, temperature: float = 0.7, max_tokens: int = 1000,
+                    on_delta: Optional[DeltaCallback] = None) -> LLMReply:
+        # Degraded or not depends on the member that answered, not the router
+        if on_delta is None:
+            member, text = await self._complete(messages, temperature, max_tokens)
+            return LLMReply.from_text(text, member.backend.degraded)
+
+        member, first, deltas = await self._open_stream(messages, temperature, max_tokens)
+        return await LLMReply.from_stream(self._relay(member, first, deltas), on_delta, member.backend.degraded)
+
+    async def _complete(self, messages: Messages, temperature: float, max_tokens: int) -> Tuple[_Member, str]:
+        async def attempt(backend: LLMBackend) -> str:
+            return await backend.complete(messages, temperature, max_tokens)
+
+        async def discard(text: str):
+            pass
+
+        return await self._race("complete", attempt, discard)
+
+    async def _open_stream(self, messages: Messages, temperature: float,
+                           max_tokens: int) -> Tuple[_Member, str, AsyncIterator[str]]:
+        """
+        Race the backends to the first delta; returns the winner, that delta and the rest of its stream
+        """
+        async def attempt(backend: LLMBackend):
+            deltas = backend.stream(messages, temperature, max_tokens)
+            try:
+                first = await deltas.__anext__()
+            except StopAsyncIteration:
+                first = ""
+            except BaseException:
+                await deltas.aclose()
+                raise
+            return first, deltas
+
+        async def discard(opened):
+            await opened[1].aclose()
+
+        member, (first, deltas) = await self._race("first_token", attempt, discard)
+        return member, first, deltas
+
+    async def _relay(self, member: _Member, first: str, deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+        try:
+            if first:
+                yield first
+            async for delta in deltas:
+                yield delta
+        except Exception:
+            member.health.record_failure()
+            raise
+        finally:
+            await deltas.aclose()
+
+    async def close(self):
+        for member in self.members:
+            try:
+                await member.backend.close()
+            except Exception as e:
+                print(f"Error closing LLM backend {member.label}: {e}")
+
+    def describe(self) -> Dict[str, Any]:
+        info = super().describe()
+        info.update({
+            "hedging": self.hedge,
+            "stats": dict(self.stats),
+            "members": [
+                {"label": member.label, **member.backend.describe(), "health": member.health.describe()}
+                for member in self.members
+            ]
+        })
+        return info
+
+    def _hedge_delay(self, member: _Member, kind: str) -> float:
+        p95 = member.health.p95(kind)
+        return max(self.hedge_min, p95 if p95 is not None else self.hedge_default)
+
+    async def _race(self, kind: str, attempt: Callable[[LLMBackend], Awaitable[Any]],
+                    discard: Callable[[Any], Awaitable[None]]) -> Tuple[_Member, Any]:
+        """
+        Run attempt on backends in preference order, hedging and failing over
+
+        Returns the winning member and its result. Results of attempts that
+        finish after the winner are handed to discard.
+        """
+        self.stats["requests"] += 1
+        candidates = [member for member in self.members if member.backend.available]
+        pending: Dict[asyncio.Future, Tuple[_Member, float]] = {}
+        errors: List[str] = []
+        first_task = None
+        position = 0
+        can_hedge = self.hedge
+
+        def launch(hedging: bool) -> bool:
+            nonlocal position
+            while position < len(candidates):
+                member = candidates[position]
+                if hedging and getattr(member.backend, "degraded", False):
+                    return False
+                position += 1
+                if member.health.allow_request():
+                    task = asyncio.ensure_future(attempt(member.backend))
+                    pending[task] = (member, time.perf_counter())
+                    return True
+            return False
+
+        if launch(hedging=False):
+            first_task = next(iter(pending))
+
+        try:
+            while pending:
+                timeout = None
+                if can_hedge and len(pending) == 1 and position < len(candidates):
+                    member, started = next(iter(pending.values()))
+                    timeout = max(0.0, started + self._hedge_delay(member, kind) - time.perf_counter())
+
+                done, _ = await asyncio.wait(list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if launch(hedging=True):
+                        self.stats["hedged"] += 1
+                    else:
+                        # Nothing left to hedge to; wait for the request in flight
+                        can_hedge = False
+                    continue
+
+                winner = None
+                for task in done:
+                    member, started = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        member.health.record_failure()
+                        errors.append(f"{member.label}: {e}")
+                        continue
+
+                    member.health.record_success(kind, time.perf_counter() - started)
+                    if winner is None:
+                        winner = (member, result)
+                        if task is not first_task:
+                            self.stats["hedge_wins"] += 1
+                    else:
+                        await discard(result)
+
+                if winner is not None:
+                    return winner
+
+                if not pending and launch(hedging=False):
+                    self.stats["failovers"] += 1
+
+            self.stats["exhausted"] += 1
+            if not errors:
+                raise LLMRequestError("Error from AI service: no backend is available or accepting requests")
+            raise LLMRequestError("Error from every AI backend: " + "; ".join(errors))
+        finally:
+            await self._abandon(pending, discard)
+
+    async def _abandon(self, pending: Dict[asyncio.Future, Tuple[_Member, float]],
+                       discard: Callable[[Any], Awaitable[None]]):
+        """
+        Cancel the attempts that lost the race and release anything they opened
+        """
+        if not pending:
+            return
+
+        tasks = list(pending)
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        for task, result in zip(tasks, results):
+            pending[task][0].health.cancel_request()
+            if not isinstance(result, BaseException):
+                # Finished before the cancellation landed
+                await discard(result)
+
+def create_router(members: List[Tuple[str, LLMBackend]]) -> LLMRouter:
+    """
+    Build a router over the given backends from environment settings
+
+    LLM_HEDGE ("1" or "0") turns hedged requests on or off; a hedge is sent
+    once the first backend passes its p95 latency, or LLM_HEDGE_DEFAULT_MS
+    until enough samples exist, but never before LLM_HEDGE_MIN_MS. A backend's
+    circuit opens after LLM_BREAKER_FAILURES consecutive failures and stays
+    open for LLM_BREAKER_COOLDOWN seconds.
+    """
+    return LLMRouter(
+        members,
+        hedge=os.environ.get("LLM_HEDGE", "1") != "0",
+        hedge_default=float(os.environ.get("LLM_HEDGE_DEFAULT_MS", "2000")) / 1000,
+        hedge_min=float(os.environ.get("LLM_HEDGE_MIN_MS", "250")) / 1000,
+        failure_threshold=int(os.environ.get("LLM_BREAKER_FAILURES", "3")),
+        cooldown=float(os.environ.get("LLM_BREAKER_COOLDOWN", "30"))
+    )
@@ -0,0 +1,139 @@
+"""
+Single Flight - Coalescing of identical concurrent LLM requests
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+DeltaCallback = Callable[[str], Awaitable[None]]
+
+# Deltas a listener may fall behind by before it is dropped from the stream
+LISTENER_QUEUE_SIZE = 256
+
+class _Listener:
+    """
+    One caller's stream: a queue of deltas drained by its own task, so a
+    slow callback only ever delays that caller
+    """
+
+    def __init__(self, callback: DeltaCallback):
+        self.callback = callback
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.ensure_future(self._pump())
+
+    def offer(self, text: str) -> bool:
+        """
+        Queue a delta, or return False if the listener is too far behind
+        """
+        if self.task.done() or self.queue.qsize() >= LISTENER_QUEUE_SIZE:
+            return False
+        self.queue.put_nowait(text)
+        return True
+
+    def close(self):
+        # The end marker goes past the bound so a full queue still drains
+        self.queue.put_nowait(None)
+
+    def cancel(self):
+        self.task.cancel()
+
+    async def _pump(self):
+        while True:
+            text = await self.queue.get()
+            if text is None:
+                return
+            try:
+                await self.callback(text)
+            except Exception as e:
+                print(f"Dropping stream listener: {e}")
+                return
+
+class _Flight:
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.deltas: List[str] = []
+        self.listeners: List[_Listener] = []
+
+class SingleFlight:
+    """
+    Runs one call per key at a time and shares its result with every
+    caller that asks for the same key while it is in flight.
+
+    The call runs as its own task, so a caller that goes away (a closed
+    WebSocket) does not cancel it for the others. Streamed deltas are fanned
+    out to every caller that wants them through a bounded queue per caller;
+    a caller joining late first receives the text produced so far, and one
+    that falls too far behind stops receiving deltas but still gets the result.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.stats = {"calls": 0, "coalesced": 0, "dropped_listeners": 0}
+
+    async def run(self, key: str, func: Callable[[DeltaCallback], Awaitable[Any]],
+                  on_delta: Optional[DeltaCallback] = None) -> Tuple[Any, bool]:
+        """
+        Result of func for this key, and whether this caller started the call
+
+        func receives a callback to pass its streamed deltas to.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.stats["coalesced"] += 1
+            listener = self._subscribe(flight, on_delta) if on_delta is not None else None
+            return await self._result(flight, listener), False
+
+        flight = _Flight()
+        listener = self._subscribe(flight, on_delta) if on_delta is not None else None
+
+        async def fan_out(text: str):
+            flight.deltas.append(text)
+            for subscriber in list(flight.listeners):
+                if not subscriber.offer(text):
+                    self._drop(flight, subscriber)
+
+        async def call():
+            try:
+                return await func(fan_out)
+            finally:
+                self._flights.pop(key, None)
+                for subscriber in flight.listeners:
+                    subscriber.close()
+
+        self.stats["calls"] += 1
+        flight.task = asyncio.ensure_future(call())
+        self._flights[key] = flight
+        return await self._result(flight, listener), True
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["in_flight"] = len(self._flights)
+        return stats
+
+    def _subscribe(self, flight: _Flight, on_delta: DeltaCallback) -> _Listener:
+        # The text produced so far is queued before the listener is visible
+        # to fan_out, so newer deltas cannot overtake it
+        listener = _Listener(on_delta)
+        produced = "".join(flight.deltas)
+        if produced:
+            listener.offer(produced)
+        flight.listeners.append(listener)
+        return listener
+
+    def _drop(self, flight: _Flight, listener: _Listener):
+        if listener in flight.listeners:
+            flight.listeners.remove(listener)
+            self.stats["dropped_listeners"] += 1
+            print("Dropping stream listener that fell behind")
+        listener.cancel()
+
+    async def _result(self, flight: _Flight, listener: Optional[_Listener]) -> Any:
+        try:
+            result = await asyncio.shield(flight.task)
+            if listener is not None:
+                # Deliver this caller's remaining deltas before its final reply
+                await asyncio.wait([listener.task])
+            return result
+        finally:
+            if listener is not None:
+                listener.cancel()
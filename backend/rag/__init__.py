@@ -0,0 +1,41 @@
+"""
+RAG Package - Storage and ingestion building blocks for the RAG system
+"""
+
+from .vector_index import VectorIndex, IndexConfig, evaluate_index_configs
+from .extraction import extract_pages, chunk_text
+from .manifest import DocumentManifest
+from .ingestion import IngestionPool, PageResult
+from .embeddings import Embedder, EmbeddingCache
+from .bm25_index import BM25Index, tokenize, keyword_confidences, fuse_relevance
+from .query_cache import LRUCache, normalize_query
+from .chunk_store import ChunkStore, DocumentChunk
+from .reranker import CrossEncoderReranker
+from .partitions import PartitionedIndex, partition_key
+from .jobs import IngestionJobQueue, IngestionJob
+
+__all__ = [
+    'VectorIndex',
+    'IndexConfig',
+    'evaluate_index_configs',
+    'extract_pages',
+    'chunk_text',
+    'DocumentManifest',
+    'IngestionPool',
+    'PageResult',
+    'Embedder',
+    'EmbeddingCache',
+    'BM25Index',
+    'tokenize',
+    'keyword_confidences',
+    'fuse_relevance',
+    'LRUCache',
+    'normalize_query',
+    'ChunkStore',
+    'DocumentChunk',
+    'CrossEncoderReranker',
+    'PartitionedIndex',
+    'partition_key',
+    'IngestionJobQueue',
+    'IngestionJob'
+]
@@ -0,0 +1,305 @@
+"""
+RAG Benchmark - Recall, latency, build time and memory of retrieval configurations
+
+Run from the repository root:
+
+    python -m backend.rag.benchmark --queries rag_queries.json --output results.json
+
+The query file is a JSON list of labelled queries. A chunk is relevant when
+it comes from the named document (title or file name) and, if pages are
+given, from one of those pages. Optional "subject" and "grade" fields are
+passed to retrieve() as partition filters:
+
+    [
+        {
+            "query": "How do you add fractions with unlike denominators?",
+            "relevant": [{"document": "Grade5_Mathematics-145-289", "pages": [12, 13]}]
+        }
+    ]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import contextlib
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from backend.rag.vector_index import INDEX_TYPES
+from backend.rag_system import (
+    RAGSystem,
+    DocumentChunk,
+    RAG_DOCS_DIR,
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_CACHE_PATH
+)
+
+def load_queries(path: str) -> List[Dict[str, Any]]:
+    with open(path, 'r', encoding="utf-8") as f:
+        queries = json.load(f)
+
+    for position, item in enumerate(queries):
+        if not item.get("query") or not item.get("relevant"):
+            raise ValueError(f"Query {position} needs a 'query' and a non-empty 'relevant' list")
+    return queries
+
+def resident_memory_bytes() -> Optional[int]:
+    """
+    Current resident set size of this process, or None where it cannot be read
+    """
+    try:
+        import psutil
+        return int(psutil.Process().memory_info().rss)
+    except ImportError:
+        pass
+
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _matches(chunk: DocumentChunk, label: Dict[str, Any], rag: RAGSystem) -> bool:
+    doc = rag.documents.get(chunk.doc_id)
+    names = {chunk.title}
+    if doc is not None:
+        names.add(os.path.basename(doc.original_file))
+        names.add(os.path.splitext(os.path.basename(doc.original_file))[0])
+    if label["document"] not in names:
+        return False
+
+    pages = label.get("pages")
+    return not pages or chunk.page in pages
+
+def score_query(results: List[Any], relevant: List[Dict[str, Any]], rag: RAGSystem) -> Dict[str, float]:
+    """
+    Recall and reciprocal rank of one query's results
+
+    Recall counts how many of the labelled (document, pages) targets are hit
+    by at least one returned chunk.
+    """
+    found = set()
+    first_hit = None
+    for rank, (chunk, _) in enumerate(results, start=1):
+        for position, label in enumerate(relevant):
+            if _matches(chunk, label, rag):
+                found.add(position)
+                if first_hit is None:
+                    first_hit = rank
+
+    return {
+        "recall": len(found) / len(relevant),
+        "reciprocal_rank": 1.0 / first_hit if first_hit else 0.0
+    }
+
+def latency_summary(latencies_ms: List[float]) -> Dict[str, float]:
+    values = np.asarray(latencies_ms, dtype="float64")
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "mean": float(values.mean()),
+        "max": float(values.max())
+    }
+
+def run_queries(rag: RAGSystem, queries: List[Dict[str, Any]], k: int, repeats: int) -> Dict[str, Any]:
+    """
+    Time retrieve() for every query and score its results.
+
+    Caches are cleared before each call so latency reflects a first-time
+    question, query embedding included.
+    """
+    latencies_ms = []
+    recalls = []
+    reciprocal_ranks = []
+
+    for item in queries:
+        results = []
+        for _ in range(repeats):
+            rag.query_embedding_cache.clear()
+            rag.retrieval_cache.clear()
+            started = time.perf_counter()
+            results = rag.retrieve(item["query"], top_k=k,
+                                   subject=item.get("subject"), grade=item.get("grade"))
+            latencies_ms.append((time.perf_counter() - started) * 1000)
+
+        scores = score_query(results, item["relevant"], rag)
+        recalls.append(scores["recall"])
+        reciprocal_ranks.append(scores["reciprocal_rank"])
+
+    return {
+        f"recall@{k}": float(np.mean(recalls)),
+        "mrr": float(np.mean(reciprocal_ranks)),
+        "latency_ms": latency_summary(latencies_ms)
+    }
+
+def benchmark_embedding_model(model_name: str, docs_dir: str, queries: List[Dict[str, Any]],
+                              index_types: List[str], k: int, repeats: int,
+                              embedding_cache_path: Optional[str], workdir: str,
+                              keyword_shortcut: bool = False) -> List[Dict[str, Any]]:
+    """
+    Index the documents once with the given embedding model, then measure
+    every index type over the same vectors
+
+    Memory per run is the index's own footprint from memory_usage(), plus
+    the resident growth from ingesting the documents, which is the same for
+    every index type of the model.
+
+    The keyword shortcut is off unless asked for: queries it answers never
+    reach the vector index, which would hide the differences between index
+    types.
+    """
+    model_dir = os.path.join(workdir, model_name.replace("/", "_"))
+
+    rag = RAGSystem(
+        docs_dir=docs_dir,
+        index_path=os.path.join(model_dir, "vector_store", "index.faiss"),
+        store_dir=os.path.join(model_dir, "document_store"),
+        embedding_model=model_name,
+        embedding_cache_path=embedding_cache_path
+    )
+    rag.keyword_shortcut = keyword_shortcut
+    try:
+        # Baseline after the embedder and reranker are loaded, so the delta
+        # is what ingesting the documents adds
+        rag.warm_up()
+        rss_before = resident_memory_bytes()
+
+        started = time.perf_counter()
+        scan = rag.scan_documents_folder()
+        ingest_seconds = time.perf_counter() - started
+        rss_after = resident_memory_bytes()
+        ingest_delta = rss_after - rss_before if rss_after is not None and rss_before is not None else None
+
+        runs = []
+        for index_type in index_types:
+            started = time.perf_counter()
+            rag.rebuild_index(index_type)
+            build_seconds = time.perf_counter() - started
+
+            run = {
+                "embedding_model": model_name,
+                "embedding_dimension": rag.embedding_dimension,
+                "index_type": index_type,
+                "built_type": rag.vector_index.index_type,
+                "keyword_shortcut": keyword_shortcut,
+                "documents": scan["total_docs"],
+                "vectors": rag.vector_index.live_count,
+                "ingest_seconds": ingest_seconds,
+                "build_seconds": build_seconds
+            }
+            run.update(run_queries(rag, queries, k, repeats))
+
+            # The index types share one process, so its resident size mixes
+            # in whatever earlier builds left behind; only the index's own
+            # footprint is comparable between them
+            run["memory"] = dict(rag.vector_index.memory_usage())
+            run["memory"]["ingest_resident_delta_bytes"] = ingest_delta
+            runs.append(run)
+
+            print(f"{model_name} / {index_type}: recall@{k}={run[f'recall@{k}']:.3f} "
+                  f"mrr={run['mrr']:.3f} p95={run['latency_ms']['p95']:.1f}ms")
+        return runs
+    finally:
+        rag.ingestion_pool.shutdown()
+        if rag.embedder.cache is not None:
+            rag.embedder.cache.close()
+
+def run_benchmark(queries_path: str, docs_dir: str = RAG_DOCS_DIR,
+                  index_types: Optional[List[str]] = None,
+                  embedding_models: Optional[List[str]] = None,
+                  k: int = 3, repeats: int = 3,
+                  cold_embeddings: bool = False,
+                  keyword_shortcut: bool = False) -> Dict[str, Any]:
+    """
+    Benchmark every (embedding model, index type) pair against a labelled query set
+
+    Document embeddings come from the shared on-disk cache unless
+    cold_embeddings is set, in which case ingest time includes embedding
+    every chunk from scratch. With keyword_shortcut set, decisive keyword
+    matches skip the vector search as they do in the tutor, which measures
+    the retrieval path end to end rather than the index types.
+    """
+    queries = load_queries(queries_path)
+    index_types = index_types or list(INDEX_TYPES)
+    embedding_models = embedding_models or [EMBEDDING_MODEL_NAME]
+
+    unknown = [index_type for index_type in index_types if index_type not in INDEX_TYPES]
+    if unknown:
+        raise ValueError(f"Unknown index types: {', '.join(unknown)}")
+
+    workdir = tempfile.mkdtemp(prefix="rag_benchmark_")
+    try:
+        cache_path = os.path.join(workdir, "embedding_cache.sqlite") if cold_embeddings else EMBEDDING_CACHE_PATH
+        runs = []
+        for model_name in embedding_models:
+            runs.extend(benchmark_embedding_model(
+                model_name, docs_dir, queries, index_types, k, repeats, cache_path, workdir,
+                keyword_shortcut
+            ))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "docs_dir": docs_dir,
+        "queries_file": queries_path,
+        "queries": len(queries),
+        "k": k,
+        "repeats": repeats,
+        "cold_embeddings": cold_embeddings,
+        "keyword_shortcut": keyword_shortcut,
+        "runs": runs
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark RAG retrieval quality and speed")
+    parser.add_argument("--queries", required=True, help="JSON file of labelled queries")
+    parser.add_argument("--docs-dir", default=RAG_DOCS_DIR, help="Documents to index")
+    parser.add_argument("--index-types", default=",".join(INDEX_TYPES),
+                        help="Comma-separated index types to compare")
+    parser.add_argument("--embedding-models", default=EMBEDDING_MODEL_NAME,
+                        help="Comma-separated sentence-transformers models to compare")
+    parser.add_argument("-k", type=int, default=3, help="Results per query (the tutor uses 3)")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed calls per query")
+    parser.add_argument("--cold-embeddings", action="store_true",
+                        help="Embed every chunk instead of using the shared embedding cache")
+    parser.add_argument("--keyword-shortcut", action="store_true",
+                        help="Let decisive keyword matches skip the vector search, as in the tutor")
+    parser.add_argument("--output", help="Write results JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    # Without --output stdout carries only the results JSON; progress and
+    # the RAG system's own messages go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run_benchmark(
+            args.queries,
+            docs_dir=args.docs_dir,
+            index_types=[name.strip() for name in args.index_types.split(",") if name.strip()],
+            embedding_models=[name.strip() for name in args.embedding_models.split(",") if name.strip()],
+            k=args.k,
+            repeats=args.repeats,
+            cold_embeddings=args.cold_embeddings,
+            keyword_shortcut=args.keyword_shortcut
+        )
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, 'w', encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote benchmark results to {args.output}")
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+"""
+BM25 Index - Compact inverted index for keyword retrieval over chunks
+"""
+
+import os
+import re
+import json
+import math
+import heapq
+import threading
+from array import array
+from collections import defaultdict
+from typing import AbstractSet, Dict, Iterable, List, Optional, Set, Tuple
+
+# Numbers, fractions and decimals are kept whole ("5/8", "2.5") as well as split
+TOKEN_PATTERN = re.compile(r"\d+(?:[./]\d+)?|[a-z]+")
+
+STOPWORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for",
+    "from", "how", "i", "in", "is", "it", "me", "my", "of", "on", "or", "so",
+    "that", "the", "this", "to", "was", "what", "when", "where", "which", "who",
+    "why", "will", "with", "you", "your"
+])
+
+# Relevance a perfect keyword match contributes on the cosine scale. It stays
+# below the 0.7 relevance cut retrieval results are held to, so matching words
+# alone never make a chunk relevant; they only lift chunks the embeddings
+# already rate as related
+KEYWORD_MAX_CONFIDENCE = 0.6
+
+# Prune tombstoned chunks from the postings once they make up this much of the index
+PRUNE_DEAD_FRACTION = 0.2
+# save() keeps appending to the journal until it has this many entries or more
+# entries than the index has chunks, then writes a fresh snapshot instead
+JOURNAL_MIN_ENTRIES = 1000
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word and number tokens with stopwords removed
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if "/" in token or "." in token:
+            tokens.extend(part for part in re.split(r"[./]", token) if part)
+    return tokens
+
+class BM25Index:
+    """
+    Inverted index with Okapi BM25 scoring.
+
+    Each term's postings are two flat typed arrays (chunk ids and term
+    frequencies) rather than per-posting Python objects, which keeps the
+    index a small fraction of the size of the chunk text it covers.
+
+    Removal only tombstones chunk ids, which searches skip; their postings
+    are pruned in one pass once enough of the index is dead. save() appends
+    the adds and removes since the last save to a journal next to the
+    snapshot, and only rewrites the snapshot once the journal outgrows it.
+    """
+
+    def __init__(self, index_path: str, k1: float = 1.5, b: float = 0.75):
+        self.index_path = index_path
+        self.journal_path = os.path.splitext(index_path)[0] + ".journal"
+        self.k1 = k1
+        self.b = b
+
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.doc_lengths: Dict[int, int] = {}
+        self.total_length = 0
+        self.tombstones: Set[int] = set()
+        self._lock = threading.RLock()
+
+        # Changes not yet written, entries already in the journal file, and
+        # whether the snapshot must be rewritten regardless (after clear())
+        self._pending: List[dict] = []
+        self._journal_entries = 0
+        self._rewrite = False
+
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, chunk_id: int, text: str):
+        tokens = tokenize(text)
+        term_counts: Dict[str, int] = defaultdict(int)
+        for token in tokens:
+            term_counts[token] += 1
+
+        with self._lock:
+            self._add_terms(chunk_id, term_counts, len(tokens))
+            self._pending.append({"add": chunk_id, "terms": term_counts, "length": len(tokens)})
+
+    def remove(self, chunk_ids: Iterable[int]):
+        with self._lock:
+            removed = self._remove_ids(chunk_ids)
+            if removed:
+                self._pending.append({"remove": removed})
+
+    def search(self, query: str, k: int,
+               allowed: Optional[AbstractSet[int]] = None) -> List[Tuple[int, float, float]]:
+        """
+        Score chunks against the query, only those in allowed if it is given
+
+        Returns:
+            Up to k (chunk id, BM25 score, fraction of query terms matched), best first
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        with self._lock:
+            n_docs = len(self.doc_lengths)
+            if not n_docs:
+                return []
+            avg_length = self.total_length / n_docs
+            scores: Dict[int, float] = defaultdict(float)
+            matched: Dict[int, int] = defaultdict(int)
+
+            for term in terms:
+                if term not in self.postings:
+                    continue
+                ids, tfs = self.postings[term]
+                idf = math.log(1 + (n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+
+                for chunk_id, tf in zip(ids, tfs):
+                    if allowed is not None and chunk_id not in allowed:
+                        continue
+                    length = self.doc_lengths.get(chunk_id)
+                    if length is None:
+                        continue
+                    length_norm = 1 - self.b + self.b * length / (avg_length or 1.0)
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+                    matched[chunk_id] += 1
+
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(chunk_id, score, matched[chunk_id] / len(terms)) for chunk_id, score in top]
+
+    def clear(self):
+        with self._lock:
+            self.postings = {}
+            self.doc_lengths = {}
+            self.total_length = 0
+            self.tombstones = set()
+            self._pending = []
+            self._rewrite = True
+
+    def save(self):
+        """
+        Append pending changes to the journal, or write a fresh snapshot once
+        the journal holds more entries than the index has chunks
+        """
+        with self._lock:
+            journal_entries = self._journal_entries + len(self._pending)
+            if self._rewrite or journal_entries > max(JOURNAL_MIN_ENTRIES, len(self.doc_lengths)):
+                self._write_snapshot()
+            elif self._pending:
+                with open(self.journal_path, 'a', encoding="utf-8") as f:
+                    for entry in self._pending:
+                        f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+                self._journal_entries = journal_entries
+                self._pending = []
+
+    def _add_terms(self, chunk_id: int, term_counts: Dict[str, int], length: int):
+        if chunk_id in self.doc_lengths:
+            self._remove_ids([chunk_id])
+        if chunk_id in self.tombstones:
+            # Its old postings are still in place; drop them before adding new ones
+            self._prune()
+
+        for term, count in term_counts.items():
+            ids, tfs = self.postings.setdefault(term, (array("q"), array("H")))
+            ids.append(chunk_id)
+            tfs.append(min(count, 65535))
+
+        self.doc_lengths[chunk_id] = length
+        self.total_length += length
+
+    def _remove_ids(self, chunk_ids: Iterable[int]) -> List[int]:
+        removed = [chunk_id for chunk_id in chunk_ids if chunk_id in self.doc_lengths]
+        for chunk_id in removed:
+            self.total_length -= self.doc_lengths.pop(chunk_id)
+            self.tombstones.add(chunk_id)
+
+        if len(self.tombstones) > PRUNE_DEAD_FRACTION * (len(self.doc_lengths) + len(self.tombstones)):
+            self._prune()
+        return removed
+
+    def _prune(self):
+        """
+        Drop tombstoned chunks from every posting list
+        """
+        if not self.tombstones:
+            return
+
+        for term in list(self.postings):
+            ids, tfs = self.postings[term]
+            keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in self.tombstones]
+            if len(keep) == len(ids):
+                continue
+            if keep:
+                self.postings[term] = (array("q", (ids[i] for i in keep)),
+                                       array("H", (tfs[i] for i in keep)))
+            else:
+                del self.postings[term]
+        self.tombstones = set()
+
+    def _write_snapshot(self):
+        self._prune()
+        data = {
+            "doc_lengths": self.doc_lengths,
+            "postings": {term: [ids.tolist(), tfs.tolist()] for term, (ids, tfs) in self.postings.items()}
+        }
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, self.index_path)
+
+        # Replaying a journal over the snapshot it was folded into is harmless,
+        # so a crash before this unlink loses nothing
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._journal_entries = 0
+        self._pending = []
+        self._rewrite = False
+
+    def _load(self):
+        if not os.path.exists(self.index_path) and not os.path.exists(self.journal_path):
+            return
+
+        try:
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'r', encoding="utf-8") as f:
+                    data = json.load(f)
+
+                self.doc_lengths = {int(chunk_id): length for chunk_id, length in data["doc_lengths"].items()}
+                self.total_length = sum(self.doc_lengths.values())
+                self.postings = {
+                    term: (array("q", ids), array("H", tfs))
+                    for term, (ids, tfs) in data["postings"].items()
+                }
+            self._replay_journal()
+        except Exception as e:
+            print(f"Error loading keyword index: {e}")
+            self.clear()
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+
+        with open(self.journal_path, 'r', encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A save cut short leaves a partial last line; the chunk
+                    # store reconciliation rebuilds whatever it lost
+                    break
+                if "add" in entry:
+                    self._add_terms(entry["add"], entry["terms"], entry["length"])
+                else:
+                    self._remove_ids(entry["remove"])
+                self._journal_entries += 1
+
+def keyword_confidences(hits: List[Tuple[int, float, float]],
+                        max_confidence: float = KEYWORD_MAX_CONFIDENCE) -> Dict[int, float]:
+    """
+    Map BM25 hits onto [0, max_confidence], scaled by score relative to the
+    best hit and by how many query terms each hit covers
+    """
+    if not hits:
+        return {}
+
+    best_score = hits[0][1]
+    return {
+        chunk_id: max_confidence * (score / best_score) * coverage
+        for chunk_id, score, coverage in hits
+    }
+
+def fuse_relevance(cosine: float, keyword: float) -> float:
+    """
+    Relevance of a chunk from its cosine similarity and keyword confidence
+
+    Each signal raises the other's shortfall, so a keyword match lifts a
+    moderately similar chunk over the cut while a chunk the embeddings rate
+    as unrelated stays at most at the keyword confidence.
+    """
+    cosine = max(0.0, cosine)
+    return 1 - (1 - cosine) * (1 - keyword)
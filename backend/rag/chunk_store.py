@@ -0,0 +1,289 @@
+"""
+Chunk Store - Append-only chunk text file with a fixed-width offset table
+"""
+
+import os
+import json
+import mmap
+import struct
+import threading
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional
+
+import numpy as np
+
+# Per record: doc id, title and content byte lengths, followed by the UTF-8 bytes
+RECORD_HEADER = struct.Struct("<HHI")
+
+# One row per vector id; length 0 marks an id with no chunk
+TABLE_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4"), ("page", "<i4")])
+
+# Rewrite the data file on save once dead records take up this much of it
+COMPACT_DEAD_FRACTION = 0.5
+
+@dataclass
+class DocumentChunk:
+    vector_id: int
+    doc_id: str
+    title: str
+    page: int
+    content: str
+
+class ChunkStore:
+    """
+    Chunk text and metadata for every vector id, kept on disk.
+
+    Records are appended to a data file that is read through mmap, and a
+    table of (offset, length, page) rows indexed directly by vector id says
+    where each one lives. Nothing per chunk is held as a Python object:
+    get() decodes a single record on demand, so a process only pays for the
+    chunks it actually returns, and forked workers share the mapped pages.
+
+    A small JSON file names the current data and table files and holds the
+    next free vector id. Removed records stay in the data file until enough
+    of it is dead, then save() writes fresh files and switches over.
+    """
+
+    def __init__(self, meta_path: str):
+        self.meta_path = meta_path
+        self.store_dir = os.path.dirname(meta_path) or "."
+        self.next_vector_id = 0
+
+        self.data_path: Optional[str] = None
+        self.table_path: Optional[str] = None
+        self.table = np.zeros(0, dtype=TABLE_DTYPE)
+        self.live_count = 0
+        self.dead_bytes = 0
+
+        self._data_file = None
+        self._map: Optional[mmap.mmap] = None
+        self._lock = threading.RLock()
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._load()
+
+    def __len__(self) -> int:
+        return self.live_count
+
+    def __contains__(self, vector_id: int) -> bool:
+        return 0 <= vector_id < len(self.table) and self.table[vector_id]["length"] > 0
+
+    def allocate_ids(self, count: int) -> List[int]:
+        with self._lock:
+            ids = list(range(self.next_vector_id, self.next_vector_id + count))
+            self.next_vector_id += count
+            return ids
+
+    def put(self, vector_id: int, doc_id: str, title: str, page: int, content: str):
+        doc_bytes = doc_id.encode("utf-8")
+        title_bytes = title.encode("utf-8")
+        content_bytes = content.encode("utf-8")
+        record = RECORD_HEADER.pack(len(doc_bytes), len(title_bytes), len(content_bytes)) \
+            + doc_bytes + title_bytes + content_bytes
+
+        with self._lock:
+            if vector_id in self:
+                self.remove([vector_id])
+
+            self._data_file.seek(0, os.SEEK_END)
+            offset = self._data_file.tell()
+            self._data_file.write(record)
+            self._data_file.flush()
+
+            self._ensure_table_size(vector_id + 1)
+            self.table[vector_id] = (offset, len(record), page)
+            self.live_count += 1
+            self.next_vector_id = max(self.next_vector_id, vector_id + 1)
+
+    def get(self, vector_id: int) -> Optional[DocumentChunk]:
+        with self._lock:
+            if vector_id not in self:
+                return None
+            offset, length, page = self.table[vector_id].tolist()
+            record = self._read(offset, length)
+
+        doc_length, title_length, content_length = RECORD_HEADER.unpack_from(record)
+        start = RECORD_HEADER.size
+        doc_id = record[start:start + doc_length].decode("utf-8")
+        start += doc_length
+        title = record[start:start + title_length].decode("utf-8")
+        start += title_length
+        content = record[start:start + content_length].decode("utf-8")
+
+        return DocumentChunk(vector_id=vector_id, doc_id=doc_id, title=title, page=page, content=content)
+
+    def set_page(self, vector_id: int, page: int):
+        with self._lock:
+            if vector_id in self:
+                self.table["page"][vector_id] = page
+
+    def remove(self, vector_ids: Iterable[int]):
+        with self._lock:
+            for vector_id in vector_ids:
+                if vector_id in self:
+                    self.dead_bytes += int(self.table["length"][vector_id])
+                    self.table["length"][vector_id] = 0
+                    self.live_count -= 1
+
+    def ids(self) -> List[int]:
+        """
+        Live vector ids in ascending order
+        """
+        with self._lock:
+            return np.flatnonzero(self.table["length"] > 0).tolist()
+
+    def iter_chunks(self) -> Iterator[DocumentChunk]:
+        for vector_id in self.ids():
+            chunk = self.get(vector_id)
+            if chunk is not None:
+                yield chunk
+
+    def clear(self):
+        with self._lock:
+            self.table = np.zeros(0, dtype=TABLE_DTYPE)
+            self.live_count = 0
+            self._switch_files(b"")
+
+    def save(self):
+        """
+        Persist the offset table, compacting the data file first if it is mostly dead
+        """
+        with self._lock:
+            data_size = os.path.getsize(self.data_path)
+            if data_size and self.dead_bytes / data_size >= COMPACT_DEAD_FRACTION:
+                self._compact()
+                return
+
+            self._data_file.flush()
+            os.fsync(self._data_file.fileno())
+            tmp_path = self.table_path + ".tmp"
+            self.table.tofile(tmp_path)
+            os.replace(tmp_path, self.table_path)
+            self._save_meta()
+
+    def close(self):
+        with self._lock:
+            self._unmap()
+            if self._data_file is not None:
+                self._data_file.close()
+                self._data_file = None
+
+    def _load(self):
+        meta = {}
+        if os.path.exists(self.meta_path):
+            try:
+                with open(self.meta_path, 'r', encoding="utf-8") as f:
+                    meta = json.load(f)
+            except Exception as e:
+                print(f"Error loading chunk store: {e}")
+
+        data_file = meta.get("data_file")
+        table_file = meta.get("table_file")
+        if data_file and table_file:
+            self.data_path = os.path.join(self.store_dir, data_file)
+            self.table_path = os.path.join(self.store_dir, table_file)
+
+        if self.data_path and os.path.exists(self.data_path) and os.path.exists(self.table_path):
+            self.next_vector_id = meta.get("next_vector_id", 0)
+            # The table is 16 bytes per id; the chunk text is what stays mapped
+            self.table = np.fromfile(self.table_path, dtype=TABLE_DTYPE)
+            lengths = self.table["length"]
+            self.live_count = int(np.count_nonzero(lengths))
+            self.dead_bytes = os.path.getsize(self.data_path) - int(lengths.sum(dtype="uint64"))
+            self._data_file = open(self.data_path, "r+b")
+            return
+
+        self._switch_files(b"")
+        if "chunks" in meta:
+            self._import_json_chunks(meta)
+
+    def _import_json_chunks(self, data: dict):
+        """
+        Migrate the old chunks.json layout of one JSON object per chunk
+        """
+        for chunk in data["chunks"]:
+            self.put(chunk["vector_id"], chunk["doc_id"], chunk["title"], chunk["page"], chunk["content"])
+        self.next_vector_id = max(self.next_vector_id, data.get("next_vector_id", 0))
+        self.save()
+        print(f"Migrated {self.live_count} chunks from JSON to the chunk store")
+
+    def _compact(self):
+        live_ids = self.ids()
+        parts = []
+        table = np.zeros(len(self.table), dtype=TABLE_DTYPE)
+        offset = 0
+        for vector_id in live_ids:
+            old_offset, length, page = self.table[vector_id].tolist()
+            parts.append(self._read(old_offset, length))
+            table[vector_id] = (offset, length, page)
+            offset += length
+
+        reclaimed = self.dead_bytes
+        self.table = table
+        self._switch_files(b"".join(parts))
+        print(f"Compacted chunk store: {len(live_ids)} chunks, {reclaimed} bytes reclaimed")
+
+    def _switch_files(self, data: bytes):
+        """
+        Write data and the current table to new files and point the store at them.
+
+        New files get new names so a file that is still mapped is never
+        overwritten in place.
+        """
+        stem = os.path.splitext(self.meta_path)[0]
+        generation = 0
+        while os.path.exists(f"{stem}.{generation}.bin"):
+            generation += 1
+        data_path = f"{stem}.{generation}.bin"
+        table_path = f"{stem}.{generation}.idx"
+
+        with open(data_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.table.tofile(table_path)
+
+        old_paths = [self.data_path, self.table_path]
+        self.close()
+        self.data_path = data_path
+        self.table_path = table_path
+        self.table = np.array(self.table)
+        self.dead_bytes = 0
+        self._data_file = open(self.data_path, "r+b")
+        self._save_meta()
+
+        for path in old_paths:
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"Could not remove old chunk store file {path}: {e}")
+
+    def _save_meta(self):
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, 'w', encoding="utf-8") as f:
+            json.dump({
+                "next_vector_id": self.next_vector_id,
+                "data_file": os.path.basename(self.data_path),
+                "table_file": os.path.basename(self.table_path)
+            }, f, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    def _ensure_table_size(self, size: int):
+        if size <= len(self.table):
+            return
+        grown = np.zeros(max(size, 2 * len(self.table), 1024), dtype=TABLE_DTYPE)
+        grown[:len(self.table)] = self.table
+        self.table = grown
+
+    def _read(self, offset: int, length: int) -> bytes:
+        if self._map is None or offset + length > len(self._map):
+            # Appended since the file was mapped
+            self._unmap()
+            self._map = mmap.mmap(self._data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map[offset:offset + length]
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
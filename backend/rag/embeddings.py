@@ -0,0 +1,155 @@
+"""
+Embeddings - Batched sentence embedding with a content-addressed on-disk cache
+"""
+
+import os
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+EMBED_BATCH_SIZE = 256
+
+# SQLite limits the number of bound parameters per statement
+LOOKUP_CHUNK_SIZE = 500
+
+class EmbeddingCache:
+    """
+    On-disk store of chunk vectors keyed by a hash of the model name and text.
+
+    Keys do not depend on document, page or position, so identical chunks are
+    only ever embedded once, and the cache outlives index rebuilds and
+    chunking changes.
+    """
+
+    def __init__(self, cache_path: str, model_name: str):
+        self.cache_path = cache_path
+        self.model_name = model_name
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def key_for(self, text: str) -> str:
+        normalized = " ".join(text.split())
+        return hashlib.sha256(f"{self.model_name}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+                batch = keys[start:start + LOOKUP_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype="float32")
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]):
+        if not items:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype="float32").tobytes()) for key, vector in items.items()]
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class Embedder:
+    """
+    Wraps the sentence-transformers model so documents are embedded in large
+    batches and only chunks missing from the embedding cache hit the model
+    """
+
+    def __init__(self, model_name: str, cache_path: Optional[str] = None,
+                 batch_size: int = EMBED_BATCH_SIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache = EmbeddingCache(cache_path, model_name) if cache_path else None
+        self._model: Optional[SentenceTransformer] = None
+        self._load_lock = threading.Lock()
+
+        self.stats = {"cache_hits": 0, "cache_misses": 0}
+
+    @property
+    def model(self) -> SentenceTransformer:
+        """
+        Sentence embedding model, loaded on first use to keep startup fast
+
+        Concurrent first uses wait for one load instead of each loading a copy.
+        """
+        with self._load_lock:
+            if self._model is None:
+                print(f"Loading embedding model {self.model_name}...")
+                self._model = SentenceTransformer(self.model_name, device="cpu")
+            return self._model
+
+    @property
+    def dimension(self) -> int:
+        return int(self.model.get_sentence_embedding_dimension())
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed chunk texts, serving repeats from the cache and batching the rest
+
+        Returns:
+            float32 array of normalised vectors, one row per input text
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+
+        if self.cache is None:
+            return self._encode(texts)
+
+        keys = [self.cache.key_for(text) for text in texts]
+        vectors = self.cache.get_many(list(set(keys)))
+
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+
+        self.stats["cache_hits"] += len(texts) - len(missing)
+        self.stats["cache_misses"] += len(missing)
+
+        if missing:
+            encoded = self._encode(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), encoded))
+            self.cache.put_many(new_vectors)
+            vectors.update(new_vectors)
+
+        return np.vstack([vectors[key] for key in keys]).astype("float32", copy=False)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """
+        Embed a single query; queries are not worth persisting
+        """
+        return self._encode([text])
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        vectors = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        return np.asarray(vectors, dtype="float32")
@@ -0,0 +1,121 @@
+"""
+Text Extraction - Pulls page text out of knowledge base documents and chunks it
+"""
+
+import os
+import re
+import shutil
+import subprocess
+from typing import List, Optional
+
+import pytesseract
+from PIL import Image
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+POPPLER_PATH = os.path.join("Extensions", "poppler-24.08.0", "Library", "bin")
+TESSERACT_CMD = os.path.join("Extensions", "Tesseract-OCR", "tesseract.exe")
+
+OCR_DPI = 300
+
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 100
+
+def find_poppler_tool(name: str) -> str:
+    """
+    Locate a poppler executable, preferring the copy bundled under Extensions/
+    """
+    for candidate in (name + ".exe", name):
+        bundled = os.path.join(POPPLER_PATH, candidate)
+        if os.path.isfile(bundled):
+            return bundled
+
+    found = shutil.which(name)
+    if found:
+        return found
+
+    raise FileNotFoundError(f"Poppler tool '{name}' not found in {POPPLER_PATH} or on PATH")
+
+def _poppler_dir() -> Optional[str]:
+    # pdf2image falls back to PATH when no directory is given
+    return POPPLER_PATH if os.path.isdir(POPPLER_PATH) else None
+
+if os.path.isfile(TESSERACT_CMD):
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+
+def extract_pages(filepath: str) -> List[str]:
+    """
+    Extract the text of each page of a plain text document
+
+    PDFs are extracted page by page by the ingestion pool instead, through
+    extract_pdf_page_text and OCR.
+
+    Returns:
+        One string per page; plain text files are treated as a single page
+    """
+    if filepath.lower().endswith(".pdf"):
+        raise ValueError(f"PDF pages are extracted by the ingestion pool: {filepath}")
+
+    with open(filepath, "r", encoding="utf-8", errors="replace") as f:
+        return [f.read()]
+
+def get_pdf_page_count(filepath: str) -> int:
+    info = pdfinfo_from_path(filepath, poppler_path=_poppler_dir())
+    return int(info["Pages"])
+
+def extract_pdf_page_text(filepath: str, page_number: int) -> str:
+    """
+    Extract the text layer of a single PDF page (1-based)
+    """
+    page = str(page_number)
+    result = subprocess.run(
+        [find_poppler_tool("pdftotext"), "-layout", "-enc", "UTF-8", "-f", page, "-l", page, filepath, "-"],
+        capture_output=True,
+        check=True
+    )
+    return result.stdout.decode("utf-8", errors="replace").replace("\f", "")
+
+def rasterize_pdf_page(filepath: str, page_number: int, dpi: int = OCR_DPI) -> Image.Image:
+    """
+    Render a single PDF page (1-based) to a greyscale image for OCR
+    """
+    images = convert_from_path(
+        filepath,
+        dpi=dpi,
+        first_page=page_number,
+        last_page=page_number,
+        grayscale=True,
+        poppler_path=_poppler_dir()
+    )
+    return images[0]
+
+def ocr_image(image: Image.Image) -> str:
+    return pytesseract.image_to_string(image)
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """
+    Split text into overlapping chunks, breaking on whitespace where possible
+    """
+    text = re.sub(r"\s+", " ", text).strip()
+    if not text:
+        return []
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            split_at = text.rfind(" ", start + chunk_size // 2, end)
+            if split_at > start:
+                end = split_at
+
+        chunks.append(text[start:end].strip())
+
+        if end >= len(text):
+            break
+
+        # Start the next chunk on a word boundary inside the overlap window
+        next_start = max(end - overlap, start + 1)
+        boundary = text.find(" ", next_start, end)
+        start = boundary + 1 if boundary != -1 else next_start
+
+    return [chunk for chunk in chunks if chunk]
@@ -0,0 +1,133 @@
+"""
+Ingestion Pool - Page-level PDF extraction and OCR across worker processes
+"""
+
+import os
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import FrozenSet, Iterable, Iterator, Optional
+
+from backend.rag.extraction import (
+    extract_pages,
+    get_pdf_page_count,
+    extract_pdf_page_text,
+    rasterize_pdf_page,
+    ocr_image
+)
+from backend.rag.manifest import hash_text
+
+# Pages with less text than this are treated as scanned images
+MIN_TEXT_LAYER_CHARS = 20
+
+@dataclass
+class PageResult:
+    page: int
+    hash: str
+    text: Optional[str]  # None when the page hash was already known to the caller
+    method: str  # "text" or "ocr"
+
+def process_pdf_page(filepath: str, page_number: int,
+                     known_hashes: FrozenSet[str] = frozenset()) -> PageResult:
+    """
+    Extract one PDF page, using the text layer when there is one and OCR otherwise.
+
+    Scanned pages are hashed on their rendered pixels before OCR, so a page the
+    caller already has indexed never goes through Tesseract again.
+    """
+    text = extract_pdf_page_text(filepath, page_number)
+    if len(text.strip()) >= MIN_TEXT_LAYER_CHARS:
+        page_hash = hash_text(text)
+        return PageResult(
+            page=page_number,
+            hash=page_hash,
+            text=None if page_hash in known_hashes else text,
+            method="text"
+        )
+
+    image = rasterize_pdf_page(filepath, page_number)
+    page_hash = "ocr:" + hashlib.sha256(image.tobytes()).hexdigest()
+    if page_hash in known_hashes:
+        return PageResult(page=page_number, hash=page_hash, text=None, method="ocr")
+
+    return PageResult(page=page_number, hash=page_hash, text=ocr_image(image), method="ocr")
+
+def _init_worker():
+    # Each worker handles one page at a time; keep Tesseract from spawning
+    # its own thread pool on top of ours
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+class IngestionPool:
+    """
+    Process pool that extracts document pages in parallel.
+
+    Pages are yielded as soon as each one finishes rather than in page order,
+    so the embedding stage can start on early pages while later ones are
+    still being rasterised and OCR'd.
+
+    Workers are spawned rather than forked: forking a process that already
+    runs torch, whisper and faiss threads can copy a held lock into the
+    child and deadlock it. The pool is created by the thread that builds
+    the IngestionPool, not lazily from an ingestion worker thread.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        self._executor: Optional[ProcessPoolExecutor] = self._new_executor()
+
+    def page_count(self, filepath: str) -> int:
+        if not filepath.lower().endswith(".pdf"):
+            return len(extract_pages(filepath))
+        return get_pdf_page_count(filepath)
+
+    def iter_pages(self, filepath: str, known_hashes: Iterable[str] = (),
+                   page_count: Optional[int] = None) -> Iterator[PageResult]:
+        """
+        Yield a PageResult for every page of the document as it completes
+        """
+        known_hashes = frozenset(known_hashes)
+
+        if not filepath.lower().endswith(".pdf"):
+            for page_number, text in enumerate(extract_pages(filepath), start=1):
+                page_hash = hash_text(text)
+                yield PageResult(
+                    page=page_number,
+                    hash=page_hash,
+                    text=None if page_hash in known_hashes else text,
+                    method="text"
+                )
+            return
+
+        if page_count is None:
+            page_count = get_pdf_page_count(filepath)
+        executor = self._get_executor()
+        futures = [
+            executor.submit(process_pdf_page, filepath, page_number, known_hashes)
+            for page_number in range(1, page_count + 1)
+        ]
+
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # Stop queued pages if the consumer gave up early or a page failed
+            for future in futures:
+                future.cancel()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            raise RuntimeError("the ingestion pool has been shut down")
+        return self._executor
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker
+        )
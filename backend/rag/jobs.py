@@ -0,0 +1,168 @@
+"""
+Ingestion Jobs - Bounded background queue for document ingestion with progress
+"""
+
+import time
+import uuid
+import asyncio
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from typing import Any, Callable, Dict, List, Optional
+
+# Job work functions receive a progress callback taking (done, total)
+JobFunc = Callable[[Callable[[int, int], None]], Dict[str, Any]]
+
+FINISHED_STATUSES = ("completed", "failed", "superseded")
+
+@dataclass
+class IngestionJob:
+    id: str
+    kind: str
+    target: str
+    status: str = "queued"
+    progress: float = 0.0
+    done: int = 0
+    total: int = 0
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+class IngestionJobQueue:
+    """
+    Runs ingestion work off the event loop with a fixed number of workers.
+
+    Each job's function runs in a worker thread so extraction and embedding
+    never block request handling; progress updates from that thread are
+    plain attribute writes that status polls read back. Finished jobs are
+    kept for polling until the history limit pushes them out.
+
+    RAGSystem.ingest_file holds the index lock for the whole file, so more
+    than one worker would only park threads on that lock; the default is a
+    single worker, with page extraction parallelised by the ingestion pool.
+    """
+
+    def __init__(self, max_concurrent: int = 1, max_history: int = 100):
+        self.max_concurrent = max_concurrent
+        self.max_history = max_history
+
+        self.jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._funcs: Dict[str, JobFunc] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the worker tasks; must be called from the running event loop
+        """
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker())
+            for _ in range(self.max_concurrent)
+        ]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, kind: str, target: str, func: JobFunc) -> IngestionJob:
+        if self._queue is None:
+            raise RuntimeError("Job queue has not been started")
+
+        job = IngestionJob(id=uuid.uuid4().hex[:12], kind=kind, target=target)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._funcs[job.id] = func
+            self._trim_history()
+        self._queue.put_nowait(job.id)
+        return job
+
+    def find_active(self, kind: str, target: str) -> Optional[IngestionJob]:
+        """
+        The queued or running job of this kind for target, if there is one
+        """
+        with self._lock:
+            for job in self.jobs.values():
+                if job.kind == kind and job.target == target and job.status in ("queued", "running"):
+                    return job
+        return None
+
+    def supersede(self, job_id: str) -> bool:
+        """
+        Drop a job that has not started yet because newer work replaces it
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status != "queued":
+                return False
+            self._funcs.pop(job_id, None)
+            job.status = "superseded"
+            job.finished_at = time.time()
+            return True
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [job.to_dict() for job in reversed(self.jobs.values())]
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(1 for job in self.jobs.values() if job.status in ("queued", "running"))
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            func = self._funcs.pop(job_id, None)
+        if job is None or func is None:
+            return
+
+        def report(done: int, total: int):
+            job.done = done
+            job.total = total
+            job.progress = done / total if total else 0.0
+
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = await asyncio.to_thread(func, report)
+            job.progress = 1.0
+            job.status = "completed"
+        except Exception as e:
+            print(f"Ingestion job {job.id} ({job.target}) failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def _trim_history(self):
+        # Drop the oldest finished jobs; queued and running jobs are never dropped
+        excess = len(self.jobs) - self.max_history
+        if excess <= 0:
+            return
+        for job_id in list(self.jobs):
+            if excess <= 0:
+                break
+            if self.jobs[job_id].status in FINISHED_STATUSES:
+                del self.jobs[job_id]
+                excess -= 1
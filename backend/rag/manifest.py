@@ -0,0 +1,114 @@
+"""
+Document Manifest - Content hashes of indexed files and pages
+"""
+
+import os
+import json
+import hashlib
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+@dataclass
+class PageEntry:
+    page: int
+    hash: str
+    vector_ids: List[int] = field(default_factory=list)
+
+@dataclass
+class FileEntry:
+    file_hash: str
+    size: int
+    mtime: float
+    pages: List[PageEntry] = field(default_factory=list)
+
+    @property
+    def vector_ids(self) -> List[int]:
+        return [vector_id for page in self.pages for vector_id in page.vector_ids]
+
+def hash_file(filepath: str) -> str:
+    """
+    SHA-256 of a file's bytes, read in blocks so large PDFs are never fully buffered
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def hash_text(text: str) -> str:
+    """
+    SHA-256 of page text with whitespace normalised, so re-extraction noise is ignored
+    """
+    normalized = " ".join(text.split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+class DocumentManifest:
+    """
+    Persistent record of what has been indexed for each document.
+
+    Files are keyed by document id and carry a whole-file hash plus the size and
+    mtime seen at indexing time; each page carries its own content hash and the
+    vector ids its chunks were stored under. A rescan compares against these to
+    find the pages that actually need extracting and embedding.
+    """
+
+    def __init__(self, manifest_path: str):
+        self.manifest_path = manifest_path
+        self.files: Dict[str, FileEntry] = {}
+        self._load()
+
+    def get(self, doc_id: str) -> Optional[FileEntry]:
+        return self.files.get(doc_id)
+
+    def set(self, doc_id: str, entry: FileEntry):
+        self.files[doc_id] = entry
+
+    def remove(self, doc_id: str) -> Optional[FileEntry]:
+        return self.files.pop(doc_id, None)
+
+    def is_unchanged(self, doc_id: str, size: int, mtime: float) -> bool:
+        """
+        Cheap stat-based check used before hashing the file at all
+        """
+        entry = self.files.get(doc_id)
+        return entry is not None and entry.size == size and entry.mtime == mtime
+
+    def vector_ids(self, doc_id: str) -> List[int]:
+        entry = self.files.get(doc_id)
+        return entry.vector_ids if entry else []
+
+    def total_vectors(self) -> int:
+        return sum(len(entry.vector_ids) for entry in self.files.values())
+
+    def clear(self):
+        self.files = {}
+
+    def save(self):
+        """
+        Write the manifest atomically
+        """
+        data = {
+            "version": 1,
+            "files": {doc_id: asdict(entry) for doc_id, entry in self.files.items()}
+        }
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _load(self):
+        if not os.path.exists(self.manifest_path):
+            return
+
+        try:
+            with open(self.manifest_path, 'r', encoding="utf-8") as f:
+                data = json.load(f)
+
+            for doc_id, entry_data in data.get("files", {}).items():
+                pages = [PageEntry(**page) for page in entry_data.pop("pages", [])]
+                self.files[doc_id] = FileEntry(pages=pages, **entry_data)
+        except Exception as e:
+            print(f"Error loading document manifest: {e}")
+            self.files = {}
@@ -0,0 +1,138 @@
+"""
+Partitions - Per (subject, grade) vector indexes for prefiltered retrieval
+"""
+
+import os
+import glob
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend.rag.vector_index import VectorIndex, IndexConfig
+
+# Partition values for documents whose subject or grade is not known
+ANY_SUBJECT = "general"
+ANY_GRADE = "any"
+
+def partition_key(subject: Optional[str], grade: Optional[str]) -> str:
+    return f"{subject or ANY_SUBJECT}__{grade or ANY_GRADE}"
+
+def split_partition_key(key: str) -> Tuple[str, str]:
+    subject, _, grade = key.partition("__")
+    return subject, grade
+
+class PartitionedIndex:
+    """
+    One small flat vector index per (subject, grade) partition.
+
+    Each partition is an ordinary memory-mapped VectorIndex, so adds,
+    tombstoned removes and compaction work the same way as for the main
+    index. A filtered search only touches the partitions that match, which
+    is both cheaper than a global search and does not lose hits to
+    post-filtering a global top-k.
+    """
+
+    def __init__(self, root_dir: str, dimension: int):
+        self.root_dir = root_dir
+        self.dimension = dimension
+        self.partitions: Dict[str, VectorIndex] = {}
+        self._lock = threading.RLock()
+
+        os.makedirs(root_dir, exist_ok=True)
+        for index_path in sorted(glob.glob(os.path.join(root_dir, "*.faiss"))):
+            key = os.path.splitext(os.path.basename(index_path))[0]
+            self.partitions[key] = VectorIndex(index_path, dimension, IndexConfig(index_type="flat"))
+
+    @property
+    def live_count(self) -> int:
+        return sum(index.live_count for index in list(self.partitions.values()))
+
+    def keys_matching(self, subject: Optional[str] = None, grade: Optional[str] = None) -> List[str]:
+        """
+        Partitions for a subject and/or grade
+
+        Documents without a grade apply to every grade of their subject, so
+        a grade filter also matches the subject's ungraded partition.
+        """
+        keys = []
+        for key in list(self.partitions):
+            key_subject, key_grade = split_partition_key(key)
+            if subject and key_subject != subject:
+                continue
+            if grade and key_grade not in (grade, ANY_GRADE):
+                continue
+            keys.append(key)
+        return keys
+
+    def add(self, key: str, vectors: np.ndarray, ids: Sequence[int]):
+        if len(ids) == 0:
+            return
+        self._get_or_create(key).add(vectors, ids)
+
+    def remove(self, key: str, ids: Sequence[int]) -> int:
+        index = self.partitions.get(key)
+        return index.remove(ids) if index is not None else 0
+
+    def search(self, keys: List[str], query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Search the given partitions and merge their hits into one (1, k) result
+        """
+        scores = []
+        ids = []
+        for key in keys:
+            index = self.partitions.get(key)
+            if index is None or index.live_count == 0:
+                continue
+            partition_scores, partition_ids = index.search(query, k)
+            scores.append(partition_scores[0])
+            ids.append(partition_ids[0])
+
+        if not scores:
+            return np.zeros((1, 0), dtype="float32"), np.zeros((1, 0), dtype="int64")
+
+        scores = np.concatenate(scores)
+        ids = np.concatenate(ids)
+        top = np.argsort(-scores, kind="stable")[:k]
+        return scores[top].reshape(1, -1), ids[top].reshape(1, -1)
+
+    def compact(self, dead_fraction: float) -> int:
+        """
+        Compact every partition whose tombstoned fraction has reached dead_fraction
+        """
+        removed = 0
+        for index in list(self.partitions.values()):
+            if index.dead_fraction >= dead_fraction:
+                removed += index.compact()
+        return removed
+
+    def max_dead_fraction(self) -> float:
+        return max((index.dead_fraction for index in list(self.partitions.values())), default=0.0)
+
+    def clear(self):
+        """
+        Drop every partition and its files
+        """
+        with self._lock:
+            # Dropping the indexes unmaps their data files before they are deleted
+            self.partitions = {}
+            for path in glob.glob(os.path.join(self.root_dir, "*")):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"Could not remove partition file {path}: {e}")
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            key: {"vectors": index.live_count, "tombstones": len(index.tombstones)}
+            for key, index in list(self.partitions.items())
+        }
+
+    def _get_or_create(self, key: str) -> VectorIndex:
+        with self._lock:
+            index = self.partitions.get(key)
+            if index is None:
+                index = VectorIndex(os.path.join(self.root_dir, f"{key}.faiss"),
+                                    self.dimension, IndexConfig(index_type="flat"))
+                self.partitions[key] = index
+            return index
@@ -0,0 +1,66 @@
+"""
+Query Cache - Bounded LRU caches for the retrieval hot path
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+def normalize_query(text: str) -> str:
+    """
+    Canonical form of a query for cache keys: case, spacing and trailing
+    punctuation do not change what a student is asking
+    """
+    text = re.sub(r"\s+", " ", text.lower()).strip()
+    return text.strip(" ?!.,")
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache with hit, miss and eviction counters
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,121 @@
+"""
+Reranker - Batched cross-encoder rescoring of first-stage retrieval candidates
+"""
+
+import time
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from sentence_transformers import CrossEncoder
+
+# Weight of the newest measurement in the per-pair latency estimate
+LATENCY_EWMA_ALPHA = 0.2
+# Rerank anyway after this many budget skips in a row, to re-measure
+BUDGET_PROBE_INTERVAL = 20
+
+class CrossEncoderReranker:
+    """
+    Scores (query, passage) pairs jointly with a cross-encoder.
+
+    All candidates for a query go through the model in one batched predict
+    call. A moving average of the cost per pair lets the caller skip the
+    stage when it would not fit in its latency budget. The first predict
+    after loading is left out of the average, and a skipped stage is still
+    run now and then so that one slow measurement cannot disable it.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 32, max_length: int = 512):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self._model: Optional[CrossEncoder] = None
+        self._load_lock = threading.Lock()
+        self._warmed = False
+
+        self.ms_per_pair = 0.0
+        self._budget_skips = 0
+        self._probing = False
+        self.stats = {"reranked": 0, "skipped_margin": 0, "skipped_budget": 0, "budget_probes": 0}
+
+    @property
+    def model(self) -> CrossEncoder:
+        with self._load_lock:
+            if self._model is None:
+                print(f"Loading reranker model {self.model_name}...")
+                self._model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu")
+            return self._model
+
+    def warm_up(self):
+        """
+        Load the model and run one untimed predict
+
+        The first predict pays for lazy initialisation and would otherwise
+        inflate the latency estimate.
+        """
+        model = self.model
+        model.predict([("warm up", "warm up")], batch_size=1, show_progress_bar=False)
+        self._warmed = True
+
+    def estimate_ms(self, n_pairs: int) -> float:
+        """
+        Expected time to score n_pairs; 0 until the first measurement
+        """
+        return self.ms_per_pair * n_pairs
+
+    def within_budget(self, n_pairs: int, budget_ms: float) -> bool:
+        """
+        Whether scoring n_pairs should run under the latency budget
+
+        Every BUDGET_PROBE_INTERVAL-th consecutive skip runs the stage anyway
+        and its measurement replaces the estimate, so a stale estimate from
+        a slow moment is corrected once reranking gets cheap again.
+        """
+        if self.estimate_ms(n_pairs) <= budget_ms:
+            self._budget_skips = 0
+            return True
+
+        self._budget_skips += 1
+        if self._budget_skips >= BUDGET_PROBE_INTERVAL:
+            self._budget_skips = 0
+            self._probing = True
+            self.stats["budget_probes"] += 1
+            return True
+
+        self.stats["skipped_budget"] += 1
+        return False
+
+    def score(self, query: str, passages: List[str]) -> np.ndarray:
+        """
+        Relevance of each passage to the query, higher is better
+        """
+        if not passages:
+            return np.zeros(0, dtype="float32")
+
+        model = self.model
+        started = time.perf_counter()
+        scores = model.predict(
+            [(query, passage) for passage in passages],
+            batch_size=self.batch_size,
+            show_progress_bar=False
+        )
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        per_pair = elapsed_ms / len(passages)
+        if not self._warmed:
+            # The cold call includes one-off initialisation
+            self._warmed = True
+        elif self.ms_per_pair == 0.0 or self._probing:
+            self.ms_per_pair = per_pair
+        else:
+            self.ms_per_pair += LATENCY_EWMA_ALPHA * (per_pair - self.ms_per_pair)
+        self._probing = False
+        self.stats["reranked"] += 1
+
+        return np.asarray(scores, dtype="float32").reshape(-1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["model"] = self.model_name
+        stats["ms_per_pair"] = self.ms_per_pair
+        return stats
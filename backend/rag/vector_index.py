@@ -0,0 +1,620 @@
+"""
+Vector Index - Memory-mapped FAISS index with incremental add and tombstoned removal
+"""
+
+import os
+import json
+import math
+import time
+import shutil
+import tempfile
+import threading
+from dataclasses import dataclass, asdict, replace
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import faiss
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# FAISS needs at least 2**nbits training points per PQ codebook; ask for a
+# few times that so the codebooks are not degenerate
+PQ_MIN_POINTS_PER_CENTROID = 4
+# k-means wants roughly this many training points per IVF list
+IVF_MIN_POINTS_PER_LIST = 39
+
+# On-disk inverted lists map their data file themselves when read.
+# IO_FLAG_MMAP must not be added: it includes IO_FLAG_SKIP_IVF_DATA, which
+# leaves the lists unmapped and crashes the first search
+READ_FLAGS = faiss.IO_FLAG_ONDISK_SAME_DIR
+
+@dataclass
+class IndexConfig:
+    """
+    Index type plus build and search parameters.
+
+    flat      exact search over memory-mapped float32 vectors (d * 4 bytes each)
+    ivf_flat  same storage, but only nprobe of nlist clusters are scanned
+    ivf_pq    product-quantised codes of pq_m bytes per vector, memory-mapped;
+              smallest footprint, recall depends on pq_m and nprobe
+    hnsw      graph index held fully in RAM; best recall/latency, largest
+              private memory (vectors plus about hnsw_m * 8 bytes of links)
+    """
+    index_type: str = "flat"
+    nlist: int = 0  # 0 picks a value from the corpus size
+    pq_m: int = 48  # must divide the embedding dimension
+    pq_nbits: int = 8
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    nprobe: int = 16
+    ef_search: int = 64
+
+    @classmethod
+    def from_env(cls) -> "IndexConfig":
+        """
+        Read RAG_INDEX_TYPE, RAG_IVF_NLIST, RAG_PQ_M, RAG_PQ_NBITS, RAG_HNSW_M,
+        RAG_HNSW_EF_CONSTRUCTION, RAG_NPROBE and RAG_EF_SEARCH
+        """
+        defaults = cls()
+        config = cls(
+            index_type=os.environ.get("RAG_INDEX_TYPE", defaults.index_type).lower(),
+            nlist=int(os.environ.get("RAG_IVF_NLIST", defaults.nlist)),
+            pq_m=int(os.environ.get("RAG_PQ_M", defaults.pq_m)),
+            pq_nbits=int(os.environ.get("RAG_PQ_NBITS", defaults.pq_nbits)),
+            hnsw_m=int(os.environ.get("RAG_HNSW_M", defaults.hnsw_m)),
+            ef_construction=int(os.environ.get("RAG_HNSW_EF_CONSTRUCTION", defaults.ef_construction)),
+            nprobe=int(os.environ.get("RAG_NPROBE", defaults.nprobe)),
+            ef_search=int(os.environ.get("RAG_EF_SEARCH", defaults.ef_search))
+        )
+        if config.index_type not in INDEX_TYPES:
+            print(f"Unknown RAG_INDEX_TYPE '{config.index_type}', using flat")
+            config.index_type = "flat"
+        return config
+
+class VectorIndex:
+    """
+    Inner-product FAISS index with incremental add/remove.
+
+    For the flat and IVF types the index file only holds the list directory;
+    the vector data sits in a sibling ``.ivfdata`` file that FAISS memory-maps
+    on load, so opening the index is cheap and the pages are shared between
+    worker processes. Vectors are added and removed in place and only the small
+    directory is rewritten. HNSW graphs cannot be memory-mapped and are loaded
+    into RAM.
+
+    Removal only records the ids as tombstones, which searches filter out;
+    compact() later rewrites the index without them and swaps it in while
+    searches carry on against the old one.
+    """
+
+    def __init__(self, index_path: str, dimension: int, config: Optional[IndexConfig] = None):
+        self.index_path = index_path
+        self.config_path = os.path.splitext(index_path)[0] + ".config.json"
+        self.tombstones_path = os.path.splitext(index_path)[0] + ".tombstones.json"
+        self.dimension = dimension
+        self.config = config or IndexConfig.from_env()
+        # The type asked for; the live index may be a simpler one until there
+        # are enough vectors to train it
+        self.target_type = self.config.index_type
+        self.index = None
+        self.data_path: Optional[str] = None
+        self.tombstones: Set[int] = set()
+        # _lock guards the live index object; _write_lock serialises anything
+        # that changes its contents, so compaction can copy the index while
+        # searches still run
+        self._lock = threading.RLock()
+        self._write_lock = threading.RLock()
+
+        os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+        self._load()
+
+    @property
+    def ntotal(self) -> int:
+        """
+        Vectors physically stored, including tombstoned ones
+        """
+        return int(self.index.ntotal) if self.index is not None else 0
+
+    @property
+    def live_count(self) -> int:
+        return self.ntotal - len(self.tombstones)
+
+    @property
+    def dead_fraction(self) -> float:
+        return len(self.tombstones) / self.ntotal if self.ntotal else 0.0
+
+    @property
+    def index_type(self) -> str:
+        return _detect_index_type(self.index) if self.index is not None else "flat"
+
+    def add(self, vectors: np.ndarray, ids: Sequence[int]):
+        """
+        Add vectors under the given int64 ids and persist the list directory
+        """
+        if len(ids) == 0:
+            return
+
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        ids = np.ascontiguousarray(ids, dtype="int64")
+
+        with self._write_lock, self._lock:
+            self.index.add_with_ids(vectors, ids)
+            self._persist()
+
+    def remove(self, ids: Sequence[int]) -> int:
+        """
+        Tombstone vectors by id; they stop appearing in search results at once
+        and are dropped from storage by the next compact()
+
+        Returns:
+            Number of ids newly tombstoned
+        """
+        with self._lock:
+            new_ids = {int(vector_id) for vector_id in ids} - self.tombstones
+            if not new_ids:
+                return 0
+            self.tombstones |= new_ids
+            self._save_tombstones()
+            return len(new_ids)
+
+    def compact(self) -> int:
+        """
+        Rewrite the index without its tombstoned vectors and swap it in.
+
+        IVF indexes are copied list by list into a new data file, keeping the
+        stored codes as they are, so nothing is retrained or re-encoded. HNSW
+        graphs are rebuilt from their remaining vectors. Searches keep using
+        the old index until the swap; only writers wait.
+
+        Returns:
+            Number of vectors physically removed
+        """
+        with self._write_lock:
+            with self._lock:
+                dead = set(self.tombstones)
+            if not dead:
+                return 0
+
+            started = time.time()
+            if self.index_type == "hnsw":
+                existing = faiss.vector_to_array(self.index.id_map)
+                keep_ids = existing[~np.isin(existing, list(dead))]
+                vectors = np.vstack([self.index.reconstruct(int(i)) for i in keep_ids]) if len(keep_ids) \
+                    else np.zeros((0, self.dimension), dtype="float32")
+                removed = len(existing) - len(keep_ids)
+                self.build(vectors, keep_ids, self.config)
+                return removed
+
+            new_data_path = self._new_data_path()
+            new_index = self._copy_without(dead, new_data_path)
+            removed = self.ntotal - int(new_index.ntotal)
+
+            with self._lock:
+                old_data_path = self.data_path
+                self.index = new_index
+                self.data_path = new_data_path
+                self.tombstones -= dead
+                self._persist()
+                self._save_tombstones()
+
+        self._remove_data_file(old_data_path)
+        print(f"Compacted {self.index_type} index: removed {removed} vectors, "
+              f"{self.ntotal} remain ({time.time() - started:.1f}s)")
+        return removed
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Search the index, returning (scores, ids) arrays of shape (n, k)
+        """
+        queries = np.ascontiguousarray(queries, dtype="float32")
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+
+        if self.live_count <= 0 or k <= 0:
+            empty_scores = np.zeros((queries.shape[0], 0), dtype="float32")
+            empty_ids = np.zeros((queries.shape[0], 0), dtype="int64")
+            return empty_scores, empty_ids
+
+        with self._lock:
+            if not self.tombstones:
+                return self.index.search(queries, min(k, self.ntotal))
+
+            # Over-fetch by the number of tombstones so k live hits survive filtering
+            scores, ids = self.index.search(queries, min(k + len(self.tombstones), self.ntotal))
+            dead = np.isin(ids, list(self.tombstones))
+
+        k = min(k, self.live_count)
+        kept_scores = np.full((len(ids), k), -np.inf, dtype="float32")
+        kept_ids = np.full((len(ids), k), -1, dtype="int64")
+        for row in range(len(ids)):
+            live = ~dead[row]
+            row_scores = scores[row][live][:k]
+            kept_scores[row, :len(row_scores)] = row_scores
+            kept_ids[row, :len(row_scores)] = ids[row][live][:k]
+        return kept_scores, kept_ids
+
+    def pending_config(self) -> Optional[IndexConfig]:
+        """
+        Config to rebuild with when the live index is not the target type
+
+        Returns None while the live index is already what the target type
+        would build as at the current number of vectors, e.g. flat while
+        there are too few vectors to train IVF lists.
+        """
+        with self._lock:
+            config = replace(self.config, index_type=self.target_type)
+            if _buildable_type(config, self.live_count) == self.index_type:
+                return None
+            return config
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """
+        Tune search-time recall/latency without rebuilding
+        """
+        with self._lock:
+            if nprobe is not None:
+                self.config.nprobe = nprobe
+            if ef_search is not None:
+                self.config.ef_search = ef_search
+            _apply_search_params(self.index, self.config)
+            self._save_config()
+
+    def build(self, vectors: np.ndarray, ids: Sequence[int], config: Optional[IndexConfig] = None):
+        """
+        Train and populate a new index, then swap it in for the current one.
+
+        This is both the "train" and "rebuild" operation: IVF centroids and PQ
+        codebooks cannot be retrained under existing codes, so retraining
+        always re-encodes every vector.
+        """
+        config = replace(config or self.config)
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        ids = np.ascontiguousarray(ids, dtype="int64")
+
+        with self._write_lock:
+            started = time.time()
+            new_data_path = self._new_data_path()
+            new_index = _build_index(vectors, config, self.dimension, new_data_path)
+            if len(ids):
+                new_index.add_with_ids(vectors, ids)
+            _apply_search_params(new_index, config)
+
+            with self._lock:
+                old_data_path = self.data_path
+                self.index = new_index
+                self.data_path = new_data_path if config.index_type != "hnsw" else None
+                self.config = config
+                # Ids tombstoned while the build ran may be in the new index too
+                self.tombstones &= set(ids.tolist())
+                self._persist()
+                self._save_config()
+                self._save_tombstones()
+
+        self._remove_data_file(old_data_path)
+        print(f"Built {config.index_type} index with {self.ntotal} vectors "
+              f"in {time.time() - started:.1f}s")
+
+    def reset(self):
+        """
+        Drop every vector and start over with an empty index
+        """
+        with self._write_lock, self._lock:
+            old_data_path = self.data_path
+            self.index = None
+            self.data_path = self._new_data_path()
+            self.index = _create_flat_index(self.dimension, self.data_path)
+            self.tombstones = set()
+            self._persist()
+            self._save_tombstones()
+        self._remove_data_file(old_data_path)
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Bytes held privately in RAM versus bytes memory-mapped from disk
+        """
+        with self._lock:
+            index_bytes = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+            data_bytes = os.path.getsize(self.data_path) if self.data_path and os.path.exists(self.data_path) else 0
+            return {"private_bytes": index_bytes, "mapped_bytes": data_bytes}
+
+    def describe(self) -> Dict[str, Any]:
+        info = {
+            "index_type": self.index_type,
+            "ntotal": self.ntotal,
+            "tombstones": len(self.tombstones),
+            "dead_fraction": self.dead_fraction,
+            "config": asdict(self.config)
+        }
+        info.update(self.memory_usage())
+        return info
+
+    def _load(self):
+        """
+        Open the index memory-mapped, replacing it if it is not in a supported layout
+        """
+        saved_config = self._load_config()
+        self.tombstones = self._load_tombstones()
+        if os.path.exists(self.index_path):
+            try:
+                index = faiss.read_index(self.index_path, READ_FLAGS)
+                index_type = _detect_index_type(index)
+                if index_type is not None and index.d == self.dimension:
+                    self.index = index
+                    self.data_path = self._loaded_data_path(index)
+
+                    if self.target_type != index_type:
+                        print(f"Configured index type is {self.target_type} but the stored "
+                              f"index is {index_type}; it is rebuilt once there are enough "
+                              f"vectors to train it")
+                    if saved_config is not None:
+                        # Build and search parameters come from what was saved with
+                        # the index unless explicitly overridden in the environment
+                        saved_config.nprobe = int(os.environ.get("RAG_NPROBE", saved_config.nprobe))
+                        saved_config.ef_search = int(os.environ.get("RAG_EF_SEARCH", saved_config.ef_search))
+                        self.config = saved_config
+                    self.config.index_type = index_type
+                    _apply_search_params(self.index, self.config)
+                    print(f"Loaded {index_type} vector index with {self.ntotal} vectors")
+                    return
+
+                print(f"Index at {self.index_path} is not a supported index of dimension "
+                      f"{self.dimension}; starting a new one")
+            except RuntimeError as e:
+                print(f"Error loading vector index: {e}")
+
+        self.reset()
+
+    def _loaded_data_path(self, index) -> Optional[str]:
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is None:
+            return None
+        invlists = faiss.downcast_InvertedLists(ivf.invlists)
+        return os.path.join(os.path.dirname(self.index_path), os.path.basename(invlists.filename))
+
+    def _copy_without(self, dead: Set[int], data_path: str):
+        """
+        Copy of the IVF index in a new data file with the given ids left out.
+
+        The copy is opened from the saved index file so it shares the trained
+        quantizer and codebooks, then gets fresh on-disk lists filled from the
+        old ones. Only readers touch the old lists meanwhile.
+        """
+        copy = faiss.read_index(self.index_path, READ_FLAGS | faiss.IO_FLAG_READ_ONLY)
+        ivf = faiss.try_extract_index_ivf(copy)
+        old_lists = faiss.downcast_InvertedLists(ivf.invlists)
+        new_lists = faiss.OnDiskInvertedLists(ivf.nlist, ivf.code_size, data_path)
+        dead_ids = np.fromiter(dead, dtype="int64", count=len(dead))
+
+        kept = 0
+        for list_no in range(ivf.nlist):
+            size = old_lists.list_size(list_no)
+            if size == 0:
+                continue
+
+            ids_ptr = old_lists.get_ids(list_no)
+            codes_ptr = old_lists.get_codes(list_no)
+            ids = faiss.rev_swig_ptr(ids_ptr, size).copy()
+            codes = faiss.rev_swig_ptr(codes_ptr, size * ivf.code_size).copy().reshape(size, ivf.code_size)
+            old_lists.release_ids(list_no, ids_ptr)
+            old_lists.release_codes(list_no, codes_ptr)
+
+            live = ~np.isin(ids, dead_ids)
+            if not live.any():
+                continue
+            live_ids = np.ascontiguousarray(ids[live])
+            live_codes = np.ascontiguousarray(codes[live])
+            new_lists.add_entries(list_no, len(live_ids), faiss.swig_ptr(live_ids), faiss.swig_ptr(live_codes))
+            kept += len(live_ids)
+
+        ivf.replace_invlists(new_lists, True)
+        new_lists.this.disown()
+        ivf.ntotal = kept
+        copy.ntotal = kept
+        _apply_search_params(copy, self.config)
+        return copy
+
+    def _new_data_path(self) -> str:
+        # Each build gets its own data file so a live mapping is never overwritten
+        stem = os.path.splitext(self.index_path)[0]
+        return f"{stem}.{int(time.time() * 1000)}.ivfdata"
+
+    def _remove_data_file(self, path: Optional[str]):
+        if not path or path == self.data_path or not os.path.exists(path):
+            return
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Could not remove old index data {path}: {e}")
+
+    def _persist(self):
+        """
+        Atomically rewrite the index file; IVF vector data is already on disk
+        """
+        tmp_path = self.index_path + ".tmp"
+        faiss.write_index(self.index, tmp_path)
+        os.replace(tmp_path, self.index_path)
+
+    def _load_tombstones(self) -> Set[int]:
+        if not os.path.exists(self.tombstones_path):
+            return set()
+        try:
+            with open(self.tombstones_path, 'r', encoding="utf-8") as f:
+                return set(json.load(f))
+        except Exception as e:
+            print(f"Error loading index tombstones: {e}")
+            return set()
+
+    def _save_tombstones(self):
+        tmp_path = self.tombstones_path + ".tmp"
+        with open(tmp_path, 'w', encoding="utf-8") as f:
+            json.dump(sorted(self.tombstones), f)
+        os.replace(tmp_path, self.tombstones_path)
+
+    def _load_config(self) -> Optional[IndexConfig]:
+        if not os.path.exists(self.config_path):
+            return None
+        try:
+            with open(self.config_path, 'r', encoding="utf-8") as f:
+                return IndexConfig(**json.load(f))
+        except Exception as e:
+            print(f"Error loading index config: {e}")
+            return None
+
+    def _save_config(self):
+        tmp_path = self.config_path + ".tmp"
+        with open(tmp_path, 'w', encoding="utf-8") as f:
+            json.dump(asdict(self.config), f, indent=2)
+        os.replace(tmp_path, self.config_path)
+
+def _detect_index_type(index) -> Optional[str]:
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        invlists = faiss.downcast_InvertedLists(ivf.invlists)
+        if not isinstance(invlists, faiss.OnDiskInvertedLists):
+            return None
+        if isinstance(faiss.downcast_index(ivf), faiss.IndexIVFPQ):
+            return "ivf_pq"
+        return "flat" if ivf.nlist == 1 else "ivf_flat"
+
+    if isinstance(index, faiss.IndexIDMap2) and isinstance(faiss.downcast_index(index.index), faiss.IndexHNSW):
+        return "hnsw"
+
+    return None
+
+def _apply_search_params(index, config: IndexConfig):
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = max(1, min(config.nprobe, ivf.nlist))
+    elif isinstance(index, faiss.IndexIDMap2):
+        faiss.downcast_index(index.index).hnsw.efSearch = config.ef_search
+
+def _attach_on_disk_lists(index, data_path: str):
+    invlists = faiss.OnDiskInvertedLists(index.nlist, index.code_size, data_path)
+    index.replace_invlists(invlists, True)
+    invlists.this.disown()
+
+def _create_flat_index(dimension: int, data_path: str):
+    """
+    Single-list IVF index backed by an on-disk data file.
+
+    With one inverted list every search scans all vectors, so results are
+    exact while the vectors themselves stay memory-mapped. Nothing to train.
+    """
+    quantizer = faiss.IndexFlatIP(dimension)
+    quantizer.add(np.zeros((1, dimension), dtype="float32"))
+
+    index = faiss.IndexIVFFlat(quantizer, dimension, 1, faiss.METRIC_INNER_PRODUCT)
+    index.is_trained = True
+    index.own_fields = True
+    quantizer.this.disown()
+
+    _attach_on_disk_lists(index, data_path)
+    return index
+
+def _choose_nlist(n_vectors: int, requested: int) -> int:
+    if requested > 0:
+        nlist = requested
+    else:
+        nlist = int(4 * math.sqrt(max(n_vectors, 1)))
+    return max(1, min(nlist, n_vectors // IVF_MIN_POINTS_PER_LIST))
+
+def _buildable_type(config: IndexConfig, n_vectors: int) -> str:
+    """
+    Index type building config over n_vectors vectors actually produces
+    """
+    index_type = config.index_type
+    if index_type == "hnsw":
+        return index_type
+    if index_type == "ivf_pq" and n_vectors < PQ_MIN_POINTS_PER_CENTROID * (2 ** config.pq_nbits):
+        index_type = "ivf_flat"
+    if index_type != "flat" and _choose_nlist(n_vectors, config.nlist) < 2:
+        index_type = "flat"
+    return index_type
+
+def _build_index(vectors: np.ndarray, config: IndexConfig, dimension: int, data_path: str):
+    """
+    Create and train an empty index of the configured type.
+
+    Falls back to a simpler type when there are too few vectors to train the
+    requested one, and records the type actually built in config.
+    """
+    n_vectors = len(vectors)
+
+    if config.index_type == "hnsw":
+        base = faiss.IndexHNSWFlat(dimension, config.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        base.hnsw.efConstruction = config.ef_construction
+        return faiss.IndexIDMap2(base)
+
+    if config.index_type == "ivf_pq" and dimension % config.pq_m != 0:
+        raise ValueError(f"pq_m={config.pq_m} must divide the embedding dimension {dimension}")
+
+    index_type = _buildable_type(config, n_vectors)
+    if index_type != config.index_type:
+        print(f"Only {n_vectors} vectors; too few to train {config.index_type}, building {index_type} instead")
+        config.index_type = index_type
+    if config.index_type == "flat":
+        return _create_flat_index(dimension, data_path)
+
+    nlist = _choose_nlist(n_vectors, config.nlist)
+
+    quantizer = faiss.IndexFlatIP(dimension)
+    if config.index_type == "ivf_pq":
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, config.pq_m, config.pq_nbits,
+                                 faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+    index.own_fields = True
+    quantizer.this.disown()
+
+    index.train(vectors)
+    _attach_on_disk_lists(index, data_path)
+    return index
+
+def evaluate_index_configs(vectors: np.ndarray, ids: np.ndarray, configs: List[IndexConfig],
+                           queries: np.ndarray, k: int = 10) -> List[Dict[str, Any]]:
+    """
+    Build each configuration from the same vectors and compare it with exact search.
+
+    Reports recall@k against brute-force inner product, mean query latency,
+    build time and memory split into private RAM and memory-mapped bytes,
+    which is the tradeoff to weigh when choosing an index type.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    ids = np.ascontiguousarray(ids, dtype="int64")
+    k = min(k, len(ids))
+    if k == 0 or len(queries) == 0:
+        return []
+
+    exact_positions = np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+    exact_ids = ids[exact_positions]
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="rag_index_eval_")
+    try:
+        for position, config in enumerate(configs):
+            index_path = os.path.join(workdir, f"eval_{position}.faiss")
+            index = VectorIndex(index_path, vectors.shape[1], replace(config))
+
+            started = time.time()
+            index.build(vectors, ids, replace(config))
+            build_seconds = time.time() - started
+
+            started = time.time()
+            _, found_ids = index.search(queries, k)
+            query_ms = (time.time() - started) * 1000 / len(queries)
+
+            hits = sum(len(set(found) & set(expected)) for found, expected in zip(found_ids, exact_ids))
+            result = {
+                "requested_type": config.index_type,
+                "built": index.describe(),
+                f"recall@{k}": hits / (k * len(queries)),
+                "mean_query_ms": query_ms,
+                "build_seconds": build_seconds
+            }
+            results.append(result)
+            index.index = None
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
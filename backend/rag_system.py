@@ -1,123 +1,872 @@
 """
-Speech Processor
+RAG System - Retrieval over the knowledge base documents in backend/RAG_docs
 """
 
 import os
-import re
 import json
-import time
-import whisper
-from TTS.api import TTS
-import tempfile
-
-TTS_OUTPUT_DIR = "tts_output"
-TEMP_AUDIO_PATH = "temp_audio.wav"
-
-class SpeechProcessor:
-    
-    def __init__(self):
-        os.makedirs(TTS_OUTPUT_DIR, exist_ok=True)
-        
-        try:
-            self.stt_model = whisper.load_model("base")
-        except Exception as e:
-            print(f"Error loading Whisper model: {e}")
-            self.stt_model = None
-        
+import hashlib
+import random
+import threading
+from dataclasses import dataclass, field, asdict, fields, replace
+from typing import AbstractSet, Dict, Any, Callable, List, Optional, Tuple
+
+import numpy as np
+
+from backend.rag.vector_index import VectorIndex, IndexConfig, INDEX_TYPES, evaluate_index_configs
+from backend.rag.embeddings import Embedder
+from backend.rag.bm25_index import BM25Index, keyword_confidences, fuse_relevance
+from backend.rag.chunk_store import ChunkStore, DocumentChunk
+from backend.rag.reranker import CrossEncoderReranker
+from backend.rag.partitions import PartitionedIndex, partition_key
+from backend.intent_classifier import IntentClassifier
+from backend.rag.query_cache import LRUCache, normalize_query
+from backend.rag.extraction import chunk_text
+from backend.rag.ingestion import IngestionPool, process_pdf_page
+from backend.rag.manifest import DocumentManifest, FileEntry, PageEntry, hash_file
+
+RAG_DOCS_DIR = os.path.join("backend", "RAG_docs")
+VECTOR_STORE_DIR = "vector_store"
+DOCUMENT_STORE_DIR = "document_store"
+INDEX_PATH = os.path.join(VECTOR_STORE_DIR, "index.faiss")
+EMBEDDING_CACHE_PATH = os.path.join(VECTOR_STORE_DIR, "embedding_cache.sqlite")
+KEYWORD_INDEX_PATH = os.path.join(VECTOR_STORE_DIR, "bm25.json")
+PARTITIONS_DIR = os.path.join(VECTOR_STORE_DIR, "partitions")
+DOCUMENTS_FILE = os.path.join(DOCUMENT_STORE_DIR, "documents.json")
+CHUNKS_FILE = os.path.join(DOCUMENT_STORE_DIR, "chunks.json")
+MANIFEST_FILE = os.path.join(DOCUMENT_STORE_DIR, "manifest.json")
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_DIMENSION = 384
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".md")
+
+# Chunks are embedded as soon as this many have streamed in from the pool
+EMBED_FLUSH_SIZE = 256
+
+# Hybrid retrieval: candidates pulled from each leg before fusion
+HYBRID_CANDIDATES = 20
+# Relevance a hit needs before its text is worth putting in a prompt
+RELEVANCE_THRESHOLD = 0.7
+# The keyword leg alone answers the query when its best hit matches every
+# query term and beats the runner-up by this factor
+KEYWORD_DECISIVE_MARGIN = 1.5
+# Vector id sets of recently filtered partition combinations
+PARTITION_IDS_CACHE_SIZE = 64
+
+# Optional cross-encoder second stage, e.g. cross-encoder/ms-marco-MiniLM-L-6-v2;
+# disabled when unset
+RERANK_MODEL_NAME = os.environ.get("RAG_RERANK_MODEL", "")
+RERANK_CANDIDATES = int(os.environ.get("RAG_RERANK_CANDIDATES", "20"))
+# Skip reranking when it is expected to take longer than this
+RERANK_BUDGET_MS = float(os.environ.get("RAG_RERANK_BUDGET_MS", "150"))
+# Skip reranking when the last first-stage hit kept leads the first one
+# dropped by at least this much relevance
+RERANK_DECISIVE_MARGIN = 0.15
+
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+RETRIEVAL_CACHE_SIZE = 512
+
+# Removed vectors are only tombstoned; compact once this fraction of the index is dead
+COMPACTION_DEAD_FRACTION = float(os.environ.get("RAG_COMPACTION_THRESHOLD", "0.2"))
+
+# Stored vectors sampled as queries when evaluating index types
+EVALUATION_QUERY_SAMPLE = 200
+
+# Called with (pages_done, pages_total) while a document is being indexed
+ProgressCallback = Callable[[int, int], None]
+
+@dataclass
+class RAGDocument:
+    id: str
+    title: str
+    original_file: str
+    last_modified: float
+    in_folder: bool = True
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+class RAGSystem:
+    """
+    Keeps the knowledge base documents chunked, embedded and searchable.
+
+    Chunk vectors live in a memory-mapped FAISS index that is updated in place
+    when documents are added, changed or removed; chunk text sits in a
+    memory-mapped chunk store and document records alongside it in the
+    document store. A content-hash manifest limits rescans to the pages that
+    actually changed.
+    """
+
+    def __init__(self,
+                 docs_dir: str = RAG_DOCS_DIR,
+                 index_path: str = INDEX_PATH,
+                 store_dir: str = DOCUMENT_STORE_DIR,
+                 ingestion_workers: Optional[int] = None,
+                 embedding_model: str = EMBEDDING_MODEL_NAME,
+                 embedding_cache_path: Optional[str] = None):
+        self.docs_dir = docs_dir
+        self.documents_file = os.path.join(store_dir, os.path.basename(DOCUMENTS_FILE))
+        self.chunks_file = os.path.join(store_dir, os.path.basename(CHUNKS_FILE))
+        self.manifest = DocumentManifest(os.path.join(store_dir, os.path.basename(MANIFEST_FILE)))
+
+        os.makedirs(docs_dir, exist_ok=True)
+        os.makedirs(store_dir, exist_ok=True)
+
+        self.documents: Dict[str, RAGDocument] = {}
+        self.chunk_store = ChunkStore(self.chunks_file)
+        # Bumped on every index mutation; retrieval cache keys include it
+        self.index_generation = 0
+
+        self._lock = threading.RLock()
+        self._compaction_thread: Optional[threading.Thread] = None
+        self.embedder = Embedder(embedding_model, cache_path=embedding_cache_path or os.path.join(
+            os.path.dirname(index_path), os.path.basename(EMBEDDING_CACHE_PATH)))
+        # Other models are loaded up front to find out their dimension
+        self.embedding_dimension = EMBEDDING_DIMENSION if embedding_model == EMBEDDING_MODEL_NAME \
+            else self.embedder.dimension
+        self.ingestion_pool = IngestionPool(max_workers=ingestion_workers)
+        self.query_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+        self.retrieval_cache = LRUCache(RETRIEVAL_CACHE_SIZE)
+        self.partition_ids_cache = LRUCache(PARTITION_IDS_CACHE_SIZE)
+        self.reranker = CrossEncoderReranker(RERANK_MODEL_NAME) if RERANK_MODEL_NAME else None
+        # Answer decisive keyword matches without a vector search; the
+        # benchmark turns this off so every query exercises the vector index
+        self.keyword_shortcut = True
+        # Tags documents with the same subject and grade vocabulary used for queries
+        self.intent_classifier = IntentClassifier()
+
+        self._load_store()
+        self.vector_index = VectorIndex(index_path, self.embedding_dimension)
+        self.keyword_index = BM25Index(os.path.join(
+            os.path.dirname(index_path), os.path.basename(KEYWORD_INDEX_PATH)))
+        self.partitions = PartitionedIndex(os.path.join(
+            os.path.dirname(index_path), os.path.basename(PARTITIONS_DIR)), self.embedding_dimension)
+        self._reconcile_index()
+
+        print(f"RAG System initialized with {len(self.documents)} documents "
+              f"and {self.vector_index.live_count} vectors")
+
+    def warm_up(self):
+        """
+        Load the embedding and reranker models before the first query
+
+        Otherwise the first questions pay for the load inside the RAG
+        stage's deadline and are answered without knowledge base passages.
+        """
+        self.embedder.model
+        if self.reranker is not None:
+            self.reranker.warm_up()
+
+    def retrieve(self, text: str, top_k: int = 3, subject: Optional[str] = None,
+                 grade: Optional[str] = None) -> List[Tuple[DocumentChunk, float]]:
+        """
+        Find the chunks most relevant to the query text.
+
+        With a subject and/or grade (as returned by IntentClassifier) only the
+        matching partitions are searched. If they give fewer than top_k hits
+        above RELEVANCE_THRESHOLD, the whole knowledge base is searched too
+        and the best top_k of both are returned.
+
+        The BM25 keyword leg runs first. When it is decisive (its best hit
+        matches every query term by a clear margin) the vector search is
+        skipped and only the keyword hits are scored against the query
+        embedding; otherwise its hits are fused with the vector search
+        results. If a reranker is configured and the hits that pass
+        RELEVANCE_THRESHOLD are close at the top_k cut, the leading ones are
+        rescored by the cross-encoder in one batch and reordered.
+
+        Returns:
+            List of (chunk, relevance) pairs, best first. Relevance is on the
+            cosine scale: vector-only hits keep their cosine similarity and
+            keyword matches raise it, but a keyword match alone never reaches
+            RELEVANCE_THRESHOLD. Reranking changes the order and which
+            chunks make the cut, not the relevance reported for them; it only
+            chooses among hits that already pass the threshold, so it cannot
+            displace a relevant chunk with one the caller would drop.
+        """
+        if not text or not text.strip() or self.vector_index.live_count == 0:
+            return []
+
+        query_key = normalize_query(text)
+        cache_key = (self.index_generation, query_key, top_k, subject, grade)
+        cached = self.retrieval_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+
+        partition_keys = self.partitions.keys_matching(subject, grade) if subject or grade else []
+
+        # Partition filtering happens inside the keyword search, from the
+        # manifest's vector ids, so no chunk is read before ranking
+        allowed = self._partition_vector_ids(partition_keys) if partition_keys else None
+        keyword_hits = self.keyword_index.search(text, HYBRID_CANDIDATES, allowed)
+        keyword_scores = keyword_confidences(keyword_hits)
+
+        query_vector = self._embed_query(query_key)
+        keyword_decisive = self.keyword_shortcut and self._keyword_is_decisive(keyword_hits)
+        if keyword_decisive:
+            fused = self._score_keyword_hits(query_vector, keyword_scores)
+        else:
+            candidates = max(top_k, HYBRID_CANDIDATES, RERANK_CANDIDATES if self.reranker else 0)
+            if partition_keys:
+                scores, ids = self.partitions.search(partition_keys, query_vector, candidates)
+            else:
+                scores, ids = self.vector_index.search(query_vector, candidates)
+
+            fused = dict(keyword_scores)
+            for score, vector_id in zip(scores[0], ids[0]):
+                if vector_id < 0:
+                    continue
+                vector_id = int(vector_id)
+                fused[vector_id] = fuse_relevance(float(score), keyword_scores.get(vector_id, 0.0))
+
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+        # The cross-encoder's scores are not on the relevance scale, so the
+        # threshold is applied to the first-stage scores before it runs
+        relevant = [item for item in ranked if item[1] > RELEVANCE_THRESHOLD]
+        if not keyword_decisive and self._should_rerank(relevant, top_k):
+            results = self._rerank(text, relevant[:RERANK_CANDIDATES], top_k)
+        else:
+            results = []
+            for vector_id, score in ranked:
+                # Only the hits actually returned are read from the chunk store
+                chunk = self.chunk_store.get(vector_id)
+                if chunk is not None:
+                    results.append((chunk, score))
+                    if len(results) >= top_k:
+                        break
+
+        # Weak in-partition hits would be dropped by the caller, so only
+        # relevant ones count towards skipping the global search
+        if partition_keys and sum(1 for _, score in results if score > RELEVANCE_THRESHOLD) < top_k:
+            seen = {chunk.vector_id for chunk, _ in results}
+            merged = results + [(chunk, score) for chunk, score in self.retrieve(text, top_k)
+                                if chunk.vector_id not in seen]
+            results = sorted(merged, key=lambda item: item[1], reverse=True)[:top_k]
+
+        self.retrieval_cache.put(cache_key, tuple(results))
+        return results
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """
+        Hit, miss and eviction counters for the retrieval caches
+        """
+        return {
+            "index_generation": self.index_generation,
+            "query_embeddings": self.query_embedding_cache.stats(),
+            "retrieval_results": self.retrieval_cache.stats(),
+            "chunk_embeddings": dict(self.embedder.stats),
+            "reranker": self.reranker.get_stats() if self.reranker else None
+        }
+
+    def get_index_info(self) -> Dict[str, Any]:
+        info = self.vector_index.describe()
+        info["partitions"] = self.partitions.describe()
+        return info
+
+    def train_index(self) -> Dict[str, Any]:
+        """
+        Retrain the current index type on the current vectors.
+
+        IVF centroids and PQ codebooks are fitted to the corpus they were
+        trained on; retrain after the knowledge base has grown substantially.
+        """
+        return self.rebuild_index(self.vector_index.config.index_type)
+
+    def rebuild_index(self, index_type: Optional[str] = None, **params) -> Dict[str, Any]:
+        """
+        Build a new index of the given type from the stored vectors and swap it in
+
+        Args:
+            index_type: One of flat, ivf_flat, ivf_pq, hnsw (default: current type)
+            params: IndexConfig overrides such as nlist, pq_m, hnsw_m, nprobe, ef_search
+        """
+        index_type = index_type or self.vector_index.config.index_type
+        if index_type not in INDEX_TYPES:
+            return {"success": False, "message": f"Unknown index type: {index_type}"}
+
+        with self._lock:
+            config = replace(self.vector_index.config, index_type=index_type, **params)
+            # Kept as the target if there are too few vectors to build it yet
+            self.vector_index.target_type = index_type
+            vector_ids, vectors = self._collect_vectors()
+            self.vector_index.build(vectors, vector_ids, config)
+            self.index_generation += 1
+
+        return {"success": True, "index": self.vector_index.describe()}
+
+    def compact_index(self) -> Dict[str, Any]:
+        """
+        Physically drop tombstoned vectors from the index
+        """
+        removed = self.vector_index.compact()
+        removed += self.partitions.compact(0.0)
+        return {"success": True, "vectors_removed": removed, "index": self.get_index_info()}
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> Dict[str, Any]:
+        self.vector_index.set_search_params(nprobe=nprobe, ef_search=ef_search)
+        self.index_generation += 1
+        return self.vector_index.describe()
+
+    def evaluate_index_types(self, k: int = 10,
+                             configs: Optional[List[IndexConfig]] = None) -> Dict[str, Any]:
+        """
+        Compare index types on the live corpus: recall@k against exact search,
+        query latency, build time and private versus memory-mapped bytes.
+
+        Flat and IVF indexes keep vectors memory-mapped (shared page cache, no
+        private copy per worker); PQ shrinks them to pq_m bytes each at some
+        cost in recall; HNSW gives the best recall per millisecond but holds
+        the vectors and graph in each worker's private memory.
+        """
+        if configs is None:
+            base = self.vector_index.config
+            configs = [replace(base, index_type=index_type) for index_type in INDEX_TYPES]
+
+        with self._lock:
+            vector_ids, vectors = self._collect_vectors()
+
+        if len(vector_ids) == 0:
+            return {"vectors": 0, "results": []}
+
+        sample = random.Random(0).sample(range(len(vector_ids)), min(EVALUATION_QUERY_SAMPLE, len(vector_ids)))
+        results = evaluate_index_configs(vectors, vector_ids, configs, vectors[sample], k=k)
+
+        return {"vectors": len(vector_ids), "queries": len(sample), "results": results}
+
+    def _document_partition(self, doc: RAGDocument) -> str:
+        return partition_key(doc.metadata.get("subject"), doc.metadata.get("grade"))
+
+    def _partition_vector_ids(self, partition_keys: List[str]) -> AbstractSet[int]:
+        """
+        Vector ids of the documents in the given partitions, cached per index generation
+        """
+        cache_key = (self.index_generation, tuple(partition_keys))
+        vector_ids = self.partition_ids_cache.get(cache_key)
+        if vector_ids is None:
+            vector_ids = frozenset(
+                vector_id
+                for doc in list(self.documents.values()) if self._document_partition(doc) in partition_keys
+                for vector_id in self.manifest.vector_ids(doc.id)
+            )
+            self.partition_ids_cache.put(cache_key, vector_ids)
+        return vector_ids
+
+    def _classify_document(self, doc: RAGDocument):
+        """
+        Tag a document with a subject and grade from its path in the documents folder,
+        e.g. "Grade5_Mathematics" or "science/grade3/plants"
+        """
         try:
-            self.tts_model = TTS(model_name="tts_models/en/ljspeech/glow-tts", 
-                               progress_bar=False, gpu=False)
-        except Exception as e:
-            print(f"Error loading TTS model: {e}")
-            self.tts_model = None
-    
-    def transcribe_audio(self, audio_data: bytes = None, filepath: str = None) -> str:
-        if self.stt_model is None:
-            raise ValueError("Speech-to-text model not available")
-        
+            relative = os.path.relpath(doc.original_file, self.docs_dir)
+        except ValueError:
+            relative = os.path.basename(doc.original_file)
+        name = os.path.splitext(relative)[0].replace("\\", " ").replace("/", " ").replace("_", " ")
+
+        subject = self.intent_classifier.extract_topic(name)
+        if subject not in self.intent_classifier.topic_patterns:
+            subject = None
+        doc.metadata["subject"] = subject
+        doc.metadata["grade"] = self.intent_classifier.extract_grade_level(name)
+
+    def _should_rerank(self, ranked: List[Tuple[int, float]], top_k: int) -> bool:
+        """
+        Rerank only when it can change the answer and fits the latency budget
+        """
+        if self.reranker is None or len(ranked) <= top_k:
+            return False
+
+        if ranked[top_k - 1][1] - ranked[top_k][1] >= RERANK_DECISIVE_MARGIN:
+            self.reranker.stats["skipped_margin"] += 1
+            return False
+
+        return self.reranker.within_budget(min(len(ranked), RERANK_CANDIDATES), RERANK_BUDGET_MS)
+
+    def _rerank(self, text: str, candidates: List[Tuple[int, float]],
+                top_k: int) -> List[Tuple[DocumentChunk, float]]:
+        chunks = []
+        for vector_id, score in candidates:
+            chunk = self.chunk_store.get(vector_id)
+            if chunk is not None:
+                chunks.append((chunk, score))
+
+        rerank_scores = self.reranker.score(text, [chunk.content for chunk, _ in chunks])
+        order = np.argsort(-rerank_scores, kind="stable")[:top_k]
+        return [chunks[position] for position in order]
+
+    def _collect_vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        All stored vectors in id order, served from the embedding cache
+        """
+        vector_ids = self.chunk_store.ids()
+        if not vector_ids:
+            return np.zeros(0, dtype="int64"), np.zeros((0, self.embedding_dimension), dtype="float32")
+
+        vectors = self.embedder.embed_documents([self.chunk_store.get(vector_id).content for vector_id in vector_ids])
+        return np.asarray(vector_ids, dtype="int64"), vectors
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """
+        Embedding of a query, shared with the retrieval query cache
+        """
+        return self._embed_query(normalize_query(text))
+
+    def _embed_query(self, query_key: str):
+        vector = self.query_embedding_cache.get(query_key)
+        if vector is None:
+            vector = self.embedder.embed_query(query_key)
+            self.query_embedding_cache.put(query_key, vector)
+        return vector
+
+    def _score_keyword_hits(self, query_vector: np.ndarray, keyword_scores: Dict[int, float]) -> Dict[int, float]:
+        """
+        Fused relevance of the keyword hits alone, without a vector search
+
+        Their embeddings are served from the embedding cache; a keyword match
+        is no evidence of relevance without the cosine similarity behind it.
+        """
+        chunks = [(vector_id, self.chunk_store.get(vector_id)) for vector_id in keyword_scores]
+        chunks = [(vector_id, chunk) for vector_id, chunk in chunks if chunk is not None]
+        if not chunks:
+            return {}
+
+        vectors = self.embedder.embed_documents([chunk.content for _, chunk in chunks])
+        cosines = vectors @ query_vector.reshape(-1)
+        return {
+            vector_id: fuse_relevance(float(cosine), keyword_scores[vector_id])
+            for (vector_id, _), cosine in zip(chunks, cosines)
+        }
+
+    def _keyword_is_decisive(self, keyword_hits: List[Tuple[int, float, float]]) -> bool:
+        if not keyword_hits or keyword_hits[0][2] < 1.0:
+            return False
+        if len(keyword_hits) == 1:
+            return True
+        return keyword_hits[0][1] >= KEYWORD_DECISIVE_MARGIN * keyword_hits[1][1]
+
+    def get_document_list(self) -> List[Dict[str, Any]]:
+        """
+        List known documents in the shape the document manager expects
+        """
+        # Snapshot without taking the lock so listing never waits on ingestion
+        return [
+            {
+                "id": doc.id,
+                "title": doc.title,
+                "original_file": doc.original_file,
+                "in_folder": doc.in_folder,
+                "in_faiss": bool(self.manifest.vector_ids(doc.id)),
+                "last_modified": doc.last_modified,
+                "chunks": len(self.manifest.vector_ids(doc.id)),
+                "subject": doc.metadata.get("subject"),
+                "grade": doc.metadata.get("grade")
+            }
+            for doc in list(self.documents.values())
+        ]
+
+    def scan_documents_folder(self) -> Dict[str, Any]:
+        """
+        Bring the index in line with the documents folder.
+
+        Files whose size and mtime match the manifest are skipped without being
+        read; files whose content hash is unchanged are skipped without being
+        extracted. Otherwise only pages with a new content hash are chunked and
+        embedded, and files that have disappeared are dropped from the index.
+        """
+        with self._lock:
+            added = 0
+            updated = 0
+            pages_embedded = 0
+            seen_paths = set()
+
+            for filepath in self._list_document_files():
+                seen_paths.add(self._path_key(filepath))
+                try:
+                    status, embedded = self._sync_file(filepath)
+                    pages_embedded += embedded
+                    if status == "added":
+                        added += 1
+                    elif status == "updated":
+                        updated += 1
+                except Exception as e:
+                    print(f"Error indexing {filepath}: {e}")
+
+            removed = 0
+            for doc in list(self.documents.values()):
+                if self._path_key(doc.original_file) not in seen_paths:
+                    self._remove_document_vectors(doc)
+                    del self.documents[doc.id]
+                    removed += 1
+
+            self._save_store()
+            self._upgrade_index()
+
+            return {
+                "added": added,
+                "updated": updated,
+                "removed": removed,
+                "pages_embedded": pages_embedded,
+                "embedding_cache": dict(self.embedder.stats),
+                "total_docs": len(self.documents),
+                "total_in_faiss": sum(1 for doc in self.documents.values()
+                                      if self.manifest.vector_ids(doc.id))
+            }
+
+    def ingest_file(self, filepath: str, progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """
+        Index a single file from the documents folder, reporting page progress
+
+        Meant to run off the event loop, e.g. from the ingestion job queue.
+        """
+        with self._lock:
+            status, embedded = self._sync_file(filepath, progress)
+            self._save_store()
+            self._upgrade_index()
+
+            doc = self._find_document_by_path(self._path_key(filepath))
+            return {
+                "status": status or "unchanged",
+                "doc_id": doc.id if doc else None,
+                "pages_embedded": embedded,
+                "chunks": len(self.manifest.vector_ids(doc.id)) if doc else 0
+            }
+
+    def _sync_file(self, filepath: str, progress: Optional[ProgressCallback] = None) -> Tuple[Optional[str], int]:
+        """
+        Index one file if it is new or its content changed
+
+        Returns:
+            ("added" | "updated" | None when unchanged, number of pages embedded)
+        """
+        doc = self._find_document_by_path(self._path_key(filepath))
+
+        stat = os.stat(filepath)
+        if doc is not None and self.manifest.is_unchanged(doc.id, stat.st_size, stat.st_mtime):
+            return None, 0
+
+        file_hash = hash_file(filepath)
+        entry = self.manifest.get(doc.id) if doc is not None else None
+        if entry is not None and entry.file_hash == file_hash:
+            entry.size = stat.st_size
+            entry.mtime = stat.st_mtime
+            return None, 0
+
+        is_new = doc is None
+        if is_new:
+            doc = RAGDocument(
+                id=self._make_document_id(filepath),
+                title=os.path.splitext(os.path.basename(filepath))[0],
+                original_file=filepath,
+                last_modified=stat.st_mtime,
+                metadata={"source": filepath}
+            )
+            self._classify_document(doc)
+            self.documents[doc.id] = doc
+
         try:
-            if audio_data is not None:
-                with open(TEMP_AUDIO_PATH, "wb") as f:
-                    f.write(audio_data)
-                filepath = TEMP_AUDIO_PATH
-            
-            if filepath is None or not os.path.exists(filepath):
-                raise ValueError("No audio data or valid filepath provided")
-            
-            result = self.stt_model.transcribe(filepath)
-            transcription_text = result.get("text", "").strip()
-            transcription_text = self._clean_transcription(transcription_text)
-            
-            if filepath == TEMP_AUDIO_PATH and os.path.exists(TEMP_AUDIO_PATH):
+            pages, embedded = self._index_document_pages(doc, filepath, entry.pages if entry else [], progress)
+        except Exception:
+            if is_new:
+                del self.documents[doc.id]
+            raise
+
+        self.manifest.set(doc.id, FileEntry(
+            file_hash=file_hash,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            pages=pages
+        ))
+        # The manifest's vector ids feed the cached partition filters
+        self.index_generation += 1
+        doc.last_modified = stat.st_mtime
+        doc.in_folder = True
+
+        return ("added" if is_new else "updated"), embedded
+
+    def remove_document(self, doc_id: str) -> Dict[str, Any]:
+        """
+        Remove a document, its vectors and its file in the documents folder.
+
+        Vectors are tombstoned rather than deleted, so this returns without
+        touching the index data and the document stops being retrieved at once.
+        """
+        with self._lock:
+            doc = self.documents.get(doc_id)
+            if doc is None:
+                return {"success": False, "message": f"Unknown document: {doc_id}"}
+
+            removed = self._remove_document_vectors(doc)
+            del self.documents[doc_id]
+            self._save_store()
+
+            # Otherwise the next scan would index it again
+            if os.path.exists(doc.original_file):
                 try:
-                    os.remove(TEMP_AUDIO_PATH)
-                except:
-                    pass
-            
-            return transcription_text
-        except Exception as e:
-            print(f"Error in transcription: {e}")
+                    os.remove(doc.original_file)
+                except OSError as e:
+                    print(f"Could not delete {doc.original_file}: {e}")
+
+            return {"success": True, "doc_id": doc_id, "vectors_removed": removed}
+
+    def _index_document_pages(self, doc: RAGDocument, filepath: str,
+                              previous_pages: List[PageEntry],
+                              progress: Optional[ProgressCallback] = None) -> Tuple[List[PageEntry], int]:
+        """
+        Extract a document in the ingestion pool and embed only pages whose hash is new.
+
+        Pages stream in from the pool as they finish and their chunks are
+        embedded in batches while later pages are still being extracted.
+        Pages are matched on hash rather than position, so inserting a page
+        does not force the pages after it to be re-embedded.
+
+        Returns:
+            The document's page entries and the number of pages embedded
+        """
+        previous_by_hash: Dict[str, List[PageEntry]] = {}
+        for page in previous_pages:
+            previous_by_hash.setdefault(page.hash, []).append(page)
+
+        partition = self._document_partition(doc)
+        pages: List[PageEntry] = []
+        pending_texts: List[str] = []
+        pending_pages: List[PageEntry] = []
+        added_ids: List[int] = []
+        embedded = 0
+
+        def flush():
+            if not pending_texts:
+                return
+            vectors = self.embedder.embed_documents(pending_texts)
+            vector_ids = self.chunk_store.allocate_ids(len(pending_texts))
+
+            self.vector_index.add(vectors, vector_ids)
+            self.partitions.add(partition, vectors, vector_ids)
+            self.index_generation += 1
+            added_ids.extend(vector_ids)
+
+            for vector_id, text, page in zip(vector_ids, pending_texts, pending_pages):
+                page.vector_ids.append(vector_id)
+                self.chunk_store.put(vector_id, doc.id, doc.title, page.page, text)
+                self.keyword_index.add(vector_id, text)
+            pending_texts.clear()
+            pending_pages.clear()
+
+        page_count = self.ingestion_pool.page_count(filepath)
+        if progress:
+            progress(0, page_count)
+
+        try:
+            for result in self.ingestion_pool.iter_pages(filepath, previous_by_hash.keys(), page_count):
+                if progress:
+                    progress(len(pages) + 1, page_count)
+
+                candidates = previous_by_hash.get(result.hash)
+                reused = candidates.pop(0) if candidates else None
+
+                if reused is not None:
+                    page = PageEntry(page=result.page, hash=result.hash, vector_ids=reused.vector_ids)
+                    for vector_id in page.vector_ids:
+                        self.chunk_store.set_page(vector_id, result.page)
+                    pages.append(page)
+                    continue
+
+                text = result.text
+                if text is None:
+                    # Known hash, but every earlier copy of it is already claimed
+                    text = process_pdf_page(filepath, result.page).text
+
+                page = PageEntry(page=result.page, hash=result.hash)
+                page_chunks = chunk_text(text)
+                pending_texts.extend(page_chunks)
+                pending_pages.extend([page] * len(page_chunks))
+                if page_chunks:
+                    embedded += 1
+                pages.append(page)
+
+                if len(pending_texts) >= EMBED_FLUSH_SIZE:
+                    flush()
+            flush()
+        except Exception:
+            # Leave the index as it was so the next scan retries this file cleanly
+            self._drop_vectors(added_ids, partition)
             raise
-    
-    def generate_speech(self, text: str) -> str:
-        if self.tts_model is None:
-            raise ValueError("Text-to-speech model not available")
-        
+
+        # Whatever was not matched belongs to pages that changed or were deleted
+        stale_ids = [vector_id
+                     for unmatched in previous_by_hash.values()
+                     for page in unmatched
+                     for vector_id in page.vector_ids]
+        self._drop_vectors(stale_ids, partition)
+
+        pages.sort(key=lambda page: page.page)
+
+        print(f"Indexed {doc.title}: {len(added_ids)} new chunks, "
+              f"{len(stale_ids)} stale vectors removed")
+        return pages, embedded
+
+    def _remove_document_vectors(self, doc: RAGDocument) -> int:
+        """
+        Drop a document's vectors from the index, its chunks and its manifest entry
+        """
+        entry = self.manifest.remove(doc.id)
+        if entry is None:
+            return 0
+        return self._drop_vectors(entry.vector_ids, self._document_partition(doc))
+
+    def _drop_vectors(self, vector_ids: List[int], partition: Optional[str] = None) -> int:
+        """
+        Remove vectors from the vector indexes, keyword index and chunk store
+
+        The vector index only tombstones them; a background compaction
+        reclaims the space once enough of the index is dead.
+        """
+        if not vector_ids:
+            return 0
+
+        removed = self.vector_index.remove(vector_ids)
+        if partition is not None:
+            self.partitions.remove(partition, vector_ids)
+        self.index_generation += 1
+        self.keyword_index.remove(vector_ids)
+        self.chunk_store.remove(vector_ids)
+
+        self._schedule_compaction()
+        return removed
+
+    def _schedule_compaction(self):
+        dead_fraction = max(self.vector_index.dead_fraction, self.partitions.max_dead_fraction())
+        if dead_fraction < COMPACTION_DEAD_FRACTION:
+            return
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+
+        def run():
+            try:
+                self.vector_index.compact()
+                self.partitions.compact(COMPACTION_DEAD_FRACTION)
+            except Exception as e:
+                print(f"Error compacting vector index: {e}")
+
+        self._compaction_thread = threading.Thread(target=run, name="rag-compaction", daemon=True)
+        self._compaction_thread.start()
+
+    def _list_document_files(self) -> List[str]:
+        files = []
+        for root, _, filenames in os.walk(self.docs_dir):
+            for filename in sorted(filenames):
+                if filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                    files.append(os.path.join(root, filename))
+        return files
+
+    def _find_document_by_path(self, path_key: str) -> Optional[RAGDocument]:
+        for doc in self.documents.values():
+            if self._path_key(doc.original_file) == path_key:
+                return doc
+        return None
+
+    def _path_key(self, filepath: str) -> str:
+        # Stored paths may have been written on Windows
+        return os.path.normcase(os.path.normpath(filepath.replace("\\", "/")))
+
+    def _make_document_id(self, filepath: str) -> str:
+        path_hash = hashlib.md5(self._path_key(filepath).encode("utf-8")).hexdigest()
+        return f"{path_hash}_{os.path.basename(filepath)}"
+
+    def _reconcile_index(self):
+        """
+        Make sure the index, chunk store and manifest describe the same vectors
+        """
+        counts = (self.vector_index.live_count, len(self.chunk_store), self.manifest.total_vectors())
+        if counts[0] == counts[1] == counts[2]:
+            if len(self.keyword_index) != len(self.chunk_store):
+                print("Rebuilding keyword index from the chunk store...")
+                self.keyword_index.clear()
+                for chunk in self.chunk_store.iter_chunks():
+                    self.keyword_index.add(chunk.vector_id, chunk.content)
+                self.keyword_index.save()
+            if self.partitions.live_count != counts[0]:
+                self._rebuild_partitions()
+            self._upgrade_index()
+            return
+
+        print(f"Vector index, chunk store and manifest are out of sync {counts}; "
+              f"documents will be re-indexed on the next scan")
+        self.vector_index.reset()
+        self.index_generation += 1
+        self.keyword_index.clear()
+        self.chunk_store.clear()
+        self.partitions.clear()
+        self.manifest.clear()
+        self._save_store()
+        self._upgrade_index()
+
+    def _upgrade_index(self):
+        """
+        Rebuild the vector index as the configured type once it can be trained
+
+        A new or reset index starts flat, and IVF types need enough vectors
+        for their clustering (PQ more still), so this runs whenever the
+        corpus has changed and builds the configured type, or the best
+        fallback for the current size, when that differs from the live one.
+        """
+        config = self.vector_index.pending_config()
+        if config is None:
+            return
+
         try:
-            timestamp = int(time.time())
-            output_filename = f"response_{timestamp}.wav"
-            output_path = os.path.join(TTS_OUTPUT_DIR, output_filename)
-            
-            cleaned_text = self._clean_text_for_tts(text)
-            self.tts_model.tts_to_file(text=cleaned_text, file_path=output_path)
-            
-            return output_filename
+            vector_ids, vectors = self._collect_vectors()
+            self.vector_index.build(vectors, vector_ids, config)
+            self.index_generation += 1
         except Exception as e:
-            print(f"Error generating speech: {e}")
-            raise
-    
-    def _clean_transcription(self, text: str) -> str:
-        text = re.sub(r'\s+', ' ', text)
-        text = re.sub(r'^(um|uh|like|so|well|okay|actually)\s+', '', text, flags=re.IGNORECASE)
-        text = re.sub(r'\s+(um|uh|like|you know)$', '', text, flags=re.IGNORECASE)
-        
-        if text and not text[-1] in '.?!':
-            text += '.'
-        
-        return text.strip()
-    
-    def _clean_text_for_tts(self, text: str) -> str:
+            print(f"Error building {config.index_type} vector index: {e}")
+
+    def _rebuild_partitions(self):
+        """
+        Fill the partition indexes from the chunk store, with vectors from the embedding cache
+        """
+        print("Rebuilding partition indexes from the chunk store...")
+        self.partitions.clear()
+        for doc in list(self.documents.values()):
+            vector_ids = [vector_id for vector_id in self.manifest.vector_ids(doc.id)
+                          if vector_id in self.chunk_store]
+            if not vector_ids:
+                continue
+            vectors = self.embedder.embed_documents(
+                [self.chunk_store.get(vector_id).content for vector_id in vector_ids])
+            self.partitions.add(self._document_partition(doc), vectors, vector_ids)
+
+    def _load_store(self):
+        """
+        Load document records from the document store; chunks live in the chunk store
+        """
+        doc_fields = {f.name for f in fields(RAGDocument)}
+
         try:
-            if text.startswith('{') and text.endswith('}'):
-                try:
-                    json_data = json.loads(text)
-                    if 'explanation' in json_data:
-                        text = json_data['explanation']
-                except json.JSONDecodeError:
-                    pass
-            
-            elif '```json' in text:
-                json_start = text.find('```json') + 7
-                json_end = text.rfind('```')
-                if json_start > 0 and json_end > json_start:
-                    json_str = text[json_start:json_end].strip()
-                    try:
-                        json_data = json.loads(json_str)
-                        if 'explanation' in json_data:
-                            text = json_data['explanation']
-                    except json.JSONDecodeError:
-                        pass
-            
-            cleaned_text = text.replace('\\', '').replace('```json', '').replace('```', '').strip()
-            cleaned_text = re.sub(r'\[DRAW:.*?\]', '', cleaned_text).strip()
-            cleaned_text = cleaned_text.replace('+', ' plus ').replace('=', ' equals ')
-            cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
-            cleaned_text = re.sub(r'<[^>]+>', '', cleaned_text)
-            
-            if len(cleaned_text) > 1000:
-                cleaned_text = cleaned_text[:997] + "..."
-            
-            return cleaned_text
+            if os.path.exists(self.documents_file):
+                with open(self.documents_file, 'r', encoding="utf-8") as f:
+                    data = json.load(f)
+                for doc_id, doc_data in data.items():
+                    doc_data = {k: v for k, v in doc_data.items() if k in doc_fields}
+                    doc_data["id"] = doc_id
+                    doc = RAGDocument(**doc_data)
+                    if "subject" not in doc.metadata:
+                        self._classify_document(doc)
+                    self.documents[doc_id] = doc
         except Exception as e:
-            print(f"Error cleaning text for TTS: {e}")
-            return text[:500]
\ No newline at end of file
+            print(f"Error loading document store: {e}")
+
+    def _save_store(self):
+        """
+        Persist document records and chunk metadata
+        """
+        try:
+            self._write_json(self.documents_file, {
+                doc_id: asdict(doc) for doc_id, doc in self.documents.items()
+            })
+            self.chunk_store.save()
+            self.manifest.save()
+            self.keyword_index.save()
+        except Exception as e:
+            print(f"Error saving document store: {e}")
+
+    def _write_json(self, path: str, data: Any):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
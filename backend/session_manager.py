@@ -0,0 +1,336 @@
+"""
+Session Manager - Per-student conversation and learning state for the tutor
+"""
+
+import os
+import re
+import gzip
+import hashlib
+import json
+import time
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
+
+from backend.learning_tracker import LearningTracker
+
+# Requests without a session id belong to this session, which keeps using
+# the process-wide learning tracker and its files
+DEFAULT_SESSION_ID = "default"
+
+# Client ids used unchanged as file names; anything else is hashed
+PLAIN_SESSION_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+def normalize_session_id(session_id: Optional[str]) -> str:
+    """
+    The key, safe to use as a file name, of the session for a client id
+
+    Distinct client ids always get distinct keys. Ids that are already
+    safe are kept; other ids, and a client sending the default session's
+    own id, get "h." and a digest of the raw id, which no plain id can
+    match since plain ids have no dots.
+    """
+    if session_id is None or session_id == "":
+        return DEFAULT_SESSION_ID
+    session_id = str(session_id)
+    if PLAIN_SESSION_ID.fullmatch(session_id) and session_id != DEFAULT_SESSION_ID:
+        return session_id
+    return "h." + hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:40]
+
+@dataclass
+class StudentSession:
+    session_id: str
+    tracker: LearningTracker
+    history: Deque[Dict[str, str]]
+    last_active: float = field(default_factory=time.time)
+    # Requests currently using the session; it is not evicted while above zero
+    in_use: int = 0
+
+class SessionManager:
+    """
+    Keeps the conversation history and learning tracker of each student.
+
+    Active sessions live in memory in least recently used order. Beyond
+    max_active sessions, or after idle_timeout seconds without a request, a
+    session is evicted: its history and in-progress learning session are
+    written to a gzipped JSON file and reloaded on the student's next
+    request. The state is captured under the lock but the file is written
+    after it is released, and a session that is not in memory is restored
+    or created with the lock released too, so other students' requests
+    never wait on disk I/O. Concurrent requests for the same missing
+    session wait for the one that loads it. A session asked for again
+    before its file is written is restored from the captured state.
+    Sessions held through use() are never evicted, so a request does not
+    write to a tracker that has already been saved and dropped. Each
+    student's profile is kept by their own LearningTracker under
+    students/<session id>.
+    """
+
+    def __init__(self, default_tracker: LearningTracker, data_dir: str = "learning_data",
+                 max_active: int = 64, idle_timeout: float = 1800, history_size: int = 40):
+        self.data_dir = data_dir
+        self.students_dir = os.path.join(data_dir, "students")
+        self.evicted_dir = os.path.join(data_dir, "sessions")
+        self.max_active = max_active
+        self.idle_timeout = idle_timeout
+        self.history_size = history_size
+
+        os.makedirs(self.students_dir, exist_ok=True)
+        os.makedirs(self.evicted_dir, exist_ok=True)
+
+        # The default session is pinned: other components share its tracker
+        self.default = StudentSession(DEFAULT_SESSION_ID, default_tracker, deque(maxlen=history_size))
+        self.sessions: "OrderedDict[str, StudentSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Evicted state not yet on disk, and the lock that orders file writes
+        self._unsaved: Dict[str, Dict[str, Any]] = {}
+        self._write_lock = threading.Lock()
+        # Sessions being restored or created; set once they are available
+        self._loading: Dict[str, threading.Event] = {}
+
+        self.stats = {"created": 0, "restored": 0, "evicted_lru": 0, "evicted_idle": 0}
+
+    def get(self, session_id: Optional[str] = None) -> StudentSession:
+        """
+        The session for this id, restored or created if it is not active
+        """
+        return self._get(normalize_session_id(session_id), pin=False)
+
+    def find(self, session_id: Optional[str] = None) -> Optional[StudentSession]:
+        """
+        The session for this id if the student is known, without creating one
+
+        A student is known while their session is active, evicted to disk,
+        or has a profile directory from an earlier session.
+        """
+        return self._get(normalize_session_id(session_id), pin=False, create=False)
+
+    @contextmanager
+    def use(self, session_id: Optional[str] = None) -> Iterator[StudentSession]:
+        """
+        The session for this id, kept in memory until the block exits
+        """
+        session = self._get(normalize_session_id(session_id), pin=True)
+        try:
+            yield session
+        finally:
+            self._release(session)
+
+    @asynccontextmanager
+    async def use_async(self, session_id: Optional[str] = None) -> AsyncIterator[StudentSession]:
+        """
+        use() for the event loop; restoring the session runs in a thread
+        """
+        session = await asyncio.to_thread(self._get, normalize_session_id(session_id), True)
+        try:
+            yield session
+        finally:
+            self._release(session)
+
+    def _release(self, session: StudentSession):
+        with self._lock:
+            session.in_use -= 1
+            session.last_active = time.time()
+
+    def _get(self, session_id: str, pin: bool, create: bool = True) -> Optional[StudentSession]:
+        while True:
+            evicted: List[Tuple[str, Dict[str, Any]]] = []
+            try:
+                with self._lock:
+                    if session_id == DEFAULT_SESSION_ID:
+                        self.default.last_active = time.time()
+                        self.default.in_use += 1 if pin else 0
+                        return self.default
+
+                    self._evict_idle(evicted)
+                    session = self.sessions.get(session_id)
+                    if session is not None:
+                        return self._activate(session, pin, evicted)
+
+                    loading = self._loading.get(session_id)
+                    if loading is None:
+                        loading = self._loading[session_id] = threading.Event()
+                        break
+            finally:
+                self._write_evicted(evicted)
+
+            # Another request is loading this session; it is active once that
+            # finishes, unless the loader was not allowed to create it
+            loading.wait()
+
+        session = None
+        evicted = []
+        try:
+            session = self._load(session_id, create)
+        finally:
+            with self._lock:
+                del self._loading[session_id]
+                if session is not None:
+                    self.sessions[session_id] = session
+                    session = self._activate(session, pin, evicted)
+                loading.set()
+            self._write_evicted(evicted)
+        return session
+
+    def _load(self, session_id: str, create: bool) -> Optional[StudentSession]:
+        """
+        Restore or create a session that is not in memory, outside the lock
+        """
+        session = self._restore(session_id)
+        if session is not None:
+            return session
+        if not create and not os.path.isdir(os.path.join(self.students_dir, session_id)):
+            return None
+        return self._create(session_id)
+
+    def _activate(self, session: StudentSession, pin: bool,
+                  evicted: List[Tuple[str, Dict[str, Any]]]) -> StudentSession:
+        """
+        Mark an active session as just used; called under the lock
+        """
+        session_id = session.session_id
+        self.sessions.move_to_end(session_id)
+        session.last_active = time.time()
+        if pin:
+            session.in_use += 1
+
+        # Sessions in use are skipped; the cache may exceed max_active
+        # while they all are
+        for candidate in list(self.sessions.values()):
+            if len(self.sessions) <= self.max_active:
+                break
+            if candidate.in_use or candidate is session:
+                continue
+            del self.sessions[candidate.session_id]
+            evicted.append(self._evict(candidate))
+            self.stats["evicted_lru"] += 1
+
+        return session
+
+    def save_all(self):
+        """
+        Write every active session to disk, e.g. before the process exits
+        """
+        with self._lock:
+            evicted = [self._evict(session) for session in self.sessions.values()]
+            self.sessions.clear()
+        self._write_evicted(evicted)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["active"] = len(self.sessions)
+            stats["in_use"] = sum(1 for session in self.sessions.values() if session.in_use)
+            stats["max_active"] = self.max_active
+            return stats
+
+    def _create(self, session_id: str) -> StudentSession:
+        session = StudentSession(session_id, self._tracker(session_id), deque(maxlen=self.history_size))
+        with self._lock:
+            self.stats["created"] += 1
+        return session
+
+    def _tracker(self, session_id: str) -> LearningTracker:
+        student_dir = os.path.join(self.students_dir, session_id)
+        os.makedirs(student_dir, exist_ok=True)
+        return LearningTracker(data_dir=student_dir)
+
+    def _evicted_path(self, session_id: str) -> str:
+        return os.path.join(self.evicted_dir, f"{session_id}.json.gz")
+
+    def _evict_idle(self, evicted: List[Tuple[str, Dict[str, Any]]]):
+        cutoff = time.time() - self.idle_timeout
+        # Sessions are in last-used order, so the idle ones are at the front
+        for session in list(self.sessions.values()):
+            if session.last_active > cutoff:
+                break
+            if session.in_use:
+                continue
+            del self.sessions[session.session_id]
+            evicted.append(self._evict(session))
+            self.stats["evicted_idle"] += 1
+
+    def _evict(self, session: StudentSession) -> Tuple[str, Dict[str, Any]]:
+        """
+        Capture the state of a session leaving memory; called under the lock
+        """
+        data = {
+            "session_id": session.session_id,
+            "history": list(session.history),
+            "learning_session": session.tracker.export_session_state(),
+            "last_active": session.last_active
+        }
+        self._unsaved[session.session_id] = data
+        return session.session_id, data
+
+    def _write_evicted(self, evicted: List[Tuple[str, Dict[str, Any]]]):
+        """
+        Write captured session state to disk, outside the session lock
+        """
+        for session_id, data in evicted:
+            with self._write_lock:
+                with self._lock:
+                    # Already restored, or evicted again with newer state
+                    if self._unsaved.get(session_id) is not data:
+                        continue
+
+                path = self._evicted_path(session_id)
+                try:
+                    with gzip.open(path + ".tmp", 'wt', encoding="utf-8") as f:
+                        json.dump(data, f, separators=(",", ":"))
+                    os.replace(path + ".tmp", path)
+                except Exception as e:
+                    print(f"Error saving session {session_id}: {e}")
+
+                with self._lock:
+                    if self._unsaved.get(session_id) is data:
+                        del self._unsaved[session_id]
+                    elif session_id in self.sessions or session_id in self._loading:
+                        # Restored from memory while the file was being written
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+
+    def _restore(self, session_id: str) -> Optional[StudentSession]:
+        with self._lock:
+            data = self._unsaved.pop(session_id, None)
+        if data is not None:
+            session = self._from_state(session_id, data)
+            with self._lock:
+                self.stats["restored"] += 1
+            return session
+
+        path = self._evicted_path(session_id)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with gzip.open(path, 'rt', encoding="utf-8") as f:
+                data = json.load(f)
+            session = self._from_state(session_id, data)
+        except Exception as e:
+            # Kept aside rather than deleted or overwritten by the next eviction
+            print(f"Error restoring session {session_id}: {e}")
+            try:
+                os.replace(path, path + ".failed")
+            except OSError:
+                pass
+            return None
+
+        # The file only holds state while the session is not in memory
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.stats["restored"] += 1
+        return session
+
+    def _from_state(self, session_id: str, data: Dict[str, Any]) -> StudentSession:
+        tracker = self._tracker(session_id)
+        tracker.import_session_state(data.get("learning_session"))
+        return StudentSession(session_id, tracker, deque(data.get("history", []), maxlen=self.history_size))
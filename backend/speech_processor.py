@@ -4,7 +4,9 @@ import os
 import sys
 import shutil
 import re
-import json
+from typing import Any, Dict
+
+from backend.llm.response_parser import parse_tutor_response
 
 TTS_OUTPUT_FILENAME = "current_response.wav"
 TTS_OUTPUT_DIR = "tts_output"
@@ -13,6 +15,25 @@ TTS_OUTPUT_PATH = os.path.join(TTS_OUTPUT_DIR, TTS_OUTPUT_FILENAME)
 # Initialize Coqui TTS model
 tts_model = TTS(model_name="tts_models/en/ljspeech/glow-tts", progress_bar=False, gpu=False)
 
+def tts_text_from_response(json_data: Dict[str, Any]) -> str:
+    """
+    What to say aloud for a parsed tutor reply: the explanation, the scene and the final answer
+    """
+    cleaned_text = ""
+    if 'explanation' in json_data and isinstance(json_data['explanation'], str):
+        cleaned_text = json_data['explanation']
+    
+    if 'scene' in json_data and isinstance(json_data['scene'], list) and json_data['scene']:
+        scene_description = " The scene includes: " + ', '.join([f"{item.get('type', 'unknown')} at position ({item.get('x', 'unknown')}, {item.get('y', 'unknown')})" for item in json_data['scene'] if isinstance(item, dict)])
+        cleaned_text += scene_description
+    
+    if 'final_answer' in json_data and isinstance(json_data['final_answer'], dict):
+        final_answer = json_data['final_answer']
+        final_answer_text = f" The correct answer is {final_answer.get('correct_value', 'unknown')}. {final_answer.get('explanation', '')}"
+        cleaned_text += final_answer_text
+    
+    return cleaned_text.strip()
+
 def generate_tts_audio(text: str) -> str:
     os.makedirs(TTS_OUTPUT_DIR, exist_ok=True)
     
@@ -25,32 +46,10 @@ def generate_tts_audio(text: str) -> str:
     
     cleaned_text = text
     try:
-        if text.startswith('{') and text.endswith('}') and '"explanation"' in text:
-            json_data = json.loads(text)
-            if 'explanation' in json_data and isinstance(json_data['explanation'], str):
-                cleaned_text = json_data['explanation']
-                print(f"Extracted explanation for TTS: {cleaned_text[:100]}...")
-            
-            if 'scene' in json_data and isinstance(json_data['scene'], list):
-                scene_description = " The scene includes: " + ', '.join([f"{item.get('type', 'unknown')} at position ({item.get('x', 'unknown')}, {item.get('y', 'unknown')})" for item in json_data['scene']])
-                cleaned_text += scene_description
-                print(f"Added scene description for TTS: {scene_description[:100]}...")
-            
-            if 'final_answer' in json_data and isinstance(json_data['final_answer'], dict):
-                final_answer = json_data['final_answer']
-                final_answer_text = f" The correct answer is {final_answer.get('correct_value', 'unknown')}. {final_answer.get('explanation', '')}"
-                cleaned_text += final_answer_text
-                print(f"Added final answer for TTS: {final_answer_text[:100]}...")
-        
-        elif '```json' in text:
-            json_start = text.find('```json') + 7
-            json_end = text.rfind('```')
-            if json_start > 0 and json_end > json_start:
-                json_str = text[json_start:json_end].strip()
-                json_data = json.loads(json_str)
-                if 'explanation' in json_data and isinstance(json_data['explanation'], str):
-                    cleaned_text = json_data['explanation']
-                    print(f"Extracted explanation from JSON block for TTS: {cleaned_text[:100]}...")
+        parsed = parse_tutor_response(text)
+        if parsed is not None:
+            cleaned_text = tts_text_from_response(parsed) or text
+            print(f"Extracted response text for TTS: {cleaned_text[:100]}...")
     except Exception as e:
         print(f"Error parsing JSON for TTS: {e}")
     
@@ -3,13 +3,15 @@ PEARL AI Backend - Main Entry Point
 Orchestrates all backend components for the AI tutor system
 """
 
-from fastapi import FastAPI, UploadFile, File, Request, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, UploadFile, File, Form, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 import os
 import uvicorn
 import asyncio
+import tempfile
 from typing import Dict, Any, Optional
 from pydantic import BaseModel
 
@@ -21,7 +23,8 @@ from backend.core_agent import CoreAgent
 from backend.speech_processor import SpeechProcessor, TTS_OUTPUT_DIR
 from backend.camera_system import CameraSystem
 from backend.emotion_analyzer import EmotionAnalyzer
-from backend.rag_system import RAGSystem, RAG_DOCS_DIR
+from backend.rag_system import RAGSystem, RAG_DOCS_DIR, SUPPORTED_EXTENSIONS
+from backend.rag import IngestionJobQueue
 from backend.learning_tracker import LearningTracker
 from backend.intent_classifier import IntentClassifier
 from backend.commands.command_executor import CommandExecutor
@@ -29,6 +32,7 @@ from backend.commands.command_executor import CommandExecutor
 # Request models
 class TextRequest(BaseModel):
     text: str
+    session_id: Optional[str] = None
 
 class TTSRequest(BaseModel):
     text: str
@@ -64,6 +68,10 @@ learning_tracker: Optional[LearningTracker] = None
 intent_classifier: Optional[IntentClassifier] = None
 command_executor: Optional[CommandExecutor] = None
 
+# Document ingestion runs here, off the request path, one file at a time
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+ingestion_jobs = IngestionJobQueue(max_concurrent=1)
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize all backend components on startup"""
@@ -99,6 +107,8 @@ async def startup_event():
         # 4. RAG system
         print("Initializing RAG system...")
         rag_system = RAGSystem()
+        await asyncio.to_thread(rag_system.warm_up)
+        ingestion_jobs.start()
         print("RAG system ready")
         
         # 5. Learning tracker
@@ -130,6 +140,9 @@ async def startup_event():
             intent_classifier=intent_classifier,
             command_executor=command_executor
         )
+        if core_agent.llm_backend.available:
+            # A local model takes a while to load; do it before the first question
+            await asyncio.to_thread(core_agent.llm_backend.load)
         print("Core agent ready")
         
         print("PEARL AI Backend initialization complete!")
@@ -138,6 +151,16 @@ async def startup_event():
         print(f"Critical error during initialization: {e}")
         raise
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close pooled connections and stop background workers"""
+    if core_agent:
+        await core_agent.close()
+    await ingestion_jobs.stop()
+    if rag_system:
+        # Ingestion worker processes would otherwise outlive a reload
+        await asyncio.to_thread(rag_system.ingestion_pool.shutdown)
+
 # Health check endpoint
 @app.get("/")
 async def health_check():
@@ -158,14 +181,14 @@ async def health_check():
 
 # Greeting endpoint - starts the interaction flow
 @app.get("/greeting")
-async def get_greeting():
+async def get_greeting(session_id: Optional[str] = None):
     """Get initial greeting message and start the learning session"""
     if not core_agent:
         return {"error": "Core agent not initialized"}
     
     try:
         # Get personalized greeting based on learning history
-        greeting_response = await core_agent.get_personalized_greeting()
+        greeting_response = await core_agent.get_personalized_greeting(session_id)
         return greeting_response
     except Exception as e:
         print(f"Error getting greeting: {e}")
@@ -173,7 +196,7 @@ async def get_greeting():
 
 # Main speech processing endpoint
 @app.post("/tutor/speak")
-async def process_speech(file: UploadFile = File(...)):
+async def process_speech(file: UploadFile = File(...), session_id: Optional[str] = Form(None)):
     """Process speech input through the complete AI pipeline"""
     if not core_agent:
         return {"error": "Core agent not initialized"}
@@ -185,7 +208,7 @@ async def process_speech(file: UploadFile = File(...)):
         audio_data = await file.read()
         
         # Process through core agent
-        response = await core_agent.process_speech_input(audio_data)
+        response = await core_agent.process_speech_input(audio_data, session_id)
         
         return response
         
@@ -204,7 +227,7 @@ async def process_text(request: TextRequest):
         print(f"Processing text: {request.text}")
         
         # Process through core agent
-        response = await core_agent.process_text_input(request.text)
+        response = await core_agent.process_text_input(request.text, session_id=request.session_id)
         
         return response
         
@@ -289,14 +312,34 @@ async def capture_image():
         return {"error": str(e)}
 
 # Learning progress endpoints
+def tracker_for(session_id: Optional[str], create: bool = True):
+    """
+    Learning tracker of the given student session, or the default one
+
+    With create=False an unknown session id gives None instead of starting
+    a session (and its files) for it.
+    """
+    if core_agent and session_id:
+        if create:
+            return core_agent.sessions.get(session_id).tracker
+        session = core_agent.sessions.find(session_id)
+        return session.tracker if session else None
+    return learning_tracker
+
+def unknown_session(session_id: Optional[str]) -> JSONResponse:
+    return JSONResponse(status_code=404, content={"error": f"Unknown session: {session_id}"})
+
 @app.get("/learning/progress")
-async def get_learning_progress():
+async def get_learning_progress(session_id: Optional[str] = None):
     """Get current learning progress"""
     if not learning_tracker:
         return {"error": "Learning tracker not available"}
     
     try:
-        progress = learning_tracker.get_current_progress()
+        tracker = await asyncio.to_thread(tracker_for, session_id, False)
+        if tracker is None:
+            return unknown_session(session_id)
+        progress = tracker.get_current_progress()
         return progress
     except Exception as e:
         return {"error": str(e)}
@@ -312,36 +355,76 @@ async def log_answer_result(request: dict):
         is_correct = request.get("is_correct", False)
         difficulty = request.get("difficulty", "medium")
         
-        learning_tracker.log_answer_result(topic, is_correct, difficulty)
+        tracker = await asyncio.to_thread(tracker_for, request.get("session_id"))
+        tracker.log_answer_result(topic, is_correct, difficulty)
         
         return {"message": "Answer result logged successfully"}
     except Exception as e:
         return {"error": str(e)}
 
 @app.get("/learning/objectives")
-async def get_learning_objectives():
+async def get_learning_objectives(session_id: Optional[str] = None):
     """Get current learning objectives"""
     if not learning_tracker:
         return {"error": "Learning tracker not available"}
     
     try:
-        objectives = learning_tracker.get_active_objectives()
+        tracker = await asyncio.to_thread(tracker_for, session_id, False)
+        if tracker is None:
+            return unknown_session(session_id)
+        objectives = tracker.get_active_objectives()
         return objectives
     except Exception as e:
         return {"error": str(e)}
 
 @app.post("/learning/reset")
-async def reset_learning_progress():
+async def reset_learning_progress(session_id: Optional[str] = None):
     """Reset learning progress"""
     if not learning_tracker:
         return {"error": "Learning tracker not available"}
     
     try:
-        learning_tracker.reset_progress()
+        tracker = await asyncio.to_thread(tracker_for, session_id, False)
+        if tracker is None:
+            return unknown_session(session_id)
+        tracker.reset_progress()
         return {"message": "Learning progress reset"}
     except Exception as e:
         return {"error": str(e)}
 
+@app.get("/tutor/sessions")
+async def get_session_stats():
+    """Get active, created, restored and evicted student session counts"""
+    if not core_agent:
+        return {"error": "Core agent not initialized"}
+    
+    try:
+        return core_agent.sessions.get_stats()
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.get("/tutor/llm")
+async def get_llm_backends():
+    """Get the LLM backends in use with their latency, error rate and circuit breaker state"""
+    if not core_agent:
+        return {"error": "Core agent not initialized"}
+    
+    try:
+        return core_agent.llm_backend.describe()
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.get("/tutor/cache_stats")
+async def get_tutor_cache_stats():
+    """Get LLM response cache hit rate, request coalescing and pre-LLM stage timings"""
+    if not core_agent:
+        return {"error": "Core agent not initialized"}
+    
+    try:
+        return core_agent.get_cache_stats()
+    except Exception as e:
+        return {"error": str(e)}
+
 # RAG system endpoints
 @app.get("/rag/documents")
 async def get_documents():
@@ -361,11 +444,168 @@ async def scan_documents():
         return {"error": "RAG system not available"}
     
     try:
-        result = rag_system.scan_documents_folder()
+        result = await asyncio.to_thread(rag_system.scan_documents_folder)
         return result
     except Exception as e:
         return {"error": str(e)}
 
+@app.post("/rag/upload")
+async def upload_document(file: UploadFile = File(...)):
+    """Save an uploaded document and queue it for ingestion"""
+    if not rag_system:
+        return {"error": "RAG system not available"}
+    
+    filename = os.path.basename(file.filename or "")
+    if not filename or os.path.splitext(filename)[1].lower() not in SUPPORTED_EXTENSIONS:
+        return {"error": f"Unsupported file type: {filename or 'unnamed file'}"}
+    
+    filepath = os.path.join(RAG_DOCS_DIR, filename)
+    part_path = None
+    try:
+        # Stream to a temp file of its own in chunks, so large PDFs are never
+        # held in memory and concurrent uploads of one name do not mix
+        try:
+            with tempfile.NamedTemporaryFile(dir=RAG_DOCS_DIR, prefix=".upload-", suffix=".part", delete=False) as f:
+                part_path = f.name
+                while True:
+                    chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    await asyncio.to_thread(f.write, chunk)
+        finally:
+            await file.close()
+        
+        # From here to submit there is no await, so another upload of the
+        # same name cannot slip in between the replace and its job.
+        # A running job is still reading the current file; a queued one
+        # has not started and the new upload replaces it
+        active = ingestion_jobs.find_active("ingest", filename)
+        if active is not None and not ingestion_jobs.supersede(active.id):
+            os.remove(part_path)
+            return {"error": f"{filename} is still being ingested (job {active.id}); upload it again when that job finishes"}
+        os.replace(part_path, filepath)
+        part_path = None
+        
+        job = ingestion_jobs.submit(
+            "ingest",
+            filename,
+            lambda progress: rag_system.ingest_file(filepath, progress)
+        )
+        return {"job_id": job.id, "status": job.status, "filename": filename}
+    except Exception as e:
+        if part_path and os.path.exists(part_path):
+            os.remove(part_path)
+        return {"error": str(e)}
+
+@app.post("/rag/remove")
+async def remove_document(request: dict):
+    """Remove a document from the RAG index"""
+    if not rag_system:
+        return {"error": "RAG system not available"}
+    
+    try:
+        doc_id = request.get("doc_id")
+        if not doc_id:
+            return {"error": "doc_id is required"}
+        return await asyncio.to_thread(rag_system.remove_document, doc_id)
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.get("/rag/jobs")
+async def list_ingestion_jobs():
+    """List recent ingestion jobs, newest first"""
+    return ingestion_jobs.list()
+
+@app.get("/rag/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    """Get the status and progress of an ingestion job"""
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        return {"error": f"Job {job_id} not found"}
+    return job.to_dict()
+
+@app.get("/rag/cache_stats")
+async def get_rag_cache_stats():
+    """Get hit/miss/eviction counters for the RAG retrieval caches"""
+    if not rag_system:
+        return {"error": "RAG system not available"}
+    
+    try:
+        return rag_system.get_cache_stats()
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.get("/rag/index")
+async def get_rag_index_info():
+    """Get the vector index type, size, parameters and memory footprint"""
+    if not rag_system:
+        return {"error": "RAG system not available"}
+    
+    try:
+        return rag_system.get_index_info()
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.post("/rag/index/train")
+async def train_rag_index():
+    """Retrain the current index type on the current vectors"""
+    if not rag_system:
+        return {"error": "RAG system not available"}
+    
+    try:
+        return await asyncio.to_thread(rag_system.train_index)
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.post("/rag/index/rebuild")
+async def rebuild_rag_index(request: dict):
+    """Rebuild the vector index as a given type (flat, ivf_flat, ivf_pq, hnsw)"""
+    if not rag_system:
+        return {"error": "RAG system not available"}
+    
+    try:
+        params = dict(request)
+        index_type = params.pop("index_type", None)
+        return await asyncio.to_thread(rag_system.rebuild_index, index_type, **params)
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.post("/rag/index/compact")
+async def compact_rag_index():
+    """Drop removed vectors from the index now instead of waiting for the threshold"""
+    if not rag_system:
+        return {"error": "RAG system not available"}
+    
+    try:
+        return await asyncio.to_thread(rag_system.compact_index)
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.post("/rag/index/search_params")
+async def set_rag_search_params(request: dict):
+    """Tune nprobe (IVF) and efSearch (HNSW) without rebuilding"""
+    if not rag_system:
+        return {"error": "RAG system not available"}
+    
+    try:
+        return rag_system.set_search_params(
+            nprobe=request.get("nprobe"),
+            ef_search=request.get("ef_search")
+        )
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.get("/rag/index/evaluate")
+async def evaluate_rag_index(k: int = 10):
+    """Compare memory footprint and recall of each index type on the current corpus"""
+    if not rag_system:
+        return {"error": "RAG system not available"}
+    
+    try:
+        return await asyncio.to_thread(rag_system.evaluate_index_types, k)
+    except Exception as e:
+        return {"error": str(e)}
+
 # WebSocket for real-time communication
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -384,8 +624,8 @@ async def websocket_endpoint(websocket: WebSocket):
                 })
                 continue
             
-            # Process message through core agent
-            response = await core_agent.process_websocket_message(data)
+            # Process message through core agent, streaming explanation deltas as they arrive
+            response = await core_agent.process_websocket_message(data, websocket.send_json)
             
             # Send response
             await websocket.send_json(response)
@@ -18,6 +18,14 @@ interface ScanResult {
   total_in_faiss: number;
 }
 
+interface IngestionJob {
+  id: string;
+  status: 'queued' | 'running' | 'completed' | 'failed' | 'superseded';
+  done: number;
+  total: number;
+  error: string | null;
+}
+
 const DocumentManager: React.FC = () => {
   const [isOpen, setIsOpen] = useState(false);
   const [documents, setDocuments] = useState<Document[]>([]);
@@ -84,6 +92,26 @@ const DocumentManager: React.FC = () => {
     }
   };
 
+  const waitForIngestionJob = async (jobId: string, fileName: string): Promise<IngestionJob> => {
+    while (true) {
+      const response = await axios.get(`http://localhost:8000/rag/jobs/${jobId}`);
+      if (response.data.error) {
+        throw new Error(response.data.error);
+      }
+      const job: IngestionJob = response.data;
+      if (job.status === 'completed' || job.status === 'failed' || job.status === 'superseded') {
+        return job;
+      }
+      
+      setUploadStatus(
+        job.status === 'running' && job.total > 0
+          ? `Indexing ${fileName}: page ${job.done} of ${job.total}`
+          : `Queued ${fileName} for indexing...`
+      );
+      await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+  };
+
   const handleFileUpload = async (event: React.ChangeEvent<HTMLInputElement>) => {
     const file = event.target.files?.[0];
     if (!file) return;
@@ -96,16 +124,29 @@ const DocumentManager: React.FC = () => {
       const formData = new FormData();
       formData.append('file', file);
       
-      await axios.post('http://localhost:8000/rag/upload', formData, {
+      const response = await axios.post('http://localhost:8000/rag/upload', formData, {
         headers: {
           'Content-Type': 'multipart/form-data'
         }
       });
+      if (response.data.error) {
+        throw new Error(response.data.error);
+      }
+      
+      // Ingestion runs as a background job on the server; poll until it finishes
+      const job = await waitForIngestionJob(response.data.job_id, file.name);
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Ingestion failed');
+      }
       
-      setUploadStatus(`Successfully uploaded ${file.name}`);
+      setUploadStatus(
+        job.status === 'superseded'
+          ? `${file.name} was replaced by a newer upload`
+          : `Successfully uploaded ${file.name}`
+      );
       
-      // Refresh document list and scan result
-      await scanDocuments();
+      // Refresh document list
+      await fetchDocuments();
       
       // Clear the input value so the same file can be uploaded again
       event.target.value = '';
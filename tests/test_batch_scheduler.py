@@ -0,0 +1,107 @@
+"""
+Batch Scheduler Tests - Concurrent generations sharing decode steps on one engine
+"""
+
+import asyncio
+
+from backend.llm.batch_scheduler import BatchEngine, BatchScheduler
+
+class FakeEngine(BatchEngine):
+    """
+    Emits "<name><i>" for each step of a request ("name", length)
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self.batch_sizes = []
+        self.running = 0
+
+    def start(self, slot, request):
+        if self.capacity is not None and self.running >= self.capacity:
+            return None
+        self.running += 1
+        name, length = request
+        return {"name": name, "length": length, "done": 0}
+
+    def step(self, states):
+        self.batch_sizes.append(len(states))
+        results = []
+        for state in states:
+            state["done"] += 1
+            results.append((f"{state['name']}{state['done']}", state["done"] >= state["length"]))
+        return results
+
+    def release(self, state):
+        self.running -= 1
+
+async def collect(scheduler, request):
+    return [text async for text in scheduler.submit(request)]
+
+def run(scheduler, requests):
+    async def scenario():
+        outputs = await asyncio.gather(*(collect(scheduler, request) for request in requests))
+        await scheduler.close()
+        return outputs
+    return asyncio.run(scenario())
+
+def test_concurrent_requests_share_decode_steps():
+    engine = FakeEngine()
+    scheduler = BatchScheduler(lambda: engine, max_batch=4, max_wait_ms=50)
+
+    outputs = run(scheduler, [("a", 3), ("b", 3), ("c", 3)])
+    assert outputs == [["a1", "a2", "a3"], ["b1", "b2", "b3"], ["c1", "c2", "c3"]]
+    assert engine.batch_sizes == [3, 3, 3]
+
+    stats = scheduler.get_stats()
+    assert stats["completed"] == 3 and stats["steps"] == 3
+    assert stats["mean_batch_size"] == 3.0
+
+def test_batch_size_is_capped_and_queued_requests_join_later():
+    engine = FakeEngine()
+    scheduler = BatchScheduler(lambda: engine, max_batch=2, max_wait_ms=50)
+
+    outputs = run(scheduler, [("a", 1), ("b", 3), ("c", 2)])
+    assert outputs == [["a1"], ["b1", "b2", "b3"], ["c1", "c2"]]
+    assert max(engine.batch_sizes) == 2
+    # c takes a's slot at the next step boundary
+    assert engine.batch_sizes == [2, 2, 2]
+    assert scheduler.get_stats()["queue_depth_max"] == 3
+
+def test_request_waits_until_the_engine_has_room():
+    engine = FakeEngine(capacity=1)
+    scheduler = BatchScheduler(lambda: engine, max_batch=4, max_wait_ms=50)
+
+    outputs = run(scheduler, [("a", 2), ("b", 2)])
+    assert outputs == [["a1", "a2"], ["b1", "b2"]]
+    assert engine.batch_sizes == [1, 1, 1, 1]
+
+def test_engine_errors_reach_the_caller():
+    def broken():
+        raise RuntimeError("no model")
+    scheduler = BatchScheduler(broken, max_batch=2, max_wait_ms=0)
+
+    async def scenario():
+        try:
+            await collect(scheduler, ("a", 1))
+        except RuntimeError as e:
+            return str(e)
+        finally:
+            await scheduler.close()
+
+    assert asyncio.run(scenario()) == "no model"
+    assert scheduler.get_stats()["failed"] == 1
+
+def test_caller_going_away_drops_its_sequence():
+    engine = FakeEngine()
+    scheduler = BatchScheduler(lambda: engine, max_batch=2, max_wait_ms=0)
+
+    async def scenario():
+        stream = scheduler.submit(("a", 1000))
+        assert await stream.__anext__() == "a1"
+        await stream.aclose()
+        await asyncio.sleep(0.05)
+        await scheduler.close()
+
+    asyncio.run(scenario())
+    assert scheduler.get_stats()["cancelled"] == 1
+    assert engine.running == 0
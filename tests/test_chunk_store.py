@@ -0,0 +1,57 @@
+"""
+Chunk Store Tests - Reading chunks back and compacting the data file
+"""
+
+import os
+
+from backend.rag.chunk_store import ChunkStore
+
+def store_at(tmp_path):
+    return ChunkStore(os.path.join(str(tmp_path), "chunks.json"))
+
+def fill(store, count):
+    for vector_id in store.allocate_ids(count):
+        store.put(vector_id, "doc", "Title", 1, f"chunk {vector_id} " + "text " * 20)
+
+def test_chunks_survive_a_reopen(tmp_path):
+    store = store_at(tmp_path)
+    fill(store, 3)
+    store.save()
+    store.close()
+
+    reopened = store_at(tmp_path)
+    assert len(reopened) == 3
+    assert reopened.get(1).content.startswith("chunk 1 ")
+    assert reopened.allocate_ids(1) == [3]
+
+def test_removed_chunks_are_compacted_away(tmp_path):
+    store = store_at(tmp_path)
+    fill(store, 4)
+    store.save()
+    old_data_path = store.data_path
+
+    store.remove([0, 1, 2])
+    assert store.get(0) is None
+    store.save()
+
+    assert store.data_path != old_data_path
+    assert not os.path.exists(old_data_path)
+    assert store.dead_bytes == 0
+    assert os.path.getsize(store.data_path) == int(store.table["length"].sum())
+    assert store.ids() == [3]
+    store.close()
+
+    reopened = store_at(tmp_path)
+    assert reopened.get(3).content.startswith("chunk 3 ")
+    assert reopened.allocate_ids(1) == [4]
+
+def test_mostly_live_store_is_not_compacted(tmp_path):
+    store = store_at(tmp_path)
+    fill(store, 4)
+    store.save()
+    data_path = store.data_path
+
+    store.remove([0])
+    store.save()
+    assert store.data_path == data_path
+    assert store.dead_bytes > 0
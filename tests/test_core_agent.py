@@ -0,0 +1,162 @@
+"""
+Core Agent Tests - Pre-LLM stage deadlines and sharing LLM calls between identical prompts
+"""
+
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+# The agent module pulls in the speech, camera and vision stacks
+pytest.importorskip("backend.core_agent")
+
+from backend import core_agent
+from backend.core_agent import CoreAgent, STAGE_DEADLINES_MS
+from backend.intent_classifier import IntentClassifier
+from backend.llm.backends import LLMBackend, LLMReply
+from backend.llm.single_flight import SingleFlight
+
+REPLY = '{"explanation": "Add the numerators.", "follow_up_question": "Try 1/4 + 2/4?"}'
+
+def make_agent():
+    """
+    An agent with only the parts the tested methods use, and a slow fake LLM
+    """
+    agent = CoreAgent.__new__(CoreAgent)
+    agent.llm_backend = LLMBackend()
+    agent.intent_classifier = IntentClassifier()
+    agent.response_cache = None
+    agent.llm_in_flight = SingleFlight()
+    agent.stage_stats = {name: {"runs": 0, "timeouts": 0, "total_ms": 0.0} for name in STAGE_DEADLINES_MS}
+    agent.llm_calls = []
+    agent.llm_release = None
+
+    async def query_llm(session, text, rag_blocks, context_sections, on_delta=None):
+        agent.llm_calls.append(text)
+        await agent.llm_release.wait()
+        return LLMReply.from_text(REPLY)
+
+    agent._query_llm = query_llm
+    return agent
+
+def make_session(history=()):
+    return SimpleNamespace(history=list(history))
+
+def ask_together(agent, sessions, text="how do I add fractions"):
+    async def scenario():
+        agent.llm_release = asyncio.Event()
+        callers = [
+            asyncio.ensure_future(agent._query_llm_cached(session, text, ["passage"], ["context"], "fingerprint"))
+            for session in sessions
+        ]
+        await asyncio.sleep(0.01)
+        agent.llm_release.set()
+        return await asyncio.gather(*callers)
+
+    return asyncio.run(scenario())
+
+def test_identical_prompts_share_one_llm_call():
+    agent, sessions = make_agent(), [make_session(), make_session()]
+    replies = ask_together(agent, sessions)
+
+    assert len(agent.llm_calls) == 1
+    assert [reply.text for reply in replies] == [REPLY, REPLY]
+    # The follower's history records the shared answer too
+    assert sessions[1].history[-1] == {"role": "assistant", "content": REPLY}
+
+def test_different_conversation_history_is_not_shared():
+    sessions = [
+        make_session(),
+        make_session([{"role": "user", "content": "I am in grade 2"},
+                      {"role": "assistant", "content": "Great!"}])
+    ]
+    agent = make_agent()
+    ask_together(agent, sessions)
+
+    assert len(agent.llm_calls) == 2
+    assert agent.llm_in_flight.get_stats()["coalesced"] == 0
+
+class Tracker:
+    def __init__(self):
+        self.interactions = []
+
+    def log_interaction(self, kind, text, response):
+        self.interactions.append((kind, text))
+
+def test_stage_past_its_deadline_gives_its_default(monkeypatch):
+    monkeypatch.setitem(core_agent.STAGE_DEADLINES_MS, "emotion", 50)
+    agent = make_agent()
+    release = threading.Event()
+
+    def stalled():
+        release.wait(5)
+        return {"emotion": "happy"}
+
+    async def scenario():
+        started = time.perf_counter()
+        result = await agent._run_stage("emotion", stalled, None)
+        elapsed = time.perf_counter() - started
+        # Let the abandoned thread finish so the loop can shut down
+        release.set()
+        return result, elapsed
+
+    result, elapsed = asyncio.run(scenario())
+
+    assert result is None
+    assert elapsed < 0.5
+    assert agent.stage_stats["emotion"]["timeouts"] == 1
+    assert agent.stage_stats["emotion"]["runs"] == 1
+
+def test_failing_stage_degrades_to_its_default():
+    agent = make_agent()
+
+    def broken(text):
+        raise RuntimeError("index unavailable")
+
+    result = asyncio.run(agent._run_stage("rag", broken, ([], [], []), "fractions"))
+    assert result == ([], [], [])
+    assert agent.stage_stats["rag"]["runs"] == 1
+    assert agent.stage_stats["rag"]["timeouts"] == 0
+
+def test_reply_arrives_on_time_when_stages_stall_or_fail(monkeypatch):
+    monkeypatch.setitem(core_agent.STAGE_DEADLINES_MS, "emotion", 50)
+    agent = make_agent()
+    release = threading.Event()
+    contexts = []
+
+    def stalled_emotion():
+        release.wait(5)
+        return {"emotion": "happy"}
+
+    def broken_rag(text):
+        raise RuntimeError("index unavailable")
+
+    def build_context(text, emotion_data, knowledge_assessment, progress, rag_docs):
+        contexts.append((emotion_data, rag_docs))
+        return []
+
+    agent._get_current_emotion = stalled_emotion
+    agent._assess_learning_state = lambda session, text: (None, None)
+    agent._enhance_with_rag = broken_rag
+    agent._build_ai_context = build_context
+    session = SimpleNamespace(history=[], tracker=Tracker())
+
+    async def scenario():
+        agent.llm_release = asyncio.Event()
+        agent.llm_release.set()
+        started = time.perf_counter()
+        response = await agent._handle_educational_query(session, "how do I add fractions", {})
+        elapsed = time.perf_counter() - started
+        release.set()
+        return response, elapsed
+
+    response, elapsed = asyncio.run(scenario())
+
+    assert response["answer"]["explanation"] == "Add the numerators."
+    assert elapsed < 0.5
+    # The LLM was asked without the emotion and knowledge base context
+    assert contexts == [(None, [])]
+    assert agent.stage_stats["emotion"]["timeouts"] == 1
+    assert session.tracker.interactions == [("educational", "how do I add fractions")]
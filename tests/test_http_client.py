@@ -0,0 +1,185 @@
+"""
+HTTP Client Tests - Retries, Retry-After, timeouts and SSE parsing against a stub transport
+"""
+
+import json
+import random
+import asyncio
+
+import httpx
+
+from backend.llm.http_client import LLMHttpClient, LLMRequestError, MAX_BACKOFF_SECONDS, _iter_sse_deltas
+
+PAYLOAD = {"model": "stub", "messages": [{"role": "user", "content": "hi"}]}
+
+def completion(text):
+    return {"choices": [{"message": {"content": text}}]}
+
+def sse(*events):
+    return "".join(f"{event}\n\n" for event in events).encode()
+
+def delta(text):
+    return "data: " + json.dumps({"choices": [{"delta": {"content": text}}]})
+
+class Upstream:
+    """
+    Answers each request with the next of the given responses; an exception is raised instead
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def __call__(self, request):
+        response = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+def make_client(upstream, **kwargs):
+    kwargs.setdefault("backoff_base", 0.0)
+    client = LLMHttpClient("http://upstream.test/v1", transport=httpx.MockTransport(upstream), **kwargs)
+    waits = []
+    backoff = client._backoff
+
+    def recording_backoff(attempt, retry_after):
+        waits.append(backoff(attempt, retry_after))
+        return waits[-1]
+
+    client._backoff = recording_backoff
+    return client, waits
+
+def run(coroutine_function):
+    return asyncio.run(coroutine_function())
+
+def expect_error(client_call):
+    async def scenario():
+        try:
+            await client_call()
+        except LLMRequestError as e:
+            return e
+        raise AssertionError("expected LLMRequestError")
+    return run(scenario)
+
+async def collect(client):
+    return [text async for text in client.stream_chat_completion(PAYLOAD)]
+
+def test_server_errors_and_dropped_connections_are_retried():
+    upstream = Upstream(httpx.Response(503), httpx.ConnectError("refused"),
+                        httpx.Response(200, json=completion("ok")))
+    client, waits = make_client(upstream, max_retries=2)
+
+    assert run(lambda: client.chat_completion(PAYLOAD)) == completion("ok")
+    assert upstream.calls == 3
+    assert len(waits) == 2
+
+def test_backoff_is_jittered_and_capped():
+    client = LLMHttpClient("http://upstream.test/v1", backoff_base=1.0)
+    random.seed(7)
+    waits = [client._backoff(3, None) for _ in range(50)]
+
+    # Full jitter: anywhere between nothing and base * 2 ** attempt
+    assert all(0 <= wait <= 8.0 for wait in waits)
+    assert len(set(waits)) > 1
+    assert client._backoff(10, None) <= MAX_BACKOFF_SECONDS
+
+def test_rate_limit_waits_for_retry_after():
+    upstream = Upstream(httpx.Response(429, headers={"Retry-After": "0.05"}),
+                        httpx.Response(200, json=completion("ok")))
+    client, waits = make_client(upstream, backoff_base=5.0)
+
+    assert run(lambda: client.chat_completion(PAYLOAD)) == completion("ok")
+    assert waits == [0.05]
+
+def test_retry_after_is_capped():
+    client = LLMHttpClient("http://upstream.test/v1")
+    assert client._backoff(0, 3600.0) == MAX_BACKOFF_SECONDS
+
+def test_client_errors_are_not_retried():
+    upstream = Upstream(httpx.Response(401))
+    client, waits = make_client(upstream)
+
+    error = expect_error(lambda: client.chat_completion(PAYLOAD))
+    assert error.status_code == 401
+    assert upstream.calls == 1 and waits == []
+
+def test_timeouts_are_retried_then_reported():
+    upstream = Upstream(httpx.ReadTimeout("too slow"))
+    client, waits = make_client(upstream, max_retries=2)
+
+    error = expect_error(lambda: client.chat_completion(PAYLOAD))
+    assert "ReadTimeout" in str(error)
+    assert upstream.calls == 3 and len(waits) == 2
+
+def test_slow_upstream_hits_the_read_timeout():
+    async def stalled(request):
+        await asyncio.sleep(5)
+        return httpx.Response(200, json=completion("late"))
+
+    # MockTransport does not enforce timeouts, so give the stub a server's deadline
+    async def upstream(request):
+        try:
+            return await asyncio.wait_for(stalled(request), request.extensions["timeout"]["read"])
+        except asyncio.TimeoutError:
+            raise httpx.ReadTimeout("no response", request=request)
+
+    client = LLMHttpClient("http://upstream.test/v1", read_timeout=0.05, max_retries=0,
+                           transport=httpx.MockTransport(upstream))
+    error = expect_error(lambda: client.chat_completion(PAYLOAD))
+    assert "ReadTimeout" in str(error)
+
+def test_stream_retries_before_the_first_delta():
+    upstream = Upstream(httpx.Response(502),
+                        httpx.Response(200, content=sse(delta("Hel"), delta("lo"), "data: [DONE]")))
+    client, waits = make_client(upstream)
+
+    assert run(lambda: collect(client)) == ["Hel", "lo"]
+    assert upstream.calls == 2 and len(waits) == 1
+
+def test_stream_is_not_retried_after_the_first_delta():
+    async def broken_body():
+        yield sse(delta("Hel"))
+        raise httpx.ReadError("connection reset")
+
+    upstream = Upstream(httpx.Response(200, content=broken_body()),
+                        httpx.Response(200, content=sse(delta("Hello"), "data: [DONE]")))
+    client, waits = make_client(upstream, max_retries=2)
+    received = []
+
+    async def scenario():
+        async for text in client.stream_chat_completion(PAYLOAD):
+            received.append(text)
+
+    error = expect_error(scenario)
+    assert "ReadError" in str(error)
+    assert received == ["Hel"]
+    assert upstream.calls == 1 and waits == []
+
+def test_sse_skips_comments_and_malformed_chunks_and_stops_at_done():
+    body = (
+        ": keep-alive\n\n"
+        + "data: {not json\n\n"
+        + delta("a") + "\n\n"
+        + 'data: {"choices": [{"delta": {}}]}\n\n'
+        + "event: ping\n\n"
+        + delta("b") + "\n\n"
+        + "data: [DONE]\n\n"
+        + delta("after done") + "\n\n"
+    )
+
+    async def scenario():
+        response = httpx.Response(200, content=body.encode())
+        return [text async for text in _iter_sse_deltas(response)]
+
+    assert run(scenario) == ["a", "b"]
+
+def test_sse_error_event_is_raised():
+    body = sse(delta("a"), 'data: {"error": {"message": "overloaded"}}')
+
+    async def scenario():
+        response = httpx.Response(200, content=body)
+        return [text async for text in _iter_sse_deltas(response)]
+
+    error = expect_error(scenario)
+    assert "overloaded" in str(error)
@@ -0,0 +1,42 @@
+"""
+Hybrid Retrieval Tests - Keyword confidence calibration and score fusion
+"""
+
+import os
+
+from backend.rag.bm25_index import BM25Index, KEYWORD_MAX_CONFIDENCE, keyword_confidences, fuse_relevance
+from backend.rag_system import RELEVANCE_THRESHOLD
+
+UNRELATED_CORPUS = [
+    "Plants make their food from sunlight, water and carbon dioxide in their leaves.",
+    "Clouds form when water vapour cools and condenses into tiny droplets.",
+    "The class trip to the museum ended with a short film about a volcano erupting."
+]
+
+def build_index(tmp_path, texts):
+    index = BM25Index(os.path.join(str(tmp_path), "bm25.json"))
+    for chunk_id, text in enumerate(texts):
+        index.add(chunk_id, text)
+    return index
+
+def test_single_term_keyword_match_alone_is_not_relevant(tmp_path):
+    index = build_index(tmp_path, UNRELATED_CORPUS)
+
+    hits = index.search("volcano", 20)
+    assert [chunk_id for chunk_id, _, _ in hits] == [2]
+    assert hits[0][2] == 1.0
+
+    confidences = keyword_confidences(hits)
+    assert confidences[2] == KEYWORD_MAX_CONFIDENCE
+    assert confidences[2] < RELEVANCE_THRESHOLD
+
+    # The embeddings rate the passage as unrelated to a question about volcanoes
+    for cosine in (0.0, 0.1, 0.2):
+        assert fuse_relevance(cosine, confidences[2]) <= RELEVANCE_THRESHOLD
+
+def test_keyword_match_lifts_a_related_chunk_over_the_threshold():
+    assert fuse_relevance(0.5, 0.0) < RELEVANCE_THRESHOLD
+    assert fuse_relevance(0.5, KEYWORD_MAX_CONFIDENCE) > RELEVANCE_THRESHOLD
+
+def test_fusion_ignores_negative_cosine():
+    assert fuse_relevance(-0.4, 0.3) == fuse_relevance(0.0, 0.3)
@@ -0,0 +1,62 @@
+"""
+Ingestion Job Tests - Queued jobs superseded by a newer upload of the same file
+"""
+
+import asyncio
+import threading
+
+from backend.rag.jobs import IngestionJobQueue
+
+def test_queued_job_is_superseded_and_never_runs():
+    async def scenario():
+        jobs = IngestionJobQueue()
+        jobs.start()
+        release = threading.Event()
+        ran = []
+
+        def blocking(report):
+            release.wait(5)
+            return {"file": "other.pdf"}
+
+        def work(name):
+            def func(report):
+                ran.append(name)
+                report(1, 1)
+                return {"file": name}
+            return func
+
+        running = jobs.submit("upload", "other.pdf", blocking)
+        first = jobs.submit("upload", "notes.pdf", work("first"))
+        await asyncio.sleep(0.05)
+
+        assert running.status == "running"
+        assert jobs.find_active("upload", "notes.pdf") is first
+        assert not jobs.supersede(running.id)
+        assert jobs.supersede(first.id)
+        second = jobs.submit("upload", "notes.pdf", work("second"))
+        assert jobs.find_active("upload", "notes.pdf") is second
+
+        release.set()
+        await asyncio.wait_for(jobs._queue.join(), 5)
+        await jobs.stop()
+        return first, second, ran
+
+    first, second, ran = asyncio.run(scenario())
+    assert first.status == "superseded" and first.finished_at is not None
+    assert second.status == "completed" and second.result == {"file": "second"}
+    assert ran == ["second"]
+
+def test_superseded_jobs_are_trimmed_from_history():
+    async def scenario():
+        jobs = IngestionJobQueue(max_history=1)
+        jobs.start()
+        job = jobs.submit("upload", "a.pdf", lambda report: {})
+        jobs.supersede(job.id)
+        jobs.submit("upload", "a.pdf", lambda report: {})
+        await asyncio.wait_for(jobs._queue.join(), 5)
+        await jobs.stop()
+        return jobs, job
+
+    jobs, job = asyncio.run(scenario())
+    assert jobs.get(job.id) is None
+    assert len(jobs.list()) == 1
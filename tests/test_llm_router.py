@@ -0,0 +1,201 @@
+"""
+LLM Router Tests - Circuit breaker, failover and hedged requests across mock and stub HTTP backends
+"""
+
+import time
+import asyncio
+
+import httpx
+
+from backend.llm.backends import LLMBackend, OpenRouterBackend
+from backend.llm.http_client import LLMHttpClient, LLMRequestError
+from backend.llm.router import (
+    BackendHealth, LLMRouter, MIN_P95_SAMPLES, CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN
+)
+
+class FakeBackend(LLMBackend):
+    def __init__(self, text="ok", delay=0.0, fail=False, degraded=False):
+        self.text = text
+        self.delay = delay
+        self.fail = fail
+        self.degraded = degraded
+        self.calls = 0
+
+    async def complete(self, messages, temperature=0.7, max_tokens=1000):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise LLMRequestError("upstream down")
+        return self.text
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+def complete(router):
+    return asyncio.run(router.complete(MESSAGES))
+
+def test_breaker_opens_after_consecutive_failures():
+    health = BackendHealth(failure_threshold=2, cooldown=60)
+    health.record_failure()
+    assert health.state == CIRCUIT_CLOSED
+    health.record_failure()
+    assert health.state == CIRCUIT_OPEN
+    assert not health.allow_request()
+    assert health.counts["trips"] == 1 and health.counts["rejected"] == 1
+
+def test_breaker_lets_one_trial_through_after_cooldown():
+    health = BackendHealth(failure_threshold=1, cooldown=0)
+    health.record_failure()
+    assert health.allow_request()
+    assert health.state == CIRCUIT_HALF_OPEN
+    assert not health.allow_request()
+
+    health.record_success("complete", 0.1)
+    assert health.state == CIRCUIT_CLOSED
+    assert health.allow_request()
+
+def test_failed_trial_reopens_and_cancelled_trial_frees_the_slot():
+    health = BackendHealth(failure_threshold=1, cooldown=0)
+    health.record_failure()
+    assert health.allow_request()
+    health.cancel_request()
+    assert health.allow_request()
+
+    health.record_failure()
+    assert health.state == CIRCUIT_OPEN
+    assert health.counts["trips"] == 1
+
+def test_failover_to_the_next_backend():
+    primary, secondary = FakeBackend(fail=True), FakeBackend("from secondary")
+    router = LLMRouter([("primary", primary), ("secondary", secondary)], hedge=False)
+
+    assert complete(router) == "from secondary"
+    assert router.stats["failovers"] == 1
+    assert router.members[0].health.counts["failures"] == 1
+
+def test_open_circuit_skips_the_backend():
+    primary, secondary = FakeBackend(fail=True), FakeBackend("from secondary")
+    router = LLMRouter([("primary", primary), ("secondary", secondary)],
+                       hedge=False, failure_threshold=2, cooldown=60)
+
+    for _ in range(3):
+        assert complete(router) == "from secondary"
+    assert primary.calls == 2
+    assert router.members[0].health.state == CIRCUIT_OPEN
+
+def test_every_backend_failing_raises():
+    router = LLMRouter([("a", FakeBackend(fail=True)), ("b", FakeBackend(fail=True))], hedge=False)
+    try:
+        complete(router)
+    except LLMRequestError as e:
+        assert "a: upstream down" in str(e) and "b: upstream down" in str(e)
+    else:
+        raise AssertionError("expected LLMRequestError")
+    assert router.stats["exhausted"] == 1
+
+def test_slow_backend_is_hedged_and_loser_cancelled():
+    primary, secondary = FakeBackend("slow", delay=5.0), FakeBackend("fast")
+    router = LLMRouter([("primary", primary), ("secondary", secondary)],
+                       hedge_default=0.05, hedge_min=0.01)
+
+    assert complete(router) == "fast"
+    assert router.stats["hedged"] == 1 and router.stats["hedge_wins"] == 1
+    assert router.members[0].health.counts["cancelled"] == 1
+    assert router.members[0].health.counts["failures"] == 0
+
+def test_degraded_backend_is_not_hedged_to():
+    primary, mock = FakeBackend("real", delay=0.2), FakeBackend("canned", degraded=True)
+    router = LLMRouter([("primary", primary), ("mock", mock)], hedge_default=0.01, hedge_min=0.01)
+
+    assert complete(router) == "real"
+    assert mock.calls == 0
+    assert router.stats["hedged"] == 0
+
+def test_reply_is_degraded_when_the_mock_answers():
+    router = LLMRouter([("primary", FakeBackend(fail=True)),
+                        ("mock", FakeBackend('{"explanation": "canned"}', degraded=True))], hedge=False)
+
+    reply = asyncio.run(router.reply(MESSAGES))
+    assert reply.degraded
+    assert reply.parsed == {"explanation": "canned"}
+
+def test_stream_fails_over_before_the_first_delta():
+    router = LLMRouter([("primary", FakeBackend(fail=True)),
+                        ("secondary", FakeBackend('{"explanation": "streamed"}'))], hedge=False)
+    deltas = []
+
+    async def on_delta(text):
+        deltas.append(text)
+
+    reply = asyncio.run(router.reply(MESSAGES, on_delta=on_delta))
+    assert "".join(deltas) == "streamed"
+    assert not reply.degraded and reply.parsed["explanation"] == "streamed"
+
+class StubEndpoint:
+    """
+    An OpenAI-compatible upstream served through httpx.MockTransport
+    """
+
+    def __init__(self, text, delay=0.0, status=200):
+        self.text = text
+        self.delay = delay
+        self.status = status
+        self.calls = 0
+
+    async def __call__(self, request):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.status != 200:
+            return httpx.Response(self.status)
+        return httpx.Response(200, json={"choices": [{"message": {"content": self.text}}]})
+
+    def backend(self):
+        client = LLMHttpClient("http://upstream.test/v1", max_retries=0,
+                               transport=httpx.MockTransport(self))
+        return OpenRouterBackend(client, model="stub", requires_key=False)
+
+def test_http_backend_past_its_p95_is_hedged():
+    primary, secondary = StubEndpoint("primary"), StubEndpoint("secondary")
+    # The default delay is far too long to hedge within the test; only the p95 can
+    router = LLMRouter([("primary", primary.backend()), ("secondary", secondary.backend())],
+                       hedge_default=30.0, hedge_min=0.02)
+
+    async def scenario():
+        for _ in range(MIN_P95_SAMPLES):
+            assert await router.complete(MESSAGES) == "primary"
+        assert router.members[0].health.p95("complete") < 0.02
+
+        primary.delay = 5.0
+        started = time.perf_counter()
+        text = await router.complete(MESSAGES)
+        elapsed = time.perf_counter() - started
+        await router.close()
+        return text, elapsed
+
+    text, elapsed = asyncio.run(scenario())
+    assert text == "secondary"
+    assert elapsed < 1.0
+    assert router.stats["hedged"] == 1 and router.stats["hedge_wins"] == 1
+    assert router.members[0].health.counts["cancelled"] == 1
+
+def test_failing_http_backend_opens_the_circuit_and_recovers():
+    primary, secondary = StubEndpoint("primary", status=503), StubEndpoint("secondary")
+    router = LLMRouter([("primary", primary.backend()), ("secondary", secondary.backend())],
+                       hedge=False, failure_threshold=2, cooldown=0.1)
+
+    async def scenario():
+        for _ in range(3):
+            assert await router.complete(MESSAGES) == "secondary"
+        assert primary.calls == 2
+        assert router.members[0].health.state == CIRCUIT_OPEN
+
+        # After the cooldown one trial request reaches the recovered upstream
+        primary.status = 200
+        await asyncio.sleep(0.15)
+        text = await router.complete(MESSAGES)
+        await router.close()
+        return text
+
+    assert asyncio.run(scenario()) == "primary"
+    assert primary.calls == 3
+    assert router.members[0].health.state == CIRCUIT_CLOSED
+    assert router.members[0].health.counts["trips"] == 1
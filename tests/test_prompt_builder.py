@@ -0,0 +1,78 @@
+"""
+Prompt Builder Tests - Filling the token budget in priority order
+"""
+
+import pytest
+
+from backend.llm.prompt_builder import (
+    MESSAGE_OVERHEAD_TOKENS, MIN_TRUNCATED_TOKENS, TRUNCATION_MARK, PromptBuilder
+)
+
+def count_words(text):
+    return len(text.split())
+
+def words(prefix, count):
+    return " ".join(f"{prefix}{i}" for i in range(count))
+
+def builder(budget, history=6):
+    return PromptBuilder(count_words, budget_tokens=budget, max_history_entries=history)
+
+def entry(role, count, prefix):
+    return {"role": role, "content": words(prefix, count)}
+
+def test_everything_fits_in_a_large_budget():
+    messages, usage = builder(1000).build("system", "question", ["passage"], [entry("user", 3, "h")], ["context"])
+
+    assert messages[0] == {"role": "system", "content": "system\ncontext"}
+    assert messages[1]["content"] == "h0 h1 h2"
+    assert "passage" in messages[-1]["content"] and messages[-1]["content"].endswith("question")
+    assert not usage.truncated and not usage.dropped
+    assert usage.total <= usage.budget
+
+def test_question_is_cut_to_the_budget():
+    question = words("q", 200)
+    budget = 100
+    messages, usage = builder(budget).build("sys", question, [], [], [])
+
+    assert usage.truncated == ["question"]
+    assert messages[-1]["content"].endswith(TRUNCATION_MARK)
+    assert usage.total <= budget
+
+def test_system_prompt_that_fills_the_budget_raises():
+    with pytest.raises(ValueError):
+        builder(MIN_TRUNCATED_TOKENS).build(words("s", MIN_TRUNCATED_TOKENS), "question", [], [], [])
+
+def test_history_is_newest_first_without_gaps():
+    history = [entry("user", 40, "old"), entry("assistant", 5, "mid"), entry("user", 5, "new")]
+    fixed = 2 * MESSAGE_OVERHEAD_TOKENS + 2
+    budget = fixed + 2 * (5 + MESSAGE_OVERHEAD_TOKENS)
+    messages, usage = builder(budget).build("sys", "question", [], history, [])
+
+    assert [m["content"] for m in messages[1:-1]] == [history[1]["content"], history[2]["content"]]
+    assert usage.dropped == {"history": 1}
+    assert usage.total == budget
+
+def test_passages_past_the_budget_are_dropped_and_context_skipped():
+    passages = [words("a", 80), words("b", 80)]
+    messages, usage = builder(120).build("sys", "question", passages, [], [words("c", 200), "short"])
+
+    user = messages[-1]["content"]
+    assert "a0" in user and "b0" not in user
+    assert usage.dropped["rag"] == 1
+    assert usage.dropped["context"] == 1
+    assert messages[0]["content"] == "sys\nshort"
+    assert usage.total <= 120
+
+def test_same_inputs_give_the_same_prompt():
+    args = ("sys", words("q", 80), [words("p", 60)], [entry("user", 30, "h")], ["ctx"])
+    assert builder(90).build(*args)[0] == builder(90).build(*args)[0]
+
+def test_line_breaks_between_many_small_parts_stay_in_budget():
+    budget = 200
+    builder_by_chars = PromptBuilder(len, budget_tokens=budget)
+    messages, usage = builder_by_chars.build("sys", "q", ["p"] * 300, [], ["c"] * 300)
+
+    sent = sum(len(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+    assert usage.dropped["rag"] > 0
+    assert sent <= budget
+    assert usage.total == sent
@@ -0,0 +1,51 @@
+"""
+Response Cache Tests - Context fingerprints and semantic lookup of LLM replies
+"""
+
+import numpy as np
+
+from backend.llm.response_cache import SemanticResponseCache, context_fingerprint
+
+VECTORS = {
+    "what is a fraction": [1.0, 0.0, 0.0],
+    "what's a fraction": [0.99, 0.141, 0.0],
+    "how do volcanoes erupt": [0.0, 0.0, 1.0]
+}
+
+def embed(text):
+    vector = np.asarray(VECTORS[text], dtype="float32")
+    return vector / np.linalg.norm(vector)
+
+def test_fingerprint_is_stable_and_tracks_every_part():
+    first = context_fingerprint(topic="fractions", level=2, documents=["a.pdf"])
+    assert first == context_fingerprint(documents=["a.pdf"], level=2, topic="fractions")
+    assert first != context_fingerprint(topic="fractions", level=3, documents=["a.pdf"])
+    assert first != context_fingerprint(topic="fractions", level=2, documents=["b.pdf"])
+
+def test_exact_hit_ignores_case_and_punctuation_but_not_context():
+    cache = SemanticResponseCache(embed)
+    cache.store("What is a fraction?", "ctx-a", "answer")
+
+    assert cache.lookup("what is a  FRACTION", "ctx-a") == "answer"
+    assert cache.lookup("what is a fraction", "ctx-b") is None
+    assert cache.stats["exact_hits"] == 1 and cache.stats["misses"] == 1
+
+def test_semantic_hit_only_above_the_threshold():
+    cache = SemanticResponseCache(embed, similarity_threshold=0.95)
+    cache.store("what is a fraction", "ctx", "answer")
+
+    assert cache.lookup("what's a fraction", "ctx") == "answer"
+    assert cache.lookup("how do volcanoes erupt", "ctx") is None
+    assert cache.stats["semantic_hits"] == 1
+
+def test_expired_and_evicted_entries_miss():
+    expired = SemanticResponseCache(embed, ttl_seconds=-1)
+    expired.store("what is a fraction", "ctx", "answer")
+    assert expired.lookup("what is a fraction", "ctx") is None
+    assert expired.stats["expired"] == 1
+
+    bounded = SemanticResponseCache(embed, max_entries=1)
+    bounded.store("what is a fraction", "ctx", "first")
+    bounded.store("how do volcanoes erupt", "ctx", "second")
+    assert bounded.lookup("what is a fraction", "ctx") is None
+    assert bounded.get_stats()["size"] == 1 and bounded.stats["evictions"] == 1
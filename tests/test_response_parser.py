@@ -0,0 +1,56 @@
+"""
+Response Parser Tests - Finding, repairing and streaming the tutor's JSON reply
+"""
+
+from backend.llm.response_parser import TutorResponseParser, parse_tutor_response
+
+def stream(text, size=1):
+    parser = TutorResponseParser()
+    streamed = "".join(parser.feed(text[i:i + size]) for i in range(0, len(text), size))
+    return parser, streamed
+
+def test_plain_object():
+    assert parse_tutor_response('{"explanation": "x", "scene": []}') == {"explanation": "x", "scene": []}
+
+def test_trailing_comma_keeps_the_outer_object():
+    reply = '{"explanation": "x", "final_answer": {"correct_value": "5"},}'
+    assert parse_tutor_response(reply) == {"explanation": "x", "final_answer": {"correct_value": "5"}}
+
+def test_broken_outer_object_is_cut_not_replaced_by_a_nested_one():
+    reply = '{"explanation": "x", "final_answer": {"correct_value": "5"} oops "y": 1}'
+    assert parse_tutor_response(reply) == {"explanation": "x"}
+
+def test_nested_object_without_explanation_is_not_the_reply():
+    assert parse_tutor_response('{"a" 1, "final_answer": {"correct_value": "5"}}') is None
+
+def test_raw_newline_inside_a_string():
+    assert parse_tutor_response('{"explanation": "line1\nline2"}') == {"explanation": "line1\nline2"}
+
+def test_braces_in_a_preamble_are_skipped():
+    assert parse_tutor_response('{ok} then {"explanation": "y"}') == {"explanation": "y"}
+
+def test_truncated_reply_is_repaired():
+    assert parse_tutor_response('```json\n{"explanation": "cut off here') == {"explanation": "cut off here"}
+    assert parse_tutor_response('{"explanation": "done", "scene": [{"ty') == {"explanation": "done"}
+
+def test_only_the_top_level_explanation_streams():
+    reply = '{"final_answer": {"explanation": "nested"}, "explanation": "Top \\u00e9 level"}'
+    parser, streamed = stream(reply)
+    assert streamed == "Top é level"
+    assert parser.result()["final_answer"] == {"explanation": "nested"}
+
+def test_preamble_is_not_part_of_the_explanation():
+    reply = 'Sure! Here you go:\n```json\n{"explanation": "hi", "scene": []}\n```'
+    assert parse_tutor_response(reply) == {"explanation": "hi", "scene": []}
+
+def test_prose_stops_streaming_once_the_object_opens():
+    reply = 'Sure thing!\n{"explanation": "Two plus two is four.", "scene": []}'
+    for size in (1, 7, len(reply)):
+        parser, streamed = stream(reply, size)
+        assert streamed == "Sure thing!\nTwo plus two is four."
+        assert parser.result()["explanation"] == "Two plus two is four."
+
+def test_reply_without_json_streams_as_prose():
+    parser, streamed = stream("Just plain text.", 3)
+    assert streamed == "Just plain text."
+    assert parser.result() is None
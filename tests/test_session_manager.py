@@ -0,0 +1,117 @@
+"""
+Session Manager Tests - Eviction of student sessions to disk and their restore
+"""
+
+import os
+import asyncio
+import threading
+
+from backend.learning_tracker import LearningTracker
+from backend.session_manager import SessionManager
+
+def manager(tmp_path, **options):
+    data_dir = str(tmp_path)
+    return SessionManager(LearningTracker(data_dir=data_dir), data_dir=data_dir, **options)
+
+def evicted_files(sessions):
+    return sorted(os.listdir(sessions.evicted_dir))
+
+def test_least_recently_used_session_is_evicted_and_restored(tmp_path):
+    sessions = manager(tmp_path, max_active=1)
+    sessions.get("alice").history.append({"role": "user", "content": "What is 1/2?"})
+    sessions.get("bob")
+
+    assert list(sessions.sessions) == ["bob"]
+    assert evicted_files(sessions) == ["alice.json.gz"]
+
+    restored = sessions.get("alice")
+    assert list(restored.history) == [{"role": "user", "content": "What is 1/2?"}]
+    assert "alice.json.gz" not in evicted_files(sessions)
+    assert sessions.get_stats()["restored"] == 1
+
+def test_sessions_in_use_are_not_evicted(tmp_path):
+    sessions = manager(tmp_path, max_active=1)
+    with sessions.use("alice") as alice:
+        sessions.get("bob")
+        sessions.get("carol")
+        assert "alice" in sessions.sessions
+        assert sessions.get_stats()["in_use"] == 1
+    assert alice.in_use == 0
+
+def test_idle_sessions_are_evicted(tmp_path):
+    sessions = manager(tmp_path, idle_timeout=0)
+    sessions.get("alice")
+    sessions.get("bob")
+
+    assert "alice" not in sessions.sessions
+    assert sessions.stats["evicted_idle"] == 1
+
+def test_unreadable_session_file_is_kept_aside(tmp_path):
+    sessions = manager(tmp_path)
+    path = os.path.join(sessions.evicted_dir, "alice.json.gz")
+    with open(path, "wb") as f:
+        f.write(b"not gzip")
+
+    assert list(sessions.get("alice").history) == []
+    assert os.path.exists(path + ".failed")
+    assert sessions.stats["created"] == 1
+
+def test_find_does_not_create_unknown_students(tmp_path):
+    sessions = manager(tmp_path)
+    assert sessions.find("nobody") is None
+    sessions.get("alice")
+    sessions.save_all()
+    assert sessions.find("alice") is not None
+
+def test_distinct_client_ids_get_distinct_sessions(tmp_path):
+    sessions = manager(tmp_path)
+    sessions.get("a.b").history.append({"role": "user", "content": "Hi"})
+
+    assert list(sessions.get("a b").history) == []
+    assert sessions.get("../alice").session_id.startswith("h.")
+    assert sessions.get("alice").session_id == "alice"
+
+def test_only_requests_without_an_id_share_the_default_session(tmp_path):
+    sessions = manager(tmp_path)
+    assert sessions.get(None) is sessions.default
+    assert sessions.get("") is sessions.default
+    assert sessions.get("default") is not sessions.default
+
+def test_concurrent_requests_load_a_session_once(tmp_path):
+    sessions = manager(tmp_path)
+    started = threading.Event()
+    release = threading.Event()
+    real_load = sessions._load
+
+    def slow_load(session_id, create):
+        if session_id == "alice":
+            started.set()
+            release.wait(5)
+        return real_load(session_id, create)
+
+    sessions._load = slow_load
+    results = []
+    loader = threading.Thread(target=lambda: results.append(sessions.get("alice")))
+    loader.start()
+    assert started.wait(5)
+
+    # Other students are not held up while alice is loading
+    assert sessions.get("bob").session_id == "bob"
+    waiter = threading.Thread(target=lambda: results.append(sessions.get("alice")))
+    waiter.start()
+    release.set()
+    loader.join(5)
+    waiter.join(5)
+
+    assert len(results) == 2 and results[0] is results[1]
+    assert sessions.stats["created"] == 2
+
+def test_use_async_pins_the_session(tmp_path):
+    sessions = manager(tmp_path)
+
+    async def run():
+        async with sessions.use_async("alice") as alice:
+            assert alice.in_use == 1
+        return alice
+
+    assert asyncio.run(run()).in_use == 0
@@ -0,0 +1,129 @@
+"""
+Single Flight Tests - One backend call per key, shared results and fanned-out deltas
+"""
+
+import asyncio
+
+from backend.llm import single_flight
+from backend.llm.single_flight import SingleFlight
+
+class Call:
+    """
+    A backend call that emits the given deltas, then waits to be released before returning
+    """
+
+    def __init__(self, deltas=(), result="answer"):
+        self.deltas = list(deltas)
+        self.result = result
+        self.calls = 0
+        self.streamed = asyncio.Event()
+        self.release = asyncio.Event()
+        self.finished = False
+
+    async def __call__(self, emit):
+        self.calls += 1
+        for text in self.deltas:
+            await emit(text)
+            await asyncio.sleep(0)
+        self.streamed.set()
+        await self.release.wait()
+        self.finished = True
+        return self.result
+
+class Collector:
+    def __init__(self):
+        self.deltas = []
+
+    async def __call__(self, text):
+        self.deltas.append(text)
+
+def test_concurrent_identical_keys_share_one_call():
+    flights = SingleFlight()
+
+    async def scenario():
+        call = Call()
+        callers = [asyncio.ensure_future(flights.run("key", call)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        call.release.set()
+        return call, await asyncio.gather(*callers)
+
+    call, outcomes = asyncio.run(scenario())
+    assert call.calls == 1
+    assert [result for result, _ in outcomes] == ["answer"] * 3
+    assert [leader for _, leader in outcomes] == [True, False, False]
+    assert flights.get_stats() == {"calls": 1, "coalesced": 2, "dropped_listeners": 0, "in_flight": 0}
+
+def test_late_joiner_first_receives_the_text_so_far():
+    flights = SingleFlight()
+    leader, joiner = Collector(), Collector()
+
+    async def scenario():
+        call = Call(["Two ", "plus ", "two"])
+        first = asyncio.ensure_future(flights.run("key", call, leader))
+        await call.streamed.wait()
+        second = asyncio.ensure_future(flights.run("key", call, joiner))
+        await asyncio.sleep(0.01)
+        call.release.set()
+        return await asyncio.gather(first, second)
+
+    outcomes = asyncio.run(scenario())
+    assert [result for result, _ in outcomes] == ["answer", "answer"]
+    assert leader.deltas == ["Two ", "plus ", "two"]
+    assert joiner.deltas == ["Two plus two"]
+
+def test_slow_listener_is_dropped_without_stalling_the_others(monkeypatch):
+    monkeypatch.setattr(single_flight, "LISTENER_QUEUE_SIZE", 2)
+    flights = SingleFlight()
+    fast = Collector()
+    deltas = [f"{i} " for i in range(10)]
+
+    async def scenario():
+        stuck = asyncio.Event()
+
+        async def slow(text):
+            await stuck.wait()
+
+        call = Call(deltas)
+        call.release.set()
+        callers = [flights.run("key", call, slow), flights.run("key", call, fast)]
+        return await asyncio.wait_for(asyncio.gather(*callers), 1.0)
+
+    outcomes = asyncio.run(scenario())
+    assert [result for result, _ in outcomes] == ["answer", "answer"]
+    assert fast.deltas == deltas
+    assert flights.get_stats()["dropped_listeners"] == 1
+
+def test_cancelling_the_leader_does_not_cancel_the_shared_call():
+    flights = SingleFlight()
+
+    async def scenario():
+        call = Call()
+        first = asyncio.ensure_future(flights.run("key", call))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flights.run("key", call))
+        await asyncio.sleep(0.01)
+
+        # The leader's WebSocket goes away
+        first.cancel()
+        call.release.set()
+        result = await second
+        return call, first, result
+
+    call, first, result = asyncio.run(scenario())
+    assert first.cancelled()
+    assert result == ("answer", False)
+    assert call.finished and call.calls == 1
+
+def test_different_keys_are_not_coalesced():
+    flights = SingleFlight()
+
+    async def scenario():
+        call = Call()
+        callers = [asyncio.ensure_future(flights.run(key, call)) for key in ("a", "b")]
+        await asyncio.sleep(0.01)
+        call.release.set()
+        return call, await asyncio.gather(*callers)
+
+    call, outcomes = asyncio.run(scenario())
+    assert call.calls == 2
+    assert [leader for _, leader in outcomes] == [True, True]
@@ -0,0 +1,120 @@
+"""
+Vector Index Tests - Reopening, tombstoned removal and compaction for every index type
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from backend.rag.vector_index import INDEX_TYPES, IndexConfig, VectorIndex
+
+DIMENSION = 16
+COUNT = 400
+
+# Small enough for the test corpus to train IVF lists and PQ codebooks;
+# nprobe covers every list so the IVF types search exhaustively
+CONFIG = dict(nlist=4, pq_m=4, pq_nbits=4, nprobe=4, hnsw_m=16, ef_construction=64, ef_search=128)
+
+def make_vectors():
+    vectors = np.random.default_rng(0).standard_normal((COUNT, DIMENSION)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def build_index(tmp_path, index_type):
+    vectors = make_vectors()
+    config = IndexConfig(index_type=index_type, **CONFIG)
+    index = VectorIndex(os.path.join(str(tmp_path), "index.faiss"), DIMENSION, config)
+    index.build(vectors, np.arange(COUNT), config)
+    assert index.index_type == index_type
+    return index, vectors
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_reopened_index_searches_like_the_one_saved(tmp_path, index_type):
+    index, vectors = build_index(tmp_path, index_type)
+    scores, ids = index.search(vectors[:20], 5)
+
+    reopened = VectorIndex(index.index_path, DIMENSION, IndexConfig(index_type=index_type, **CONFIG))
+    assert reopened.index_type == index_type
+    assert reopened.ntotal == COUNT
+
+    reopened_scores, reopened_ids = reopened.search(vectors[:20], 5)
+    assert (reopened_ids == ids).all()
+    assert np.allclose(reopened_scores, scores)
+
+    # The reopened lists take new vectors in place
+    reopened.add(vectors[:1], [COUNT])
+    assert reopened.ntotal == COUNT + 1
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_removed_ids_never_come_back_from_search(tmp_path, index_type):
+    index, vectors = build_index(tmp_path, index_type)
+    removed = list(range(0, COUNT, 2))
+
+    assert index.remove(removed) == len(removed)
+    assert index.remove(removed[:5]) == 0
+    assert index.live_count == COUNT - len(removed)
+
+    _, ids = index.search(vectors[:20], 10)
+    assert not set(ids.ravel().tolist()) & set(removed)
+    # Over-fetching keeps k live hits per query despite the tombstones
+    assert (ids >= 0).all()
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_compact_drops_tombstoned_vectors_and_keeps_survivors_results(tmp_path, index_type):
+    index, vectors = build_index(tmp_path, index_type)
+    removed = list(range(0, COUNT, 3))
+    survivors = [vector_id for vector_id in range(COUNT) if vector_id % 3]
+    index.remove(removed)
+    old_data_path = index.data_path
+    scores_before, ids_before = index.search(vectors[survivors[:50]], 5)
+
+    assert index.compact() == len(removed)
+    assert index.ntotal == len(survivors)
+    assert index.tombstones == set()
+    assert index.index_type == index_type
+
+    scores_after, ids_after = index.search(vectors[survivors[:50]], 5)
+    if index_type == "hnsw":
+        # The graph is rebuilt, so only the nearest neighbour is certain to match
+        assert (ids_after[:, 0] == ids_before[:, 0]).all()
+    else:
+        # IVF lists are copied code for code, so searches are unchanged
+        assert (ids_after == ids_before).all()
+        assert np.allclose(scores_after, scores_before)
+
+    if old_data_path is not None:
+        # The compacted lists live in a new data file that replaced the old one
+        assert index.data_path != old_data_path
+        assert not os.path.exists(old_data_path)
+
+    reopened = VectorIndex(index.index_path, DIMENSION, IndexConfig(index_type=index_type, **CONFIG))
+    assert reopened.ntotal == len(survivors)
+    assert (reopened.search(vectors[survivors[:50]], 5)[1] == ids_after).all()
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_removal_during_compaction_keeps_its_tombstone(tmp_path, index_type):
+    index, vectors = build_index(tmp_path, index_type)
+    index.remove([0, 1, 2])
+    late_id = 10
+
+    # Remove an id while compaction is copying the index, after it took its
+    # snapshot of the tombstones
+    step = "build" if index_type == "hnsw" else "_copy_without"
+    original = getattr(index, step)
+
+    def copy_with_concurrent_removal(*args, **kwargs):
+        assert index.remove([late_id]) == 1
+        return original(*args, **kwargs)
+
+    setattr(index, step, copy_with_concurrent_removal)
+    assert index.compact() == 3
+    delattr(index, step)
+
+    assert index.tombstones == {late_id}
+    assert index.ntotal == COUNT - 3
+    _, ids = index.search(vectors[late_id], 5)
+    assert late_id not in ids.ravel().tolist()
+
+    # The next compaction drops it for good
+    assert index.compact() == 1
+    assert index.ntotal == COUNT - 4